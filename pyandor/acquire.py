@@ -0,0 +1,206 @@
+"""Headless acquisition
+
+Acquires frames from an Andor camera straight to a recording on disk,
+without Qt or any display, for unattended runs and scripted
+experiments. For example, to record 60 s at 5 ms exposure with 2x2
+binning::
+
+    python -m pyandor.acquire run.zraw --exposure 5 --bins 2 --duration 60
+
+Recordings ending in ``.zraw`` are compressed, anything else is saved
+raw (see :mod:`pyandor.andor.recording`). Acquisition stops after the
+given number of frames or duration, or on Ctrl-C. The exit status is
+non-zero if the recording could not be written.
+
+"""
+
+from __future__ import print_function, division
+import argparse
+import logging
+import signal
+import sys
+import threading
+import time
+
+from pyandor.andor import AndorCamera, AndorError
+from pyandor.andor.counters import tag_frame
+from pyandor.andor.latency import timings
+from pyandor.andor.log import logger, setup_logging
+from pyandor.andor.recording import ChunkedRecorder, RawRecorder, \
+    camera_settings
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+# Longest time in s to wait for an image before checking whether to stop.
+WAIT_TIMEOUT = 0.5
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pyandor.acquire',
+        description='Acquire frames from an Andor camera to disk.')
+    parser.add_argument('output', help='recording to write (.raw or .zraw)')
+    parser.add_argument('-e', '--exposure', type=float, default=16.,
+                        help='exposure time in ms (default: 16)')
+    parser.add_argument('--roi', type=int, nargs=4,
+                        metavar=('X0', 'X1', 'Y0', 'Y1'),
+                        help='region of interest, 1-based and inclusive '
+                             '(default: full sensor)')
+    parser.add_argument('-b', '--bins', type=int, default=1,
+                        help='binning (default: 1)')
+    parser.add_argument('-t', '--trigger', default='internal',
+                        choices=sorted(AndorCamera._trigger_modes),
+                        help='trigger mode (default: internal)')
+    parser.add_argument('--bit-depth', type=int, default=16,
+                        choices=sorted(AndorCamera._pixel_types),
+                        help='pixel depth to read images with (default: 16)')
+    parser.add_argument('-n', '--frames', type=int,
+                        help='number of frames to acquire')
+    parser.add_argument('-d', '--duration', type=float,
+                        help='time to acquire for in s')
+    parser.add_argument('--no-wait-for-temp', dest='wait_for_temp',
+                        action='store_false',
+                        help="don't wait for the sensor to cool")
+    parser.add_argument('--sdk', metavar='PATH',
+                        help='Andor SDK library to load (default: found '
+                             'for the platform, or $ANDOR_SDK_PATH)')
+    parser.add_argument('--simulate', action='store_true',
+                        help='use a simulated camera')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='log debugging information')
+    return parser.parse_args(argv)
+
+
+def open_camera(args):
+    """Connect to and configure the camera."""
+    kwargs = {'bit_depth': args.bit_depth,
+              'wait_for_temp': args.wait_for_temp,
+              'sdk_path': args.sdk}
+    if args.simulate:
+        from pyandor.andor.simulated import SimulatedAndorSDK
+        kwargs['clib'] = SimulatedAndorSDK()
+    cam = AndorCamera(**kwargs)
+    cam.reconfigure(roi=args.roi and list(args.roi), bins=args.bins,
+                    exposure=args.exposure, trigger=args.trigger)
+    return cam
+
+
+def acquire(cam, recorder, frames=None, duration=None, report=5.,
+            stop=None):
+    """Stream frames from the camera into a recorder until done.
+
+    Every new image in the camera's buffer is read, in order, so no
+    frames are skipped as long as the recorder keeps up. Images read
+    together are timestamped back from the time they were read, one
+    kinetic cycle apart, since the SDK gives no time for each image.
+
+    Parameters
+    ----------
+    frames : int or None
+        Stop after this many frames.
+    duration : float or None
+        Stop after this many seconds.
+    report : float
+        Interval in s between progress messages.
+    stop : threading.Event or None
+        Stop once this is set, e.g. from a signal handler. It is
+        checked at least every :data:`WAIT_TIMEOUT` s, even if no
+        images arrive.
+
+    Returns
+    -------
+    int
+        Number of frames acquired.
+
+    """
+    if stop is None:
+        stop = threading.Event()
+    cycle = cam.get_exposure_time()[2]
+    count = 0
+    start = last_report = _monotonic()
+    cam.start()
+    try:
+        while (frames is None or count < frames) and not stop.is_set():
+            now = _monotonic()
+            if duration is not None and now - start >= duration:
+                break
+            if now - last_report >= report:
+                stats = recorder.writer.stats()
+                logger.info('%i frames, %.1f fps, %.1f MB/s to disk, '
+                            '%i queued, %i dropped' % (
+                                count, count/(now - start),
+                                stats['mb_per_s'], stats['depth'],
+                                cam.counters.dropped))
+                last_report = now
+
+            if not cam.wait_for_acquisition(WAIT_TIMEOUT):
+                continue
+            images, first = cam.drain_images()
+            if images is None:
+                continue
+            t_first = time.time() - cycle*(len(images) - 1)
+            if frames is not None:
+                images = images[:frames - count]
+            for i, img in enumerate(images):
+                recorder.write(tag_frame(img, first + i), t_first + cycle*i)
+            count += len(images)
+    except KeyboardInterrupt:
+        logger.info('Interrupted.')
+    finally:
+        cam.stop()
+    elapsed = _monotonic() - start
+    logger.info('Acquired %i frames in %.1f s (%.1f fps), %i dropped.' %
+                (count, elapsed, count/elapsed if elapsed else 0,
+                 cam.counters.dropped))
+    logger.debug('Stage latencies:\n' + timings.format())
+    return count
+
+
+def _stop_on_interrupt():
+    """Make Ctrl-C set an event instead of raising KeyboardInterrupt,
+    so that acquisition stops cleanly between frames.
+
+    """
+    stop = threading.Event()
+
+    def handler(signum, frame):
+        if not stop.is_set():
+            logger.info('Interrupted.')
+        stop.set()
+    signal.signal(signal.SIGINT, handler)
+    return stop
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging(logger, logging.DEBUG if args.verbose else logging.INFO)
+
+    try:
+        cam = open_camera(args)
+    except AndorError as e:
+        logger.error('Could not connect to camera: ' + str(e))
+        return 1
+
+    try:
+        recorder_class = ChunkedRecorder if args.output.endswith('.zraw') \
+            else RawRecorder
+        recorder = recorder_class(args.output, cam.frame_pool.shape,
+                                  cam.get_dtype(),
+                                  settings=camera_settings(cam))
+        previous = signal.getsignal(signal.SIGINT)
+        try:
+            acquire(cam, recorder, args.frames, args.duration,
+                    stop=_stop_on_interrupt())
+        finally:
+            signal.signal(signal.SIGINT, previous)
+            recorder.close()
+    finally:
+        cam.close()
+    if recorder.error is not None:
+        logger.error('Recording failed: ' + str(recorder.error))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
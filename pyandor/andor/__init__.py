@@ -8,26 +8,44 @@ bugs.
 """
 
 from __future__ import print_function, division
-from os.path import abspath
+import logging
+import threading
 import time
 import traceback as tb
 import ctypes
 import numpy as np
 
 from .camera import Camera, CameraError
-from .log import logger
+from .counters import FrameCounters, tag_frame
+from .framepool import FramePool
+from .latency import tick, timings
+from .log import RateLimiter, logger
+from .sdk import AndorSDK, OutParams, SDKLoadError, default_init_dir, \
+    load_library
 from .andor_status_codes import *
 from .andor_capabilities import *
 
-
-def _int_ptr(val=0):
-    """Utility function to create integer pointers."""
-    return ctypes.pointer(ctypes.c_int(val))
-
-
-def _uint_ptr(val=0):
-    """Utility function to create unsigned integer pointers."""
-    return ctypes.pointer(ctypes.c_uint(val))
+_SUCCESS = ANDOR_STATUS['DRV_SUCCESS']
+_ACQUIRING = ANDOR_STATUS['DRV_ACQUIRING']
+_IDLE = ANDOR_STATUS['DRV_IDLE']
+_NO_NEW_DATA = ANDOR_STATUS['DRV_NO_NEW_DATA']
+# GetImages statuses for start and end indices outside the buffer
+_OUT_OF_RANGE = (ANDOR_STATUS['DRV_P1INVALID'], ANDOR_STATUS['DRV_P2INVALID'])
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+# Non-fatal status codes: None to ignore the code, or a warning to log.
+# Any other code other than success is an error.
+_STATUS_WARNINGS = {
+    ANDOR_STATUS['DRV_TEMPERATURE_OFF']: None,
+    ANDOR_STATUS['DRV_TEMPERATURE_STABILIZED']: None,
+    ANDOR_STATUS['DRV_TEMPERATURE_NOT_REACHED']:
+        "Temperature set point not yet reached.",
+    ANDOR_STATUS['DRV_TEMPERATURE_DRIFT']: "Temperature is drifting.",
+    ANDOR_STATUS['DRV_TEMP_NOT_STABILIZED']:
+        "Temperature set point reached but not yet stable.",
+    _IDLE: "Function call resulted in DRV_IDLE.",
+}
 
 
 class AndorError(CameraError):
@@ -66,6 +84,16 @@ class AndorCamera(Camera):
         "external exposure": 7,
         "software": 10}
 
+    # Pixel types for reading images: bit depth -> (ctypes type, suffix
+    # of the SDK functions which read that type). The SDK's 32-bit
+    # functions use at_32, which is always 4 bytes wide.
+    _pixel_types = {
+        16: (ctypes.c_uint16, '16'),
+        32: (ctypes.c_int32, '')}
+
+    # Minimum time in s between repeats of the same status warning.
+    _warning_interval = 30.
+
     def _chk(self, status):
         """Checks the error status of an Andor DLL function call. If
         something catastrophic happened, an AndorError exception is
@@ -84,30 +112,47 @@ class AndorCamera(Camera):
             something stupid.
 
         """
-        if status == ANDOR_STATUS['DRV_ACQUIRING']:
-            logger.warn(
-                "Action not completed when data acquisition is in progress!")
-            logger.debug(''.join(tb.format_list(tb.extract_stack())))
-            raise AndorAcqInProgress
-        elif status == ANDOR_STATUS['DRV_TEMPERATURE_OFF']:
-            pass
-        elif status == ANDOR_STATUS['DRV_TEMPERATURE_NOT_REACHED']:
-            logger.warn("Temperature set point not yet reached.")
-        elif status == ANDOR_STATUS['DRV_TEMPERATURE_DRIFT']:
-            logger.warn("Temperature is drifting.")
-        elif status == ANDOR_STATUS['DRV_TEMP_NOT_STABILIZED']:
-            logger.warn(
-                "Temperature set point reached but not yet stable.")
-        elif status == ANDOR_STATUS['DRV_TEMPERATURE_STABILIZED']:
-            pass
-        elif status == ANDOR_STATUS['DRV_IDLE']:
-            stack = tb.extract_stack()
-            logger.warn(
-                'Function call resulted in DRV_IDLE.\n' +
-                ''.join(tb.format_list(stack)))
-        elif status != ANDOR_STATUS['DRV_SUCCESS']:
+        if status != _SUCCESS:
+            self._check_status(status)
+
+    def _check_status(self, status):
+        """Handle a status other than success, as listed in
+        ``_STATUS_WARNINGS``. Repeats of a warning are rate limited,
+        and the call stack is only logged when debugging.
+
+        """
+        try:
+            message = _STATUS_WARNINGS[status]
+        except KeyError:
+            if status == _ACQUIRING:
+                logger.warn(
+                    "Action not completed when data acquisition is in "
+                    "progress!")
+                self._log_stack()
+                raise AndorAcqInProgress
             raise AndorError("Andor returned the status message " +
-                             ANDOR_CODES[status])
+                             ANDOR_CODES.get(status, str(status)))
+        if message is None:
+            return
+
+        limiter = self.__dict__.get('_warning_limiter')
+        if limiter is None:
+            limiter = self._warning_limiter = \
+                RateLimiter(self._warning_interval)
+        suppressed = limiter.allow(status)
+        if suppressed is None:
+            return
+        if suppressed:
+            message += ' (repeated %i times)' % suppressed
+        logger.warn(message)
+        if status == _IDLE:
+            self._log_stack()
+
+    @staticmethod
+    def _log_stack():
+        """Log where an SDK call was made from, if debugging."""
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(''.join(tb.format_list(tb.extract_stack()[:-2])))
 
     # Setup and shutdown
     # -------------------------------------------------------------------------
@@ -120,30 +165,64 @@ class AndorCamera(Camera):
         use_noise_filter : bool
             When True, use the "median" post-processing noise filter
             provided by the Andor SDK.
+        bit_depth : int
+            Read images as 16-bit (uint16) or 32-bit (int32) data.
+            Defaults to 32. Accumulate mode and the noise filter always
+            use 32-bit data.
         wait_for_temp : bool
             When False, don't wait for the temperature to reach -20
             before shutting off. Andor recommends waiting, but for
             quicker debugging, it is useful to not wait to rerun a
             program. Defaults to True.
+        clib : object
+            Library object to use instead of loading the Andor SDK,
+            e.g. a :class:`simulated.SimulatedAndorSDK`.
+        sdk_path : str
+            Path of the SDK library to load. By default the library
+            for the platform is found by :func:`sdk.load_library`.
+        init_dir : str
+            Directory of the SDK's detector configuration files.
+            Defaults to /usr/local/etc/andor on Linux and the working
+            directory elsewhere.
+
+        The library's functions are bound through :class:`sdk.AndorSDK`,
+        which declares their ctypes prototypes.
 
         """
 
-        # Try to load the Andor DLL
-        # TODO: library name in Linux?
-        # clib_path = abspath(r'..\..\atmcd32d.dll')
-        clib_path = abspath(r'..\..\atmcd64d.dll')
-        self.clib = ctypes.WinDLL(clib_path)
+        # Load the Andor SDK unless a backend was given
+        if kwargs.get('clib') is not None:
+            lib = kwargs['clib']
+        else:
+            try:
+                lib = load_library(kwargs.get('sdk_path'))
+            except SDKLoadError as e:
+                raise AndorError(str(e))
+        self.clib = AndorSDK(lib)
+        self._out = OutParams()
+
+        # Held while reading from the circular buffer, which may
+        # happen from the acquisition thread and readers at once
+        self.lock = threading.Lock()
 
         # Initialize the camera and get the detector size
-        # TODO: directory to Initialize?
-        self._chk(self.clib.Initialize("."))
-        xpx, ypx = _int_ptr(), _int_ptr()
-        self._chk(self.clib.GetDetector(xpx, ypx))
-        self.shape = [xpx.contents.value, ypx.contents.value]
-        # self._chk(self.clib.SetReadMode(4)) # image read mode
-        self.set_roi([1, self.shape[0], 1, self.shape[1]])
-        self.set_bins(1)
+        init_dir = kwargs.get('init_dir') or default_init_dir()
+        self._chk(self.clib.Initialize(init_dir.encode()))
+        xpx, ypx = ctypes.c_int(), ctypes.c_int()
+        self._chk(self.clib.GetDetector(ctypes.byref(xpx), ctypes.byref(ypx)))
+        self.shape = [xpx.value, ypx.value]
+        self.frame_pool = None
+        self.burst_pool = None
+        self.counters = FrameCounters()
+        self._trigger_pending = False
+        self.burst_size = kwargs.get('burst_size', 16)
         self.use_noise_filter = kwargs.get('use_noise_filter', False)
+        self.bit_depth = kwargs.get('bit_depth', 32)
+        if self.bit_depth not in self._pixel_types:
+            raise AndorError("bit_depth must be one of " +
+                             repr(sorted(self._pixel_types)))
+        # self._chk(self.clib.SetReadMode(4)) # image read mode
+        self._set_image([1, self.shape[0], 1, self.shape[1]], 1)
         self.wait_for_temp = kwargs.get('wait_for_temp', True)
 
         # Set default acquisition and trigger modes
@@ -152,7 +231,7 @@ class AndorCamera(Camera):
 
         # Set maximum preamp gain
         gains = ctypes.c_int()
-        self._chk(self.clib.GetNumberPreAmpGains(ctypes.pointer(gains)))
+        self._chk(self.clib.GetNumberPreAmpGains(ctypes.byref(gains)))
         self._chk(self.clib.SetPreAmpGain(gains.value - 1))
 
         # Enable EM gain mode
@@ -160,7 +239,7 @@ class AndorCamera(Camera):
         self._chk(self.clib.SetEMGainMode(0))
         gmin, gmax = ctypes.c_int(), ctypes.c_int()
         self._chk(self.clib.GetEMGainRange(
-            ctypes.pointer(gmin), ctypes.pointer(gmax)))
+            ctypes.byref(gmin), ctypes.byref(gmax)))
         logger.debug(
             "EM gain range = [%i, %i]" % (gmin.value, gmax.value))
         # self._chk(self.clib.SetFrameTransferMode(ctypes.c_int(1)))
@@ -174,12 +253,12 @@ class AndorCamera(Camera):
         # Get generic camera-specific properties.
         caps = AndorCapabilities()
         caps.ulSize = 12*32
-        self._chk(self.clib.GetCapabilities(ctypes.pointer(caps)))
+        self._chk(self.clib.GetCapabilities(ctypes.byref(caps)))
 
         # Get cooler temperature range and initial set point.
         min_, max_ = ctypes.c_int(), ctypes.c_int()
         self._chk(self.clib.GetTemperatureRange(
-            ctypes.pointer(min_), ctypes.pointer(max_)))
+            ctypes.byref(min_), ctypes.byref(max_)))
         self.temperature_set_point = self.props['init_set_point']
         self.set_cooler_temperature(self.temperature_set_point)
         self.temp_stabilized = False
@@ -234,75 +313,252 @@ class AndorCamera(Camera):
                 "Acquisition mode must be one of " + repr(self._acq_modes))
         self.acq_mode = mode
         logger.info('Setting acquisition mode to ' + mode)
-        self._chk(self.clib.SetAcquisitionMode(
-            ctypes.c_int(self._acq_modes[mode])))
+        self._chk(self.clib.SetAcquisitionMode(self._acq_modes[mode]))
 
         # Have 0 kinetic cycle time for continuous acquisition mode
         if mode == 'continuous':
             self._chk(self.clib.SetKineticCycleTime(0))
 
-    def acquire_image_data(self):
+        # Accumulated images may overflow 16 bits
+        self._update_frame_pool()
+
+    def set_bit_depth(self, bit_depth):
+        """Set whether images are read as 16 or 32-bit data."""
+        if bit_depth not in self._pixel_types:
+            raise AndorError("bit_depth must be one of " +
+                             repr(sorted(self._pixel_types)))
+        self.bit_depth = bit_depth
+        self._update_frame_pool()
+
+    def get_dtype(self):
+        """Get the numpy data type of acquired images."""
+        return np.dtype(self._pixel_types[self.get_pixel_depth()][0])
+
+    def get_pixel_depth(self):
+        """Get the bit depth images are actually read with. This is
+        always 32 in accumulate mode or when using the noise filter.
+
+        """
+        if self.acq_mode == 'accumulate' or self.use_noise_filter:
+            return 32
+        return self.bit_depth
+
+    def _update_frame_pool(self):
+        """Rebuild the frame pool if the image geometry or pixel type
+        has changed. Frames already handed out from an old pool remain
+        valid.
+
+        """
+        shape = (self.shape[0]//self.bins, self.shape[1]//self.bins)
+        ctype, suffix = self._pixel_types[self.get_pixel_depth()]
+        self._get_images = getattr(self.clib, 'GetImages' + suffix)
+        key = (shape, ctype)
+        if self.frame_pool is None or self.frame_pool.key != key:
+            logger.debug('Allocating frame pool for shape %s, %s' %
+                         (repr(shape), ctype.__name__))
+            self.frame_pool = FramePool(shape, ctype)
+            self.burst_pool = None
+            self._filter_buffer = None
+
+    def wait_for_acquisition(self, timeout=None):
+        """Send a software trigger if needed, then block until a new
+        image has been acquired.
+
+        Parameters
+        ----------
+        timeout : float or None
+            Maximum time to wait in s, or None to wait indefinitely.
+            The wait also ends early if :meth:`cancel_wait` is called
+            from another thread.
+
+        Returns
+        -------
+        bool
+            True if a new image was acquired, False if the wait timed
+            out or was cancelled. A software trigger is only sent again
+            once the previous one has produced an image.
+
+        Raises
+        ------
+        AndorError
+            If the driver reports anything other than a new image, a
+            timeout or a cancelled wait.
+
+        """
+        start = tick()
+        if self.trigger_mode == self._trigger_modes['software'] and \
+                not self._trigger_pending:
+            self._chk(self.clib.SendSoftwareTrigger())
+            self._trigger_pending = True
+        if timeout is None:
+            status = self.clib.WaitForAcquisition()
+        else:
+            status = self.clib.WaitForAcquisitionTimeOut(int(timeout*1000))
+        timings.record('wait', start)
+        if status == _SUCCESS:
+            self._trigger_pending = False
+            return True
+        # Timeouts and CancelWait both end the wait with no new data
+        if status == _NO_NEW_DATA:
+            return False
+        self._chk(status)
+        return False
+
+    def cancel_wait(self):
+        """Wake a thread blocked in :meth:`wait_for_acquisition`."""
+        self._chk(self.clib.CancelWait())
+
+    def acquire_image_data(self, wait=True):
         """Acquire the most recent image data from the camera. This
-        will work best in single image acquisition mode.
+        will work best in single image acquisition mode. Unless wait is
+        False, this first triggers or waits for a new image.
+
+        The returned array is borrowed from :attr:`frame_pool` and is
+        recycled once it is no longer referenced. It is tagged with the
+        SDK index of the image (see :mod:`counters`); the image is read
+        by that index, so a new image arriving meanwhile cannot be
+        mistaken for it.
 
         """
         # TODO: Check that acquisition was actually started, or not in progress!
 
-        # Allocate image storage
-        img_size = self.shape[0]*self.shape[1]//self.bins**2
-        c_array = ctypes.c_long*img_size
-        c_img = c_array()
+        pool = self.frame_pool
+        start = tick()
+        img_array, c_img = pool.acquire()
+        timings.record('frame', start)
 
         # Trigger or wait for a trigger then acquire data
-        if self.trigger_mode == self._trigger_modes['software']:
-            self._chk(self.clib.SendSoftwareTrigger())
-        self.clib.WaitForAcquisition()
+        if wait:
+            self.wait_for_acquisition()
 
-        self._chk(self.clib.GetMostRecentImage(
-            ctypes.pointer(c_img),
-            ctypes.c_ulong(img_size)
-        ))
+        # Apply noise filter if requested. The raw image goes to a
+        # scratch buffer and the filtered result into the pool buffer.
+        if self.use_noise_filter:
+            if self._filter_buffer is None:
+                self._filter_buffer = (pool.ctype*pool.size)()
+            c_raw = self._filter_buffer
+        else:
+            c_raw = c_img
+
+        start = tick()
+        params = self._out
+        with self.lock:
+            status = self.clib.GetTotalNumberImagesAcquired(params.first_ref)
+            index = params.first.value
+            if status == _SUCCESS:
+                status = _NO_NEW_DATA if index < 1 else self._get_images(
+                    index, index, c_raw, pool.size,
+                    params.first_ref, params.last_ref)
+        self._chk(status)
+        timings.record('copy', start)
 
-        # Apply noise filter if requested.
         if self.use_noise_filter:
-            c_img_filtered = c_array()
+            start = tick()
             self._chk(self.clib.PostProcessNoiseFilter(
-                ctypes.pointer(c_img), ctypes.pointer(c_img_filtered),
-                ctypes.sizeof(c_img), 0, 1, 0,
+                c_raw, c_img, ctypes.sizeof(c_img), 0, 1, 0,
                 self.shape[0], self.shape[1]))
-            c_img = c_img_filtered
+            timings.record('filter', start)
 
-        # Pythonize and return.
-        img_array = np.frombuffer(c_img, dtype=ctypes.c_long)
-        img_array.shape = np.array(self.shape)//self.bins
-        return img_array
+        self.counters.deliver(index)
+        return tag_frame(img_array, index)
 
-    def acquire_images(self, first, last):
+    def acquire_images(self, first, last, out=None):
         """Acquire the specified images from the image buffer.
 
+        Parameters
+        ----------
+        first, last : int
+            Indices of the first and last images to retrieve.
+        out : np.ndarray or None
+            Optional preallocated array of shape (N, height, width)
+            with N >= last - first + 1 to read the images into. When
+            None, a new array is allocated.
+
+        Returns
+        -------
+        img_array : np.ndarray
+            The retrieved images as an (N, height, width) array. Only
+            images the driver reports as valid are included, so images
+            which have been overwritten are left out.
+        valid_first, valid_last : int
+            Indices of the first and last valid images.
+
         """
-        # Allocate image storage
-        size = (last-first+1)
-        buffer_size = self.shape[0]*self.shape[1]//self.bins**2*size
-        c_array = ctypes.c_long*buffer_size
-        img_buffer = c_array()
-
-        self._chk(self.clib.GetImages(
-            first,
-            last,
-            ctypes.pointer(img_buffer),
-            ctypes.c_ulong(buffer_size),
-            ctypes.pointer(ctypes.c_long(first)),
-            ctypes.pointer(ctypes.c_long(last))
-        ))
-
-        img_array = np.frombuffer(img_buffer, dtype=ctypes.c_long)
-        return img_array, size, self.shape, self.bins
-
-        # # Pythonize and return.
-        # img_array = np.frombuffer(img_buffer, dtype=ctypes.c_long)
-        # img_array.shape = np.array(self.shape)//self.bins
-        # return img_array
+        requested = first, last
+        size = last - first + 1
+        shape = self.frame_pool.shape
+        if out is None:
+            out = np.empty((size,) + shape, dtype=self.frame_pool.dtype)
+        elif out.shape[0] < size or out.shape[1:] != shape:
+            raise AndorError('Output array is too small for images %i-%i' %
+                             (first, last))
+        c_out = out.ctypes.data_as(ctypes.POINTER(self.frame_pool.ctype))
+
+        start = tick()
+        params = self._out
+        while True:
+            with self.lock:
+                status = self._get_images(
+                    first, last, c_out, (last - first + 1)*self.frame_pool.size,
+                    params.first_ref, params.last_ref)
+            if status not in _OUT_OF_RANGE:
+                break
+            # Some of the images have been overwritten, or were never
+            # acquired: read those still in the buffer instead.
+            oldest, newest = self.get_num_available_images()
+            available = max(first, oldest), min(last, newest)
+            if available == (first, last):
+                break
+            first, last = available
+            if last < first:
+                status = _NO_NEW_DATA
+                break
+        valid_first, valid_last = params.first, params.last
+        timings.record('copy', start)
+        if status == _NO_NEW_DATA:
+            return out[:0], first, first - 1
+        self._chk(status)
+
+        if (valid_first.value, valid_last.value) != requested:
+            logger.debug('Requested images %i-%i, got %i-%i' % (
+                requested + (valid_first.value, valid_last.value)))
+        n_valid = max(0, valid_last.value - valid_first.value + 1)
+        return out[:n_valid], valid_first.value, valid_last.value
+
+    def acquire_new_images(self):
+        """Retrieve all images which have not yet been read from the
+        circular buffer with a single GetImages call.
+
+        At most :attr:`burst_size` images are read at once; call again
+        to retrieve any remainder. The images are read into a block
+        borrowed from :attr:`burst_pool` which is recycled once it is
+        no longer referenced.
+
+        Returns
+        -------
+        img_array : np.ndarray or None
+            The new images as an (N, height, width) array in
+            acquisition order, or None if there are no new images.
+        first : int
+            Index of the first returned image.
+
+        """
+        first, newest = self.get_num_new_images()
+        if newest < first:
+            return None, first
+        last = min(newest, first + self.burst_size - 1)
+
+        if self.burst_pool is None:
+            self.burst_pool = FramePool(
+                (self.burst_size,) + self.frame_pool.shape,
+                self.frame_pool.ctype, slots=2)
+        block, _ = self.burst_pool.acquire()
+        img_array, first, last = self.acquire_images(first, last, out=block)
+        # Images past the burst stay in the buffer for the next call
+        if len(img_array):
+            self.counters.deliver(first, len(img_array),
+                                  pending=max(0, newest - last))
+        return img_array, first
 
     # Triggering
     # -------------------------------------------------------------------------
@@ -326,7 +582,7 @@ class AndorCamera(Camera):
         try:
             mode = mode.lower()
         except AttributeError:
-            mode = {v: k for k, v in self._trigger_modes.iteritems()}[mode]
+            mode = {v: k for k, v in self._trigger_modes.items()}[mode]
 
         if mode not in self._trigger_modes:
             raise AndorError("Invalid trigger mode: " + mode)
@@ -341,6 +597,8 @@ class AndorCamera(Camera):
         """Start accepting triggers."""
         logger.info('Calling StartAcquisition()')
         self._chk(self.clib.StartAcquisition())
+        self._trigger_pending = False
+        self.counters.start()
 
     def stop(self):
         """Stop acquisition."""
@@ -348,6 +606,69 @@ class AndorCamera(Camera):
         status = self.clib.AbortAcquisition()
         if status != ANDOR_STATUS['DRV_IDLE']:
             self._chk(status)
+            self.counters.update_acquired(self.get_total_images_acquired())
+
+    def get_status(self):
+        """Get the SDK status, e.g. DRV_IDLE or DRV_ACQUIRING."""
+        out = self._out
+        self._chk(self.clib.GetStatus(out.int_ref))
+        return out.int.value
+
+    def wait_for_idle(self, timeout=1.):
+        """Block until the camera reports that it is idle, e.g. after
+        stopping acquisition.
+
+        Raises
+        ------
+        AndorError
+            If the camera is still busy after timeout s.
+
+        """
+        deadline = _monotonic() + timeout
+        while self.get_status() != _IDLE:
+            if _monotonic() > deadline:
+                raise AndorError(
+                    "Camera still busy after %.1f s" % timeout)
+            time.sleep(0.001)
+
+    def reconfigure(self, roi=None, bins=None, exposure=None, trigger=None):
+        """Change several acquisition settings at once.
+
+        If the camera is acquiring, acquisition is stopped once, the
+        settings are applied as soon as the camera reports that it is
+        idle, and acquisition is then restarted. The ROI and binning
+        are applied with a single SetImage call, and the frame pool is
+        resized to match.
+
+        Parameters
+        ----------
+        roi : list or None
+            [x0, x1, y0, y1], 1-based and inclusive.
+        bins : int or None
+            Binning to use.
+        exposure : float or None
+            Exposure time in ms.
+        trigger : str or None
+            Trigger mode, as for :meth:`set_trigger_mode`.
+
+        Settings left as None are not changed.
+
+        """
+        acquiring = self.get_status() == _ACQUIRING
+        if acquiring:
+            self.stop()
+            self.wait_for_idle()
+        try:
+            if roi is not None or bins is not None:
+                self._set_image(self.roi if roi is None else roi,
+                                self.bins if bins is None else bins)
+            if trigger is not None:
+                self.set_trigger_mode(trigger)
+            if exposure is not None:
+                self.set_exposure_time(exposure)
+        finally:
+            if acquiring:
+                self.start()
 
     # Shutter control
     # -------------------------------------------------------------------------
@@ -368,50 +689,71 @@ class AndorCamera(Camera):
         self.t_ms = t
         t_s = self.t_ms/1000.
         logger.info('Setting exposure time to %.03f s.' % t_s)
-        self._chk(self.clib.SetExposureTime(ctypes.c_float(t_s)))
-
-        exposure = ctypes.c_float()
-        accumulate = ctypes.c_float()
-        kinetic = ctypes.c_float()
-        self.clib.GetAcquisitionTimings(
-            ctypes.pointer(exposure),
-            ctypes.pointer(accumulate),
-            ctypes.pointer(kinetic))
+        self._chk(self.clib.SetExposureTime(t_s))
+
+        exposure, accumulate, kinetic = self.get_exposure_time()
         logger.debug(
             'Results of GetAcquisitionTimings:\n' +
-            '\texposure = %.03f\n' % (exposure.value * 1000) +
-            '\taccumulate = %.03f\n' % accumulate.value +
-            '\tkinetic = %.03f' % kinetic.value)
+            '\texposure = %.03f\n' % (exposure * 1000) +
+            '\taccumulate = %.03f\n' % accumulate +
+            '\tkinetic = %.03f' % kinetic)
 
-        return exposure.value, accumulate.value, kinetic.value
+        return exposure, accumulate, kinetic
 
     def get_exposure_time(self):
+        """Get the actual exposure, accumulate and kinetic cycle
+        times in s.
 
-        exposure = ctypes.c_float()
-        accumulate = ctypes.c_float()
-        kinetic = ctypes.c_float()
+        """
+        params = self._out
+        self.clib.GetAcquisitionTimings(*params.timings_refs)
+        return (params.exposure.value, params.accumulate.value,
+                params.kinetic.value)
 
-        self.clib.GetAcquisitionTimings(
-            ctypes.pointer(exposure),
-            ctypes.pointer(accumulate),
-            ctypes.pointer(kinetic))
+    def get_num_available_images(self):
+        """Get the range of images in the camera's circular buffer.
+        If there are none, last < first.
 
-        return exposure.value, accumulate.value, kinetic.value
+        """
+        params = self._out
+        with self.lock:
+            status = self.clib.GetNumberAvailableImages(
+                params.first_ref, params.last_ref)
+        if status == ANDOR_STATUS['DRV_NO_NEW_DATA']:
+            return 0, -1
+        self._chk(status)
+        return params.first.value, params.last.value
+
+    def get_total_images_acquired(self):
+        """Get the number of images acquired since the acquisition
+        was started, which is also the index of the latest image.
 
-    def get_num_available_images(self):
         """
-        Gets the number of images in the camera's 48mb circular buffer
-        :return: unsigned int
+        params = self._out
+        with self.lock:
+            status = self.clib.GetTotalNumberImagesAcquired(params.first_ref)
+        self._chk(status)
+        return params.first.value
+
+    def get_num_new_images(self):
+        """Get the range of images in the circular buffer which have
+        not yet been retrieved. If there are none, last < first.
+
         """
-        a, b =_uint_ptr(), _uint_ptr()
-        self._chk(self.clib.GetNumberAvailableImages(a, b))
-        return a.contents.value, b.contents.value
+        params = self._out
+        with self.lock:
+            status = self.clib.GetNumberNewImages(
+                params.first_ref, params.last_ref)
+        if status == ANDOR_STATUS['DRV_NO_NEW_DATA']:
+            return 0, -1
+        self._chk(status)
+        return params.first.value, params.last.value
 
     def get_gain(self):
         """Query the current gain settings."""
-        gain = _int_ptr()
-        self._chk(self.clib.GetEMCCDGain(gain))
-        return gain.contents.value
+        params = self._out
+        self._chk(self.clib.GetEMCCDGain(params.int_ref))
+        return params.int.value
 
     def set_gain(self, gain, **kwargs):
         """Set the camera gain and mode.
@@ -428,7 +770,7 @@ class AndorCamera(Camera):
         """
         assert 0 <= gain <= 255
         logger.info("Setting gain to %i." % gain)
-        result = self.clib.SetEMCCDGain(ctypes.c_int(gain))
+        result = self.clib.SetEMCCDGain(gain)
         if result in (ANDOR_STATUS['DRV_SUCCESS'], ANDOR_STATUS['DRV_P1INVALID']):
             self.gain = gain
         elif result == ANDOR_STATUS['DRV_P1INVALID']:
@@ -454,8 +796,8 @@ class AndorCamera(Camera):
 
     def get_cooler_temperature(self):
         """Check the TEC temperature."""
-        temp = _int_ptr()
-        status = self.clib.GetTemperature(temp)
+        params = self._out
+        status = self.clib.GetTemperature(params.int_ref)
         unstable_codes = (
             ANDOR_STATUS['DRV_TEMPERATURE_OFF'],
             ANDOR_STATUS['DRV_TEMPERATURE_NOT_REACHED'],
@@ -468,7 +810,7 @@ class AndorCamera(Camera):
             self.temp_stabilized = False
         else:
             self._chk(status)
-        return temp.contents.value
+        return params.int.value
 
     def set_cooler_temperature(self, temp):
         """Set the cooler temperature to temp."""
@@ -505,6 +847,7 @@ class AndorCamera(Camera):
                                      self.crop[1],
                                      self.crop[2],
                                      self.crop[3]))
+        self._update_frame_pool()
 
         # self._chk(self.clib.SetIsolatedCropMode(int(on),
         #                                         self.bins,
@@ -518,31 +861,23 @@ class AndorCamera(Camera):
         from. Using a reduced sensor area typically allows for faster
         readout.
         """
-        self.roi = roi
-
-        logger.info('Updating roi to: ' +
-                    ', '.join([str(x) for x in self.roi]))
-
-        # SetImage is inclusive on both ends, so size is diff + 1
-        self.shape = [self.roi[1] - self.roi[0] + 1,
-                      self.roi[3] - self.roi[2] + 1]
-
-        self._chk(self.clib.SetImage(self.bins,
-                                     self.bins,
-                                     self.roi[0],
-                                     self.roi[1],
-                                     self.roi[2],
-                                     self.roi[3]))
+        self._set_image(roi, self.bins)
 
     def set_bins(self, bins):
         """Set binning to bins x bins."""
-        self.bins = bins
+        self._set_image(self.roi, bins)
 
-        logger.info('Updating bins to: {}'.format(self.bins))
+    def _set_image(self, roi, bins):
+        """Apply an ROI and binning with a single SetImage call."""
+        logger.info('Updating roi to: {} with bins: {}'.format(
+            ', '.join([str(x) for x in roi]), bins))
 
-        self._chk(self.clib.SetImage(self.bins,
-                                     self.bins,
-                                     self.roi[0],
-                                     self.roi[1],
-                                     self.roi[2],
-                                     self.roi[3]))
+        self._chk(self.clib.SetImage(bins, bins,
+                                     roi[0], roi[1], roi[2], roi[3]))
+        self.roi = list(roi)
+        self.bins = bins
+
+        # SetImage is inclusive on both ends, so size is diff + 1
+        self.shape = [self.roi[1] - self.roi[0] + 1,
+                      self.roi[3] - self.roi[2] + 1]
+        self._update_frame_pool()
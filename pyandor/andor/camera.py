@@ -6,9 +6,11 @@ all subsequent cameras should be based on.
 """
 
 from __future__ import print_function, division
+import os.path
+import numpy as np
 import numpy.random as npr
 from .log import logger
-# from .ringbuffer import RingBuffer
+from .ringbuffer import RingBuffer
 from .camprops import CameraProperties
 # from .exceptions import CameraError
 
@@ -35,6 +37,9 @@ class Camera(object):
         Number of pixels (x, y)
     bins : int
         Bin size to use.
+    burst_size : int
+        Maximum number of images retrieved by one call to
+        :meth:`drain_images`.
     crop : list
         Crop specifications. Should be of the form::
             [horiz start, horiz end, vert start, vert end]
@@ -72,6 +77,12 @@ class Camera(object):
         buffer_dir : str
             Directory to store the ring buffer file to. Default:
             '.'.
+        recording : bool
+            Save every frame acquired with :meth:`get_image` or
+            :meth:`drain_images` to a disk-backed ring buffer.
+            Default: False.
+        buffer_frames : int
+            Number of frames kept in the ring buffer. Default: 100.
         log_level : int
             Logging level to use. Default: ``logging.INFO``.
 
@@ -82,6 +93,7 @@ class Camera(object):
         self.gain = 0
         self.shape = (512, 512)
         self.bins = 1
+        self.burst_size = 16
         self.crop = (1, self.shape[0], 1, self.shape[1])
         self.shutter_open = False
         self.cooler_active = False
@@ -94,7 +106,8 @@ class Camera(object):
         # Get kwargs and set defaults
         bins = kwargs.get('bins', 1)
         buffer_dir = kwargs.get('buffer_dir', '.')
-        recording = kwargs.get('recording', True)
+        recording = kwargs.get('recording', False)
+        buffer_frames = kwargs.get('buffer_frames', 100)
 
         # Check kwarg types are correct
         assert isinstance(bins, int)
@@ -104,19 +117,24 @@ class Camera(object):
         logger.info("Connecting to camera")
 
         # Initialize
-        try:
-            # self.rbuffer = RingBuffer(
-            #     directory=buffer_dir, recording=recording, roi=self.roi)
-            raise ValueError
-        except ValueError:
-            # logger.warn('Error opening the ring buffer. This is expected with a remote camera server.')
-            self.rbuffer = None
         x0 = npr.randint(self.shape[0]/4, self.shape[0]/2)
         y0 = npr.randint(self.shape[1]/4, self.shape[1]/2)
         self.sim_img_center = (x0, y0)
         self.initialize(**kwargs)
         self.get_camera_properties()
 
+        # The ring buffer is sized for full frames, so it can only be
+        # created once the sensor size is known.
+        if recording:
+            try:
+                self.rbuffer = RingBuffer(
+                    directory=buffer_dir, recording=recording, roi=self.roi,
+                    slots=buffer_frames, shape=tuple(self.shape),
+                    dtype=self.get_dtype())
+            except (IOError, OSError):
+                logger.warn('Error opening the ring buffer.')
+                self.rbuffer = None
+
     def initialize(self, **kwargs):
         """Any extra initialization required should be placed in this
         function for child camera classes.
@@ -153,13 +171,82 @@ class Camera(object):
         """Get num of available images."""
         raise NotImplementedError
 
-    def get_image(self):
-        """Acquire the current image from the camera.
+    def wait_for_acquisition(self, timeout=None):
+        """Code for triggering if necessary and waiting for the next
+        image to be acquired should be placed here. This must return
+        True if a new image was acquired, or False if no image arrived
+        within timeout s (None to wait indefinitely) or the wait was
+        cancelled.
+
+        """
+        raise NotImplementedError
+
+    def cancel_wait(self):
+        """Wake a thread blocked in :meth:`wait_for_acquisition`, if
+        the camera supports it.
+
         """
-        img = self.acquire_image_data()
+        pass
+
+    def get_dtype(self):
+        """Get the numpy data type of acquired images."""
+        return np.dtype(np.uint16)
+
+    def get_image(self, wait=True):
+        """Acquire the current image from the camera, saving it to
+        the ring buffer if recording. When wait is False, the most
+        recent image is read without triggering or waiting for a new
+        one, e.g. after :meth:`wait_for_acquisition`.
+
+        """
+        img = self.acquire_image_data(wait=wait)
+        self._save_to_rbuffer(img)
         return img
 
-    def acquire_image_data(self):
+    def drain_images(self):
+        """Retrieve all images acquired since the last call, saving
+        them to the ring buffer if recording. This function should
+        *not* be overwritten by child classes; override
+        :meth:`acquire_new_images` instead.
+
+        Returns
+        -------
+        img_array : np.ndarray or None
+            The new images as an (N, height, width) array, or None if
+            there are none.
+        first : int
+            Index of the first image.
+
+        """
+        images, first = self.acquire_new_images()
+        if images is not None and self.rbuffer is not None:
+            for img in images:
+                self._save_to_rbuffer(img)
+        return images, first
+
+    def _save_to_rbuffer(self, img):
+        """Write a frame to the ring buffer, if recording."""
+        if self.rbuffer is None:
+            return
+        if img.dtype != self.rbuffer.dtype:
+            self._recreate_rbuffer(img.dtype)
+        self.rbuffer.write(img, roi=self.roi, bins=self.bins)
+
+    def _recreate_rbuffer(self, dtype):
+        """Replace the ring buffer with an empty one of the same size
+        for a new pixel type, e.g. after the bit depth changed.
+
+        """
+        old = self.rbuffer
+        old.close()
+        directory, filename = os.path.split(old.path)
+        logger.info('Recreating the ring buffer for %s data' % dtype)
+        self.rbuffer = RingBuffer(
+            directory=directory, recording=old.recording, roi=self.roi,
+            slots=old.slots, shape=old.shape, dtype=dtype,
+            filename=filename)
+
+    def acquire_image_data(self, wait=True):
         """Code for getting image data from the camera should be
         placed here. This must return a numpy array.
         """
@@ -173,16 +260,24 @@ class Camera(object):
         :meth:`acquire_image_data` method.
 
         """
-        buffer, size = self.acquire_images()
-        return buffer, size
+        return self.acquire_images(first, last)
 
-    def acquire_images(self, first, last):
+    def acquire_images(self, first, last, out=None):
         """Code for getting image data from the camera should be
         placed here. This must return a numpy array.
 
         """
         raise NotImplementedError
 
+    def acquire_new_images(self):
+        """Code for retrieving all images acquired since the last call
+        should be placed here. This must return an (N, height, width)
+        numpy array (or None if no images are available) and the index
+        of the first image.
+
+        """
+        raise NotImplementedError
+
     def get_trigger_mode(self):
         """Query the current trigger mode."""
         raise NotImplementedError
@@ -354,3 +449,18 @@ class Camera(object):
     def set_bins(self, bins):
         """Set binning to bins x bins."""
         logger.debug("set_bins not implemented.")
+
+    def reconfigure(self, roi=None, bins=None, exposure=None, trigger=None):
+        """Change several settings at once. Settings left as None are
+        not changed. By default each is set in turn; child classes
+        should override this to stop and restart acquisition only once.
+
+        """
+        if roi is not None:
+            self.set_roi(roi)
+        if bins is not None:
+            self.set_bins(bins)
+        if trigger is not None:
+            self.set_trigger_mode(trigger)
+        if exposure is not None:
+            self.set_exposure_time(exposure)
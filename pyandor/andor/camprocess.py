@@ -0,0 +1,502 @@
+"""Acquisition in a separate process
+
+Running the camera in the GUI process means acquisition competes with
+rendering for the GIL. :class:`CameraProcess` instead runs the camera
+in a dedicated worker process which writes frames into a
+:class:`SharedFrameRing`. Any number of readers, in any process, can
+attach to the ring by name and view frames without copying them.
+
+Each slot of the ring carries the sequence number of the frame in it.
+The writer invalidates a slot before overwriting it, so a reader can
+check that a frame was not overwritten while it was being used by
+calling :meth:`SharedFrameRing.valid` afterwards.
+
+Requires Python 3.8 or newer for ``multiprocessing.shared_memory``.
+
+"""
+
+from __future__ import print_function, division
+import multiprocessing
+import time
+import numpy as np
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None
+
+from .camera import CameraError
+from .counters import image_index
+from .log import logger
+
+_MAGIC = 0x414e444f52  # 'ANDOR'
+
+# Ring header fields
+_H_MAGIC, _H_SLOTS, _H_XPX, _H_YPX, _H_ITEMSIZE, _H_KIND, _H_LATEST = \
+    range(7)
+_HEADER_LEN = 8
+
+# Per-slot fields
+_S_SEQ, _S_XPX, _S_YPX, _S_TIME, _S_INDEX = range(5)
+_SLOT_LEN = 8
+
+# Longest time in s the worker waits for an image before checking for
+# commands.
+_WAIT_TIMEOUT = 0.05
+
+
+# Names of the rings created by this process.
+_created = set()
+
+
+def _attach(name, related=False):
+    """Attach to a shared memory block without leaving it registered
+    with this process's resource tracker, which would otherwise destroy
+    it when the process exits (before Python 3.13).
+
+    A process which shares the creator's resource tracker (the creator
+    itself, or a process it started) must leave the registration alone,
+    since it is the creator's: the tracker keeps one entry per name.
+
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if not related and name not in _created:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedFrameRing(object):
+    """Ring of image slots in shared memory.
+
+    Frames are numbered with sequence numbers starting at 1. Frame
+    ``seq`` is stored in slot ``seq % slots`` and can be read as long
+    as it has not been overwritten by frame ``seq + slots``.
+
+    Attributes
+    ----------
+    name : str
+        Name of the shared memory block, used to attach to the ring.
+    slots : int
+        Number of frames held.
+    shape : tuple
+        Maximum (x, y) shape of a frame, as for the camera.
+    dtype : np.dtype
+        Pixel type.
+
+    """
+    def __init__(self, name=None, shape=(1024, 1024), dtype=np.uint16,
+                 slots=32, create=True, related=False):
+        """Create a new ring, or attach to an existing one if create is
+        False. When attaching, only name needs to be given, and related
+        should be True in a process started by the ring's creator.
+
+        """
+        if shared_memory is None:
+            raise CameraError(
+                'Shared memory frame rings require Python 3.8 or newer.')
+
+        if create:
+            dtype = np.dtype(dtype)
+            size = (8*(_HEADER_LEN + slots*_SLOT_LEN) +
+                    slots*shape[0]*shape[1]*dtype.itemsize)
+            self._shm = shared_memory.SharedMemory(
+                name=name, create=True, size=size)
+            header = np.ndarray((_HEADER_LEN,), np.int64, self._shm.buf)
+            header[:] = 0
+            header[_H_SLOTS] = slots
+            header[_H_XPX], header[_H_YPX] = shape
+            header[_H_ITEMSIZE] = dtype.itemsize
+            header[_H_KIND] = ord(dtype.kind)
+            header[_H_MAGIC] = _MAGIC
+            _created.add(self._shm.name)
+        else:
+            self._shm = _attach(name, related)
+            header = np.ndarray((_HEADER_LEN,), np.int64, self._shm.buf)
+            if header[_H_MAGIC] != _MAGIC:
+                raise CameraError('Not a frame ring: ' + name)
+
+        self.owner = create
+        self.name = self._shm.name
+        self._header = header
+        self.slots = int(header[_H_SLOTS])
+        self.shape = (int(header[_H_XPX]), int(header[_H_YPX]))
+        self.dtype = np.dtype(
+            '%s%i' % (chr(header[_H_KIND]), header[_H_ITEMSIZE]))
+
+        offset = 8*_HEADER_LEN
+        self._slot_info = np.ndarray(
+            (self.slots, _SLOT_LEN), np.int64, self._shm.buf, offset)
+        offset += 8*self.slots*_SLOT_LEN
+        self._data = np.ndarray(
+            (self.slots, self.shape[0]*self.shape[1]), self.dtype,
+            self._shm.buf, offset)
+        if create:
+            self._slot_info[:] = 0
+
+    @classmethod
+    def attach(cls, name, related=False):
+        """Attach to an existing ring. Pass related=True from a
+        process started by the one which created the ring.
+
+        """
+        return cls(name, create=False, related=related)
+
+    def close(self):
+        """Detach from the ring, destroying it if this is the ring
+        that created it.
+
+        """
+        self._header = self._slot_info = self._data = None
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+            _created.discard(self.name)
+
+    # Writing
+    # -------------------------------------------------------------------------
+
+    def write(self, frame, index=0):
+        """Copy a frame into the next slot.
+
+        Parameters
+        ----------
+        frame : np.ndarray
+            2D image no larger than :attr:`shape`, of a type which can
+            be cast to :attr:`dtype` without wrapping.
+        index : int
+            Camera image index to store with the frame.
+
+        Returns
+        -------
+        int
+            Sequence number of the frame.
+
+        """
+        nx, ny = frame.shape
+        if nx > self.shape[0] or ny > self.shape[1]:
+            raise CameraError('Frame too large for ring: ' + repr(frame.shape))
+        seq = int(self._header[_H_LATEST]) + 1
+        info = self._slot_info[seq % self.slots]
+
+        # Invalidate the slot while it is being written.
+        info[_S_SEQ] = 0
+        np.copyto(self._data[seq % self.slots, :nx*ny].reshape(nx, ny), frame,
+                  casting='same_kind')
+        info[_S_XPX], info[_S_YPX] = nx, ny
+        info[_S_TIME] = int(time.time()*1e6)
+        info[_S_INDEX] = index
+        info[_S_SEQ] = seq
+        self._header[_H_LATEST] = seq
+        return seq
+
+    # Reading
+    # -------------------------------------------------------------------------
+
+    def latest(self):
+        """Sequence number of the most recent frame, or 0 if none."""
+        return int(self._header[_H_LATEST])
+
+    def valid(self, seq):
+        """Check that frame seq is still in the ring."""
+        return seq > 0 and self._slot_info[seq % self.slots, _S_SEQ] == seq
+
+    def view(self, seq):
+        """Get a zero-copy view of frame seq. The view should be
+        checked with :meth:`valid` after use, since the frame may be
+        overwritten at any time.
+
+        Returns
+        -------
+        frame : np.ndarray or None
+            The image, or None if the frame is no longer in the ring.
+        info : dict
+            Frame metadata: camera image index and timestamp in s.
+
+        """
+        info = self._slot_info[seq % self.slots].copy()
+        if seq <= 0 or info[_S_SEQ] != seq:
+            return None, None
+        nx, ny = info[_S_XPX], info[_S_YPX]
+        frame = self._data[seq % self.slots, :nx*ny].reshape(nx, ny)
+        return frame, {'index': int(info[_S_INDEX]),
+                       'timestamp': float(info[_S_TIME])/1e6}
+
+    def read(self, seq):
+        """Get a copy of frame seq, or None if it is no longer in the
+        ring.
+
+        """
+        frame, info = self.view(seq)
+        if frame is None:
+            return None, None
+        frame = frame.copy()
+        if not self.valid(seq):
+            return None, None
+        return frame, info
+
+    def wait(self, after=None, timeout=None, poll=0.001):
+        """Wait for a frame newer than after (default: the latest
+        frame) and return its sequence number, or None on timeout.
+
+        """
+        if after is None:
+            after = self.latest()
+        deadline = None if timeout is None else time.time() + timeout
+        while self.latest() <= after:
+            if deadline is not None and time.time() > deadline:
+                return None
+            time.sleep(poll)
+        return self.latest()
+
+
+def _default_factory(**kwargs):
+    from . import AndorCamera
+    return AndorCamera(**kwargs)
+
+
+def _write(ring, frame):
+    """Copy a frame into the ring with its camera image index, or 0 if
+    it has none.
+
+    """
+    index = image_index(frame)
+    ring.write(frame, 0 if index is None else index)
+
+
+def _wait_for_image(cam, conn):
+    """Wait for a new image, giving up if a command arrives first."""
+    while not cam.wait_for_acquisition(_WAIT_TIMEOUT):
+        if conn.poll():
+            return False
+    return True
+
+
+def _worker(conn, factory, kwargs):
+    """Acquisition loop run in the worker process.
+
+    The camera is created first, and the error raised creating it, or
+    its pixel type and shape, are sent to the parent. The parent then
+    creates the ring and sends its name with a 'ring' command. Every
+    reply carries the camera's current pixel type, so that the parent
+    can replace the ring when it changes; until then, no frames are
+    written.
+
+    """
+    try:
+        cam = factory(**kwargs)
+    except Exception as e:
+        conn.send((e, None, None))
+        conn.close()
+        return
+    conn.send((None, cam.get_dtype().str, tuple(cam.shape)))
+
+    ring = None
+    writable = False
+    paused = True
+    try:
+        while True:
+            # Block for commands while paused or without a usable ring,
+            # otherwise just check.
+            while conn.poll(None if paused or not writable else 0):
+                msg, args = conn.recv()
+                reply = None
+                try:
+                    if msg == 'stop':
+                        pass
+                    elif msg == 'ring':
+                        if ring is not None:
+                            ring.close()
+                            ring = None
+                        ring = SharedFrameRing.attach(*args, related=True)
+                    elif msg == 'pause':
+                        cam.stop()
+                        paused = True
+                    elif msg == 'unpause':
+                        cam.start()
+                        paused = False
+                    elif msg == 'single':
+                        single_type, = args
+                        cam.stop()
+                        mode = cam.get_trigger_mode()
+                        cam.set_trigger_mode(single_type)
+                        cam.start()
+                        if _wait_for_image(cam, conn) and writable:
+                            _write(ring, cam.get_image(wait=False))
+                        cam.stop()
+                        cam.set_trigger_mode(mode)
+                    else:
+                        # Settings can only be changed while idle.
+                        if not paused:
+                            cam.stop()
+                        if msg == 'roi':
+                            cam.set_roi(*args)
+                        elif msg == 'bins':
+                            cam.set_bins(*args)
+                        elif msg == 'exposure':
+                            reply = cam.set_exposure_time(*args)
+                        elif msg == 'trigger':
+                            cam.set_trigger_mode(*args)
+                        elif msg == 'bit_depth':
+                            cam.set_bit_depth(*args)
+                        if not paused:
+                            cam.start()
+                except Exception as e:
+                    reply = e
+                dtype = cam.get_dtype()
+                writable = ring is not None and ring.dtype == dtype
+                conn.send((reply, dtype.str))
+                if msg == 'stop':
+                    return
+
+            if not paused and cam.wait_for_acquisition(_WAIT_TIMEOUT):
+                _write(ring, cam.get_image(wait=False))
+    finally:
+        conn.close()
+        cam.close()
+        if ring is not None:
+            ring.close()
+
+
+class CameraProcess(object):
+    """Runs a camera in a worker process which writes frames into a
+    :class:`SharedFrameRing`.
+
+    The control methods mirror those of
+    :class:`camthread.CameraThread`. Frames are read from :attr:`ring`,
+    which has the camera's pixel type. When that changes, e.g. with
+    :meth:`set_bit_depth`, the ring is replaced with a new one, so
+    readers attached by name should attach to the new :attr:`ring`.
+
+    Attributes
+    ----------
+    ring : SharedFrameRing
+        Ring the worker writes frames to.
+    paused : bool
+        Indicates that acquisition is paused.
+
+    """
+    def __init__(self, factory=_default_factory, shape=None, slots=32,
+                 **kwargs):
+        """Start the worker process, wait for it to create the camera,
+        and create the ring.
+
+        Parameters
+        ----------
+        factory : callable
+            Called in the worker with kwargs to create the camera. On
+            platforms which spawn rather than fork processes (Windows),
+            the factory and kwargs must be picklable.
+        shape, slots
+            Geometry of the ring. shape must be at least the size of
+            the largest frame the camera will produce, and defaults to
+            the camera's shape once created.
+
+        Raises
+        ------
+        Exception
+            The error raised creating the camera in the worker.
+
+        """
+        self.ring = None
+        self.paused = True
+        self._slots = slots
+        self._conn, child = multiprocessing.Pipe()
+        # Start the resource tracker before the worker, so that a forked
+        # worker shares it and can attach to rings as related.
+        resource_tracker.ensure_running()
+        self._process = multiprocessing.Process(
+            target=_worker, args=(child, factory, kwargs),
+            name='pyandor-camera')
+        self._process.daemon = True
+        self._process.start()
+        # Only the worker uses its end; closing ours means a crashed
+        # worker shows up as EOFError instead of a hang.
+        child.close()
+
+        try:
+            error, dtype, cam_shape = self._conn.recv()
+        except EOFError:
+            error = CameraError('Camera process exited while starting.')
+        if error is not None:
+            self._process.join()
+            self._conn.close()
+            raise error
+        self._shape = tuple(shape or cam_shape)
+        try:
+            self._replace_ring(dtype)
+        except Exception:
+            self._conn.send(('stop', ()))
+            self._process.join()
+            self._conn.close()
+            raise
+
+    def _call(self, msg, *args):
+        """Send a command to the worker and wait for its reply."""
+        self._conn.send((msg, args))
+        try:
+            reply, dtype = self._conn.recv()
+        except EOFError:
+            raise CameraError('Camera process exited.')
+        if np.dtype(dtype) != self.ring.dtype:
+            self._replace_ring(dtype)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def _replace_ring(self, dtype):
+        """Create a ring for a new pixel type and switch the worker to
+        it, destroying the old ring.
+
+        """
+        old = self.ring
+        self.ring = SharedFrameRing(shape=self._shape, dtype=dtype,
+                                    slots=self._slots)
+        try:
+            self._call('ring', self.ring.name)
+        except Exception:
+            self.ring.close()
+            self.ring = old
+            raise
+        if old is not None:
+            old.close()
+
+    def stop(self):
+        """Stop the worker process and destroy the ring."""
+        if self._process.is_alive():
+            self._call('stop')
+            self._process.join()
+        self._conn.close()
+        self.ring.close()
+
+    def pause(self):
+        if not self.paused:
+            self._call('pause')
+            self.paused = True
+
+    def unpause(self):
+        if self.paused:
+            self._call('unpause')
+            self.paused = False
+
+    def get_single_image(self, single_type='internal'):
+        if self.paused:
+            self._call('single', single_type)
+        else:
+            logger.warn('No getting a single image while unpaused!')
+
+    def set_roi(self, roi):
+        self._call('roi', roi)
+
+    def set_bins(self, bins):
+        self._call('bins', bins)
+
+    def set_exposure_time(self, t):
+        return self._call('exposure', t)
+
+    def set_trigger_mode(self, mode):
+        self._call('trigger', mode)
+
+    def set_bit_depth(self, bit_depth):
+        self._call('bit_depth', bit_depth)
@@ -1,11 +1,20 @@
-"""Camera threads for continuous acquisition."""
+"""Camera threads for continuous acquisition.
+
+:class:`CameraThread` never polls. While paused it blocks on its
+command queue, and while acquiring it blocks waiting for images with a
+timeout. Sending a command also cancels any wait in progress, so
+commands are handled as soon as they arrive, even when no trigger does.
+
+"""
 
 from __future__ import print_function
-import time
-from Queue import Queue
+import threading
+from Queue import Empty, Queue
 import numpy as np
 
-from camera import Camera
+from camera import Camera, CameraError
+from counters import tag_frame
+from latency import tick
 from log import logger
 from PyQt4 import QtCore
 
@@ -22,80 +31,216 @@ class CameraThread(QtCore.QThread):
     paused : bool
         Indicates that the thread is currently paused. This should not
         be modified directly, but instead through the use of the
-        :meth:`pause` and :meth:`unpause` methods.
+        :meth:`pause` and :meth:`unpause` methods. Use
+        :meth:`wait_paused` to block until a pause has taken effect.
     queue : Queue
-        A queue for communicating with the thread.
+        A queue for communicating with the thread. Commands should be
+        sent with :meth:`send`, which also wakes the thread.
+    wait_timeout : float
+        Longest time in s to block waiting for an image before checking
+        for commands again, in case a cancelled wait is missed.
     image_signal : QtCore.pyqtSignal
         Used for signaling changes to a GUI.
+    images_signal : QtCore.pyqtSignal
+        In streaming mode, emits every acquired image as an (N, height,
+        width) block along with the index of the first image in it.
+    streaming : bool
+        When True, drain all new images from the camera buffer on each
+        loop instead of fetching only the most recent one.
+    pipeline : Pipeline or None
+        When set, acquired images, single exposures included, are fed
+        into this pipeline instead of being emitted with
+        :attr:`image_signal`.
+    handoff : float or None
+        :func:`latency.tick` timestamp of when the latest image was
+        passed on, for timing its hop to the display.
 
     """
     image_signal = QtCore.pyqtSignal(np.ndarray)
+    images_signal = QtCore.pyqtSignal(np.ndarray, int)
 
-    def __init__(self, camera):
+    def __init__(self, camera, streaming=False):
         super(CameraThread, self).__init__()
         assert isinstance(camera, Camera)
 
         self.abort = False
         self.paused = True
+        self._paused = threading.Event()
+        self._paused.set()
         self.queue = Queue()
         self.cam = camera
+        self.streaming = streaming
+        self.pipeline = None
+        self.handoff = None
+        self.wait_timeout = 0.5
 
         self.single_type = 'internal'
 
+    def send(self, msg):
+        """Queue a command for the thread and wake it if it is waiting
+        for an image.
+
+        """
+        self.queue.put(msg)
+        self.cam.cancel_wait()
+
     def stop(self):
         """Stop the thread."""
         self.abort = True
+        self.send('stop')
 
     def pause(self):
         if not self.paused:
-            self.queue.put('pause')
+            self.send('pause')
 
     def unpause(self):
         if self.paused:
-            self.queue.put('unpause')
+            self.send('unpause')
+
+    def wait_paused(self, timeout=None):
+        """Block until the thread has paused, returning False if it
+        had not within timeout s.
+
+        """
+        return self._paused.wait(timeout)
 
     def get_single_image(self, single_type='internal'):
         if self.paused:
             self.single_type = single_type
-            self.queue.put('single')
+            self.send('single')
         else:
             print(':::::::: No getting a single image while unpaused!')
 
+    def reconfigure(self, timeout=5., **settings):
+        """Change camera settings with :meth:`Camera.reconfigure`.
+
+        While the thread is running, the change is made by the thread
+        between frames, so that it never races with acquisition, and
+        this blocks until it is done. Acquisition carries on with the
+        new settings unless the thread is paused.
+
+        Raises
+        ------
+        CameraError
+            If the thread did not make the change within timeout s.
+
+        """
+        if not self.isRunning():
+            self.cam.reconfigure(**settings)
+            return
+        request = {'settings': settings, 'done': threading.Event(),
+                   'error': None}
+        self.send(('reconfigure', request))
+        if not request['done'].wait(timeout):
+            raise CameraError('Timed out reconfiguring the camera.')
+        if request['error'] is not None:
+            raise request['error']
+
+    def drain(self):
+        """Emit all images waiting in the camera buffer, in order."""
+        while True:
+            images, first = self.cam.drain_images()
+            if images is None or len(images) == 0:
+                break
+            self.handoff = tick()
+            self.images_signal.emit(images, first)
+            if self.pipeline is not None:
+                for i, img in enumerate(images):
+                    self.pipeline.put(tag_frame(img, first + i))
+            else:
+                self.image_signal.emit(
+                    tag_frame(images[-1], first + len(images) - 1))
+            self.img_data = images[-1]
+            if len(images) < self.cam.burst_size:
+                break
+
     def run(self):
         """Run the thread until receiving a stop request."""
         while not self.abort:
-            # Check from the main thread if we need to pause
-            # (e.g., if a hardware update is happening).
-            if not self.queue.empty():
-                msg = self.queue.get()
-
-                if msg == 'pause':
-                    self.cam.stop()
-                    self.paused = True
-
-                elif msg == 'unpause':
-                    self.cam.start()
-                    self.paused = False
-
-                elif msg == 'single':
-                    # ensure stopped
-                    self.cam.stop()
-                    mode = self.cam.get_trigger_mode()
-                    logger.debug(mode)
-                    # set to single type (internal or external trigger) and get single frame
-                    self.cam.set_trigger_mode(self.single_type)
-                    self.cam.start()
-                    self.img_data = self.cam.get_image()
-                    self.image_signal.emit(self.img_data)
-                    self.cam.stop()
-                    # return to continuous
-                    self.cam.set_trigger_mode(mode)
+            # Block for commands while paused; otherwise only take those
+            # already waiting (e.g., if a hardware update is happening).
+            try:
+                msg = self.queue.get(block=self.paused)
+            except Empty:
+                pass
+            else:
+                self.handle(msg)
+                continue
 
             # Acquire data
-            if not self.paused:
-                # print('getting img at {}'.format(time.time()))
-                self.img_data = self.cam.get_image()
-                self.image_signal.emit(self.img_data)
-
+            if not self.cam.wait_for_acquisition(self.wait_timeout):
+                continue
+            if self.streaming:
+                self.drain()
             else:
-                time.sleep(0.01)
+                self.deliver(self.cam.get_image(wait=False))
+
+        if not self.paused:
+            self.stop_acquisition()
+
+    def stop_acquisition(self):
+        """Stop the camera, then pass on the images it acquired which
+        have not been read yet, e.g. the end of a recording.
+
+        """
+        self.cam.stop()
+        self.drain()
+        self.paused = True
+        self._paused.set()
+
+    def deliver(self, img):
+        """Pass a new image to the pipeline if there is one, or emit
+        it otherwise.
+
+        """
+        self.img_data = img
+        self.handoff = tick()
+        if self.pipeline is not None:
+            self.pipeline.put(img)
+        else:
+            self.image_signal.emit(img)
+
+    def handle(self, msg):
+        """Carry out a command from the queue."""
+        if isinstance(msg, tuple):
+            msg, request = msg
+
+        if msg == 'pause':
+            self.stop_acquisition()
+
+        elif msg == 'unpause':
+            self._paused.clear()
+            self.cam.start()
+            self.paused = False
+
+        elif msg == 'single':
+            # ensure stopped
+            self.cam.stop()
+            mode = self.cam.get_trigger_mode()
+            logger.debug(mode)
+            # set to single type (internal or external trigger) and get single frame
+            self.cam.set_trigger_mode(self.single_type)
+            self.cam.start()
+            if self.wait_for_image():
+                self.deliver(self.cam.get_image(wait=False))
+            self.cam.stop()
+            # return to continuous
+            self.cam.set_trigger_mode(mode)
+
+        elif msg == 'reconfigure':
+            try:
+                self.cam.reconfigure(**request['settings'])
+            except Exception as e:
+                request['error'] = e
+            finally:
+                request['done'].set()
+
+    def wait_for_image(self):
+        """Wait for a new image until one arrives, returning True, or
+        until the thread is stopped, returning False.
+
+        """
+        while not self.cam.wait_for_acquisition(self.wait_timeout):
+            if self.abort:
+                return False
+        return True
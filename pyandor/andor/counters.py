@@ -0,0 +1,154 @@
+"""Frame accounting
+
+Every image the SDK acquires has an absolute index, counting from 1
+at the start of each acquisition. Delivered frames are tagged with this
+index so that gaps, i.e. frames which were acquired but never read
+out, can be detected and counted all the way from the camera to a
+recording on disk.
+
+A frame is tagged by viewing it as a :class:`TaggedFrame`, which
+behaves exactly like the array it wraps and shares its memory::
+
+    frame = tag_frame(frame, index)
+    image_index(frame)  # -> index
+
+Arrays derived from a tagged frame (slices, arithmetic results) are
+not tagged.
+
+"""
+
+from __future__ import print_function, division
+import threading
+import numpy as np
+
+from .log import logger
+
+# Counters kept by FrameCounters, in the order a frame reaches them.
+COUNTERS = ('acquired', 'delivered', 'displayed', 'recorded', 'dropped')
+
+
+class TaggedFrame(np.ndarray):
+    """Frame carrying the SDK index of the image it holds."""
+    image_index = None
+
+
+def tag_frame(frame, index):
+    """Get a view of a frame tagged with an SDK image index."""
+    tagged = frame.view(TaggedFrame)
+    tagged.image_index = index
+    return tagged
+
+
+def image_index(frame):
+    """Get the SDK image index a frame was tagged with, or None."""
+    return getattr(frame, 'image_index', None)
+
+
+class FrameCounters(object):
+    """Cumulative frame counts for a camera.
+
+    Counts accumulate over every acquisition since the counters were
+    created or :meth:`reset`. ``dropped`` counts frames which were
+    acquired but skipped over when reading images, as found from gaps
+    in the indices of delivered frames. Frames acquired after the last
+    delivered one are not counted as acquired until they are read or
+    skipped over; until then they are ``pending``.
+
+    Attributes
+    ----------
+    acquired, delivered, displayed, recorded, dropped : int
+        Frame counts.
+    gaps : int
+        Number of separate gaps found.
+    pending : int
+        Number of images known to be waiting in the camera buffer
+        after the last delivered one.
+    last_index : int or None
+        Index of the last delivered image in the current acquisition.
+
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.last_index = None
+        self._acquired_now = 0
+        self.reset()
+
+    def reset(self):
+        """Zero all counts. Images acquired before this are no longer
+        counted, even if the acquisition carries on.
+
+        """
+        with self._lock:
+            for name in COUNTERS:
+                setattr(self, name, 0)
+            self.gaps = self.pending = 0
+            self._acquired_before = -self._acquired_now
+
+    def start(self):
+        """Note that a new acquisition has started, and that its image
+        indices count from 1 again.
+
+        """
+        with self._lock:
+            self._acquired_before += self._acquired_now
+            self._acquired_now = 0
+            self.last_index = None
+            self.pending = 0
+
+    def update_acquired(self, total):
+        """Set the number of images acquired so far in the current
+        acquisition.
+
+        """
+        with self._lock:
+            self._acquired_now = max(self._acquired_now, total)
+            self.acquired = self._acquired_before + self._acquired_now
+
+    def deliver(self, first, n=1, acquired=None, pending=0):
+        """Count frames delivered from the camera.
+
+        Parameters
+        ----------
+        first : int
+            Index of the first delivered image.
+        n : int
+            Number of consecutive images delivered.
+        acquired : int or None
+            Number of images acquired so far, if known.
+        pending : int
+            Number of images acquired after these which have not been
+            read yet.
+
+        Returns
+        -------
+        int
+            Number of images skipped since the previous delivery.
+
+        """
+        if acquired is None:
+            acquired = first + n - 1
+        self.update_acquired(acquired)
+        with self._lock:
+            expected = 1 if self.last_index is None else self.last_index + 1
+            skipped = max(0, first - expected)
+            if skipped:
+                self.dropped += skipped
+                self.gaps += 1
+                logger.debug('Skipped images %i-%i' % (expected, first - 1))
+            self.delivered += n
+            self.last_index = first + n - 1
+            self.pending = pending
+        return skipped
+
+    def count(self, name, n=1):
+        """Add to the displayed or recorded count."""
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def snapshot(self):
+        """Get all counts as a dict."""
+        with self._lock:
+            counts = dict((name, getattr(self, name)) for name in COUNTERS)
+            counts['gaps'] = self.gaps
+            counts['pending'] = self.pending
+        return counts
@@ -0,0 +1,289 @@
+"""Pre-trigger event capture
+
+Keeps a rolling history of the most recent frames in a preallocated
+in-memory ring. When an event is triggered, the frames from before the
+event are saved along with the frames which follow it, so that
+something interesting can be kept after it has already happened.
+
+Nothing is written to disk until an event fires. Frames after the
+event are copied straight into the output file. Everything else, i.e.
+saving the history and finishing the file, happens in a background
+thread per event, so that adding frames never waits on the disk. The
+history keeps filling across events, so an event which follows soon
+after another still gets its frames from before it.
+
+"""
+
+from __future__ import print_function, division
+import datetime
+import math
+import os
+import threading
+import time
+import numpy as np
+
+from .log import logger
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+class _Capture(object):
+    """An event being captured.
+
+    Attributes
+    ----------
+    path : str
+        Path of the event's .npy file.
+    first : int
+        Number of frames added before the event.
+    n_pre, n_post : int
+        Number of frames saved from before and after the event.
+    out : np.memmap
+        The output file, sized for all post_frames.
+    times : np.ndarray
+        Timestamps of the frames in out.
+    complete : threading.Event
+        Set once no more frames will be added to the event.
+
+    """
+    def __init__(self, path, first, n_pre, post_frames, shape, dtype):
+        self.path = path
+        self.first = first
+        self.n_pre = n_pre
+        self.n_post = 0
+        self.out = np.lib.format.open_memmap(
+            path, 'w+', dtype, (n_pre + post_frames,) + shape)
+        self.times = np.zeros(n_pre + post_frames)
+        self.complete = threading.Event()
+
+
+class EventCapture(object):
+    """Rolling frame history with event-triggered saving.
+
+    Attributes
+    ----------
+    pre_frames : int
+        Number of frames kept from before an event.
+    post_frames : int
+        Number of frames saved after an event.
+    directory : str
+        Directory events are saved to.
+    capturing : bool
+        True from an event until its frames have all been added and
+        its history saved; a new event can be triggered after that.
+    saved : list
+        Paths of the saved events.
+
+    """
+    def __init__(self, shape, dtype, fps, pre_seconds=5., post_seconds=5.,
+                 directory='.', on_saved=None):
+        """Create an event capture.
+
+        Parameters
+        ----------
+        shape : tuple
+            Shape of the frames.
+        dtype : np.dtype
+            Pixel type of the frames.
+        fps : float
+            Frame rate, used to convert the windows to frame counts.
+        pre_seconds, post_seconds : float
+            Time to save before and after an event.
+        on_saved : callable
+            Called with the path of each event once it has been saved,
+            from the thread saving it.
+
+        """
+        self.pre_frames = max(1, int(math.ceil(pre_seconds*fps)))
+        self.post_frames = max(1, int(math.ceil(post_seconds*fps)))
+        self.directory = directory
+        self.on_saved = on_saved
+        self.saved = []
+        self._lock = threading.Lock()
+        self._capture = None
+        # True while the ring is being saved and must not be written.
+        self._saving_history = False
+        # Set if a frame was left out of the history while it was saved.
+        self._skipped = False
+        self._savers = []
+        self._allocate(tuple(shape), np.dtype(dtype))
+
+    @property
+    def capturing(self):
+        return self._capture is not None
+
+    @classmethod
+    def for_camera(cls, camera, fps=None, pre_seconds=5., post_seconds=5.,
+                   directory='.', on_saved=None):
+        """Create an event capture sized for a camera's current
+        geometry and pixel type. Unless given, the frame rate is taken
+        from the camera's kinetic cycle time.
+
+        """
+        if fps is None:
+            fps = 1./camera.get_exposure_time()[2]
+        shape = (camera.shape[0]//camera.bins, camera.shape[1]//camera.bins)
+        return cls(shape, camera.get_dtype(), fps, pre_seconds,
+                   post_seconds, directory, on_saved)
+
+    def _allocate(self, shape, dtype):
+        size = self.pre_frames*np.prod(shape)*dtype.itemsize
+        logger.info('Allocating %.1f MB for event history' % (size/1e6))
+        self.shape = shape
+        self.dtype = dtype
+        self._ring = np.empty((self.pre_frames,) + shape, dtype)
+        self._times = np.zeros(self.pre_frames)
+        self._count = 0
+
+    def add(self, frame, timestamp=None):
+        """Add a frame to the history, and to the event being captured."""
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            capture = self._capture
+            post = capture is not None and not capture.complete.is_set()
+            same = frame.shape == self.shape and frame.dtype == self.dtype
+            if post and not same:
+                logger.warn('Frame geometry changed during event capture.')
+                self._complete(capture)
+                post = False
+            if post:
+                i = capture.n_pre + capture.n_post
+                capture.out[i] = frame
+                capture.times[i] = timestamp
+                capture.n_post += 1
+                if capture.n_post == self.post_frames:
+                    self._complete(capture)
+
+            if self._saving_history:
+                # Frames after the event are copied into the ring once
+                # it has been saved; any others are lost from it.
+                self._skipped = self._skipped or not post
+            else:
+                if not same:
+                    self._allocate(frame.shape, frame.dtype)
+                slot = self._count % self.pre_frames
+                self._ring[slot] = frame
+                self._times[slot] = timestamp
+            self._count += 1
+
+    def _complete(self, capture):
+        """Mark that no more frames will be added to an event."""
+        capture.complete.set()
+        if not self._saving_history:
+            self._capture = None
+
+    def trigger(self, name=None):
+        """Mark an event at the current frame. The frames held in the
+        history are saved, as are the next :attr:`post_frames` frames.
+
+        Returns
+        -------
+        str or None
+            Path the event will be saved to, or None if an event is
+            already being captured.
+
+        """
+        with self._lock:
+            if self.capturing:
+                logger.warn('Already capturing an event.')
+                return None
+            if name is None:
+                name = 'event_' + datetime.datetime.now().strftime(
+                    '%Y_%m_%d_%H%M%S_%f')
+            path = os.path.join(self.directory, name + '.npy')
+            n_pre = min(self._count, self.pre_frames)
+            capture = _Capture(path, self._count, n_pre, self.post_frames,
+                               self.shape, self.dtype)
+
+            # History is in ring order starting after the newest frame.
+            start = self._count % self.pre_frames if n_pre == \
+                self.pre_frames else 0
+            order = (np.arange(n_pre) + start) % self.pre_frames
+            capture.times[:n_pre] = self._times[order]
+            self._capture = capture
+            self._saving_history = True
+            self._skipped = False
+            saver = threading.Thread(target=self._save,
+                                     args=(capture, order), name='event')
+            saver.daemon = True
+            saver.start()
+            self._savers = [t for t in self._savers if t.is_alive()]
+            self._savers.append(saver)
+        logger.info('Capturing event to ' + path)
+        return path
+
+    def close(self):
+        """End the event being captured, if any, keeping the frames
+        added so far, and wait for every event to be saved. Frames
+        should no longer be added.
+
+        """
+        with self._lock:
+            if self._capture is not None:
+                self._complete(self._capture)
+            savers, self._savers = self._savers, []
+        for saver in savers:
+            saver.join()
+
+    def _save(self, capture, order):
+        """Save an event, in its own thread."""
+        for i, slot in enumerate(order):
+            capture.out[i] = self._ring[slot]
+        self._resume_history(capture)
+        capture.complete.wait()
+        self._finish(capture)
+
+    def _resume_history(self, capture):
+        """Once the history has been saved, copy the frames added after
+        the event into the ring, so that it carries on from them.
+
+        """
+        copied = 0
+        while True:
+            with self._lock:
+                if capture.n_post == copied or self._skipped:
+                    if self._skipped:
+                        logger.debug('Frames were missed while saving an '
+                                     'event; restarting the history.')
+                        self._count = 0
+                    self._saving_history = False
+                    if capture.complete.is_set():
+                        self._capture = None
+                    return
+                n_post = capture.n_post
+            # The ring is not written while the history is being saved,
+            # so this can be done without holding the lock.
+            for k in range(max(copied, n_post - self.pre_frames), n_post):
+                slot = (capture.first + k) % self.pre_frames
+                self._ring[slot] = capture.out[capture.n_pre + k]
+                self._times[slot] = capture.times[capture.n_pre + k]
+            copied = n_post
+
+    def _finish(self, capture):
+        """Complete the file of an event once all its frames have been
+        added.
+
+        """
+        n = capture.n_pre + capture.n_post
+        out, capture.out = capture.out, None
+        if n < len(out):
+            # Ended early, e.g. when the geometry changed: keep only the
+            # frames captured.
+            part_path = capture.path[:-len('.npy')] + '.part.npy'
+            part = np.lib.format.open_memmap(part_path, 'w+', out.dtype,
+                                             (n,) + out.shape[1:])
+            part[:] = out[:n]
+            part.flush()
+            del part, out
+            _replace(part_path, capture.path)
+        else:
+            out.flush()
+            del out
+        np.save(capture.path[:-len('.npy')] + '_timestamps.npy',
+                capture.times[:n])
+        self.saved.append(capture.path)
+        logger.info('Saved %i frames (%i before event) to %s' %
+                    (n, capture.n_pre, capture.path))
+        if self.on_saved is not None:
+            self.on_saved(capture.path)
@@ -0,0 +1,115 @@
+"""Reusable image buffers for acquisition.
+
+Allocating a new ctypes array for every frame is expensive at high
+frame rates, so cameras instead borrow preallocated buffers from a
+:class:`FramePool`. Frames are handed out as numpy arrays which share
+memory with the pool; once every array derived from a frame has been
+garbage collected, its buffer is returned to the pool automatically.
+
+"""
+
+from __future__ import print_function, division
+import ctypes
+import threading
+import weakref
+import numpy as np
+
+from .log import logger
+
+
+class _Lease(object):
+    """Owner object for a borrowed pool buffer. numpy keeps a
+    reference to this object from every array derived from the
+    frame, so the buffer is only given back once the last of those
+    arrays has been released.
+
+    """
+    def __init__(self, array):
+        self.__array_interface__ = array.__array_interface__
+        self.array = array
+
+
+class FramePool(object):
+    """Pool of preallocated ctypes buffers.
+
+    Attributes
+    ----------
+    shape : tuple
+        Shape of each buffer as a numpy array.
+    ctype : ctypes type
+        Element type of the buffers.
+    size : int
+        Number of elements per buffer.
+
+    """
+    def __init__(self, shape, ctype=ctypes.c_int32, slots=4):
+        """Create a new pool.
+
+        Parameters
+        ----------
+        shape : tuple
+            Shape of each buffer.
+        ctype : ctypes type
+            ctypes element type to use for the buffers.
+        slots : int
+            Number of buffers to preallocate. The pool will grow if
+            consumers hold on to more frames than this.
+
+        """
+        self.shape = tuple(int(x) for x in shape)
+        self.ctype = ctype
+        self.size = int(np.prod(self.shape))
+        self._c_array = ctype*self.size
+        self._lock = threading.RLock()
+        self._free = []
+        self._leases = {}
+        self._total = 0
+        for _ in range(slots):
+            self._free.append(self._allocate())
+
+    @property
+    def key(self):
+        """Key used to decide if the pool must be rebuilt."""
+        return self.shape, self.ctype
+
+    @property
+    def dtype(self):
+        return np.dtype(self.ctype)
+
+    def _allocate(self):
+        c_buf = self._c_array()
+        array = np.frombuffer(c_buf, dtype=self.ctype)
+        array.shape = self.shape
+        self._total += 1
+        return c_buf, array
+
+    def _release(self, ref):
+        with self._lock:
+            self._free.append(self._leases.pop(ref))
+
+    def acquire(self):
+        """Borrow a buffer from the pool.
+
+        Returns
+        -------
+        frame : np.ndarray
+            Array view of the buffer. The buffer goes back to the pool
+            once this and any views derived from it are released.
+        c_buf : ctypes array
+            The ctypes buffer backing ``frame``, for passing to the
+            camera library.
+
+        """
+        with self._lock:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = self._allocate()
+                logger.debug(
+                    'Frame pool exhausted; growing to %i buffers.' %
+                    self._total)
+        lease = _Lease(slot[1])
+        ref = weakref.ref(lease, self._release)
+        with self._lock:
+            self._leases[ref] = slot
+        return np.asarray(lease), slot[0]
@@ -0,0 +1,221 @@
+"""Per-stage latency histograms
+
+Lightweight, always-on timing of the stages of the acquisition and
+display path, so that a drop in frame rate can be attributed to the
+stage responsible. A stage is timed by taking a timestamp with
+:func:`tick` when it starts and passing it to :meth:`StageTimings.record`
+when it ends::
+
+    from .latency import tick, timings
+
+    start = tick()
+    self.clib.WaitForAcquisition()
+    timings.record('wait', start)
+
+Durations are counted in a fixed number of log-spaced buckets, so
+recording a sample allocates nothing and costs well under a
+microsecond, and the memory used does not grow with the number of
+frames. Percentiles are therefore approximate, to within the bucket
+width (a quarter of an octave by default).
+
+Recorded stages
+---------------
+``wait``
+    Triggering and waiting for an image (``WaitForAcquisition``).
+``frame``
+    Borrowing a frame buffer from the pool.
+``copy``
+    Copying image data out of the SDK (``GetImages``).
+``filter``
+    The SDK's post-processing noise filter.
+``handoff``
+    From the camera thread passing on a frame until the display
+    receives it, i.e. the Qt signal or pipeline hop. With the
+    ``'latest'`` display policy this is measured for the newest frame.
+``display``
+    Setting the image on the display (``setImage``).
+``overlay``
+    Updating the overlay.
+``record``
+    Writing a frame in a recorder's writer thread.
+
+"""
+
+from __future__ import print_function, division
+import math
+import threading
+import time
+from collections import OrderedDict
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+#: Monotonic, high resolution timestamp in s for timing stages.
+tick = _timer
+
+# Stages in the order they happen to a frame; others are listed after.
+STAGES = ('wait', 'frame', 'copy', 'filter', 'handoff', 'display', 'overlay',
+          'record')
+
+
+class LatencyHistogram(object):
+    """Histogram of durations in fixed, log-spaced buckets.
+
+    Bucket 0 holds durations below ``lowest``. Above that, each octave
+    is split into ``per_octave`` equal buckets, up to the last bucket
+    which also holds anything longer.
+
+    Attributes
+    ----------
+    count : int
+        Number of recorded durations.
+    total : float
+        Sum of the recorded durations in s.
+    max : float
+        Longest recorded duration in s.
+
+    """
+    def __init__(self, lowest=1e-6, octaves=26, per_octave=4):
+        self.lowest = lowest
+        self.per_octave = per_octave
+        self._last = octaves*per_octave
+        self.reset()
+
+    def reset(self):
+        """Clear all recorded durations."""
+        self.counts = [0]*(self._last + 1)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def record(self, seconds):
+        """Count a duration in s."""
+        if seconds < self.lowest:
+            i = 0
+        else:
+            m, e = math.frexp(seconds/self.lowest)
+            i = min(self._last, 1 + (e - 1)*self.per_octave +
+                    int((2*m - 1)*self.per_octave))
+        self.counts[i] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def edges(self):
+        """Get the lower edge of every bucket in s."""
+        p = self.per_octave
+        return [0.] + [self.lowest*2**(i//p)*(1 + (i % p)/p)
+                       for i in range(self._last)]
+
+    @property
+    def mean(self):
+        return self.total/self.count if self.count else 0.
+
+    def percentile(self, q):
+        """Estimate the q-th percentile duration in s, as the upper
+        edge of the bucket it falls in.
+
+        """
+        if not self.count:
+            return 0.
+        target = q/100.*self.count
+        edges = self.edges()
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                if i + 1 < len(edges):
+                    return min(edges[i + 1], self.max)
+                break
+        return self.max
+
+    def summary(self):
+        """Get the count and the mean, p50, p90, p99 and maximum
+        durations in ms.
+
+        """
+        return {
+            'count': self.count,
+            'mean_ms': 1e3*self.mean,
+            'p50_ms': 1e3*self.percentile(50),
+            'p90_ms': 1e3*self.percentile(90),
+            'p99_ms': 1e3*self.percentile(99),
+            'max_ms': 1e3*self.max,
+        }
+
+
+class StageTimings(object):
+    """Collection of named latency histograms, one per stage.
+
+    Histograms are created the first time a stage is recorded.
+    Recording is not locked; each stage is normally only timed from a
+    single thread, and a rare lost count is acceptable for diagnostics.
+
+    Attributes
+    ----------
+    enabled : bool
+        When False, :meth:`record` does nothing.
+
+    """
+    def __init__(self):
+        self.enabled = True
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        """Get the histogram for a stage, creating it if needed."""
+        try:
+            return self._stages[name]
+        except KeyError:
+            with self._lock:
+                return self._stages.setdefault(name, LatencyHistogram())
+
+    def record(self, name, start, end=None):
+        """Record a stage as having run from start until end, or until
+        now. Both are timestamps from :func:`tick`.
+
+        """
+        if self.enabled:
+            if end is None:
+                end = _timer()
+            self.histogram(name).record(end - start)
+
+    def names(self):
+        """Get the names of the recorded stages, in pipeline order."""
+        names = [name for name, hist in list(self._stages.items())
+                 if hist.count]
+        return [s for s in STAGES if s in names] + \
+            sorted(s for s in names if s not in STAGES)
+
+    def snapshot(self):
+        """Get a summary of every stage.
+
+        Returns
+        -------
+        OrderedDict
+            Stage name to :meth:`LatencyHistogram.summary`.
+
+        """
+        return OrderedDict((name, self._stages[name].summary())
+                           for name in self.names())
+
+    def reset(self):
+        """Clear the histograms of all stages."""
+        for hist in list(self._stages.values()):
+            hist.reset()
+
+    def format(self):
+        """Format the summary of every stage as a text table."""
+        lines = ['{:<10}{:>9}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+            'stage', 'count', 'mean ms', 'p50 ms', 'p90 ms', 'p99 ms',
+            'max ms')]
+        for name, s in self.snapshot().items():
+            lines.append(
+                '{:<10}{count:>9}{mean_ms:>10.3f}{p50_ms:>10.3f}'
+                '{p90_ms:>10.3f}{p99_ms:>10.3f}{max_ms:>10.3f}'.format(
+                    name, **s))
+        return '\n'.join(lines)
+
+
+#: Timings shared by the whole acquisition and display path.
+timings = StageTimings()
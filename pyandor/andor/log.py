@@ -1,6 +1,7 @@
 """Log handling for qCamera."""
 
 import sys
+import time
 import logging
 try:
     import colorama
@@ -62,6 +63,42 @@ class LogFormatter(logging.Formatter):
         return formatted
 
 
+_monotonic = getattr(time, 'monotonic', time.time)
+
+
+class RateLimiter(object):
+    """Limits how often a repeated log message is emitted.
+
+    Each kind of message is identified by a key. After a message is
+    emitted, the same kind is suppressed until ``interval`` s have
+    passed, and the number suppressed in between is reported with the
+    next one.
+
+    """
+    def __init__(self, interval=30.):
+        self.interval = interval
+        self._last = {}
+
+    def allow(self, key):
+        """Check whether a message may be emitted now.
+
+        Returns
+        -------
+        int or None
+            None if the message should be suppressed, otherwise the
+            number of messages of the same kind suppressed since the
+            last one was emitted.
+
+        """
+        now = _monotonic()
+        last, suppressed = self._last.get(key, (None, 0))
+        if last is not None and now - last < self.interval:
+            self._last[key] = (last, suppressed + 1)
+            return None
+        self._last[key] = (now, 0)
+        return suppressed
+
+
 def setup_logging(log, level=logging.INFO, stream=True, file=False, color=True):
     """Configure logging with default formatting.
 
@@ -0,0 +1,290 @@
+"""Frame processing pipeline
+
+Decouples image acquisition from processing and from consumers such
+as the display and recorders. Frames flow through three stages, each
+running in its own thread and connected by bounded queues::
+
+    acquisition --> processing --+--> sink (e.g. recording)
+                                 +--> sink (e.g. display)
+
+Every queue has a backpressure policy deciding what happens when it is
+full:
+
+``'block'``
+    Wait for space. Nothing is ever lost, but a slow consumer will
+    eventually stall the stages upstream of it.
+``'drop-oldest'``
+    Discard the oldest queued frame to make room.
+``'latest'``
+    Only keep the most recent frame. Useful for displays, which only
+    ever need to show the newest image.
+
+Since every sink has its own queue, a display which falls behind with
+the ``'latest'`` policy never causes a ``'block'`` recording sink to
+miss frames.
+
+"""
+
+from __future__ import print_function, division
+import threading
+import time
+from collections import deque
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+from .counters import tag_frame
+from .log import logger
+
+POLICIES = ('block', 'drop-oldest', 'latest')
+
+# Marker passed through the queues to shut down stages.
+_STOP = object()
+
+
+class PipelineError(Exception):
+    """Errors in configuring a pipeline."""
+
+
+class FrameQueue(object):
+    """Bounded queue with a configurable backpressure policy.
+
+    Attributes
+    ----------
+    maxsize : int
+        Maximum number of queued frames.
+    policy : str
+        One of :data:`POLICIES`.
+    dropped : int
+        Number of frames discarded because the queue was full.
+    stalls : int
+        Number of times a producer had to wait for space with the
+        ``'block'`` policy.
+
+    """
+    def __init__(self, maxsize=8, policy='block'):
+        if policy not in POLICIES:
+            raise PipelineError("Policy must be one of " + repr(POLICIES))
+        self.policy = policy
+        self.maxsize = 1 if policy == 'latest' else maxsize
+        self.dropped = 0
+        self.stalls = 0
+        self._items = deque()
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item, force=False):
+        """Add an item to the queue, applying the backpressure policy
+        if it is full. If force is True, the item is added regardless
+        of the queue size.
+
+        Returns
+        -------
+        bool
+            False if a frame was dropped to make room.
+
+        """
+        with self._cond:
+            dropped = False
+            if not force:
+                if self.policy == 'block':
+                    if len(self._items) >= self.maxsize:
+                        self.stalls += 1
+                    while len(self._items) >= self.maxsize:
+                        self._cond.wait()
+                else:
+                    while len(self._items) >= self.maxsize:
+                        self._items.popleft()
+                        self.dropped += 1
+                        dropped = True
+            self._items.append(item)
+            self._cond.notify_all()
+            return not dropped
+
+    def get(self, block=True, timeout=None):
+        """Remove and return the oldest item in the queue.
+
+        Raises
+        ------
+        Empty
+            If no item is available within the timeout or when not
+            blocking.
+
+        """
+        with self._cond:
+            if block and timeout is None:
+                while not self._items:
+                    self._cond.wait()
+            elif block:
+                deadline = time.time() + timeout
+                while not self._items:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise Empty
+                    self._cond.wait(remaining)
+            elif not self._items:
+                raise Empty
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+
+class Stage(threading.Thread):
+    """Thread which applies a function to each frame from an input
+    queue and passes any result on to its output queues.
+
+    """
+    def __init__(self, func, inbox, outputs=(), name=None):
+        super(Stage, self).__init__(name=name)
+        self.daemon = True
+        self.func = func
+        self.inbox = inbox
+        self.outputs = list(outputs)
+
+    def run(self):
+        while True:
+            item = self.inbox.get()
+            if item is _STOP:
+                break
+            try:
+                result = self.func(item) if self.func else item
+            except Exception:
+                logger.exception('Error in pipeline stage ' + self.name)
+                continue
+            if result is not None:
+                for queue in list(self.outputs):
+                    queue.put(result)
+
+    def stop(self, timeout=None):
+        """Finish processing queued frames and stop the thread."""
+        self.inbox.put(_STOP, force=True)
+        self.join(timeout)
+
+
+class AcquisitionStage(threading.Thread):
+    """Thread which acquires images from a camera and feeds them into
+    a pipeline. The camera must already be started.
+
+    """
+    def __init__(self, camera, pipeline, streaming=False):
+        super(AcquisitionStage, self).__init__(name='acquisition')
+        self.daemon = True
+        self.cam = camera
+        self.pipeline = pipeline
+        self.streaming = streaming
+        self.abort = False
+
+    # Longest time in s to wait for an image before checking for abort.
+    wait_timeout = 0.5
+
+    def run(self):
+        while not self.abort:
+            if not self.cam.wait_for_acquisition(self.wait_timeout):
+                continue
+            if self.streaming:
+                images, first = self.cam.drain_images()
+                if images is not None:
+                    for i, img in enumerate(images):
+                        self.pipeline.put(tag_frame(img, first + i))
+            else:
+                self.pipeline.put(self.cam.get_image(wait=False))
+
+    def stop(self, timeout=None):
+        self.abort = True
+        self.cam.cancel_wait()
+        self.join(timeout)
+
+
+class Pipeline(object):
+    """Processing stage plus any number of named sinks.
+
+    Frames are passed in with :meth:`put`, which applies the input
+    queue's policy. Each processor function is applied to the frame in
+    turn in the processing thread, and the result is then queued for
+    every sink.
+
+    """
+    def __init__(self, processors=(), maxsize=8, policy='block'):
+        """Create a pipeline.
+
+        Parameters
+        ----------
+        processors : list
+            Functions taking and returning a frame. A processor may
+            return None to discard a frame.
+        maxsize : int
+            Size of the input queue.
+        policy : str
+            Backpressure policy of the input queue.
+
+        """
+        self.processors = list(processors)
+        self.inbox = FrameQueue(maxsize, policy)
+        self.sinks = {}
+        self._processing = Stage(self._process, self.inbox, name='processing')
+
+    def _process(self, frame):
+        for func in self.processors:
+            frame = func(frame)
+            if frame is None:
+                break
+        return frame
+
+    def start(self):
+        self._processing.start()
+
+    def stop(self, timeout=None):
+        """Stop the pipeline once all queued frames are consumed."""
+        self._processing.stop(timeout)
+        for name in list(self.sinks):
+            self.remove_sink(name, timeout)
+
+    def put(self, frame):
+        """Feed a frame into the pipeline."""
+        return self.inbox.put(frame)
+
+    def add_sink(self, name, func=None, policy='block', maxsize=8):
+        """Add a consumer of processed frames.
+
+        Parameters
+        ----------
+        name : str
+            Name used to refer to the sink.
+        func : callable or None
+            Called with each frame in a dedicated thread. If None, no
+            thread is started and frames should be taken from the
+            returned queue by the consumer.
+        policy : str
+            Backpressure policy of the sink's queue.
+        maxsize : int
+            Size of the sink's queue.
+
+        Returns
+        -------
+        FrameQueue
+            The sink's input queue.
+
+        """
+        if name in self.sinks:
+            raise PipelineError("Sink already exists: " + name)
+        queue = FrameQueue(maxsize, policy)
+        stage = None
+        if func is not None:
+            stage = Stage(func, queue, name=name)
+            stage.start()
+        self.sinks[name] = (queue, stage)
+        self._processing.outputs.append(queue)
+        return queue
+
+    def remove_sink(self, name, timeout=None):
+        """Remove a sink. If it has a thread, frames already queued
+        are consumed before it stops.
+
+        """
+        queue, stage = self.sinks.pop(name)
+        self._processing.outputs.remove(queue)
+        if stage is not None:
+            stage.stop(timeout)
@@ -0,0 +1,535 @@
+"""Random-access recording reader
+
+Opens recordings made by :mod:`recording` as lazy, array-like objects.
+Indexing a :class:`Recording` only reads the bytes needed: raw
+recordings are memory mapped, and compressed recordings only
+decompress the chunks holding the requested frames, located through
+the chunk index. For example::
+
+    rec = open_recording('cells.raw')
+    stack = rec[1000:2000, 100:200, 300:400]
+    times = rec.timestamps[1000:2000]
+
+Per-frame metadata is available as NumPy columns read from the frame
+index.
+
+:class:`CameraBuffer` gives the same frame-by-number access to the
+images held in an Andor camera's circular buffer, and
+:class:`FrameCache` reads frames from any of these sources ahead of a
+playhead.
+
+"""
+
+from __future__ import print_function, division
+import json
+import operator
+import os.path
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from .log import logger
+from .recording import CHUNK_DTYPE, THUMB_FACTOR, RecordingError, \
+    decompress_chunk, make_thumbnail, record_dtype
+
+
+def open_recording(path, cache_chunks=8):
+    """Open a raw or compressed recording.
+
+    Parameters
+    ----------
+    path : str
+        Path of the recording's data file.
+    cache_chunks : int
+        Number of decompressed chunks of a compressed recording to
+        keep in memory.
+
+    Returns
+    -------
+    Recording
+
+    """
+    return Recording(path, cache_chunks)
+
+
+class Recording(object):
+    """A recording as a lazy (frames, height, width) array.
+
+    Supports ``len``, NumPy style indexing with an integer, slice,
+    integer array or boolean mask along the frame axis followed by any
+    indexing of the image axes, and :func:`numpy.asarray` to read the
+    whole recording.
+
+    Attributes
+    ----------
+    path : str
+        Path of the data file.
+    header : dict
+        The recording header.
+    index : np.ndarray
+        Frame index, one :data:`recording.RECORD_DTYPE` record per
+        frame.
+    shape : tuple
+        (frames, height, width).
+    dtype : np.dtype
+        Pixel type.
+    thumbnails : np.ndarray or None
+        Thumbnails stored with the recording, if any.
+    thumbnail_frames : np.ndarray or None
+        Frame numbers of the thumbnails.
+
+    """
+    def __init__(self, path, cache_chunks=8):
+        self.path = path
+        with open(path + '.json') as f:
+            self.header = json.load(f)
+        self.format = self.header['format']
+        self.dtype = np.dtype(self.header['dtype'])
+        frame_shape = tuple(self.header['shape'])
+        self.index = np.fromfile(path + '.idx', record_dtype(self.header))
+
+        # Recordings still being written have no frame count, so use
+        # the frames in the index.
+        n = len(self.index)
+        if self.header['frames'] is not None:
+            n = min(self.header['frames'], n)
+
+        self._frames = None
+        self._data = None
+        if self.format == 'chunked':
+            self.codec = self.header['codec']
+            self.chunks = np.fromfile(path + '.chunks', CHUNK_DTYPE)
+            self._firsts = self.chunks['first'].astype(np.intp)
+            n = min(n, int(self._firsts[-1] + self.chunks['frames'][-1])) \
+                if len(self.chunks) else 0
+            if len(self.chunks):
+                self._data = np.memmap(path, np.uint8, 'r')
+            self._cache = OrderedDict()
+            self._cache_size = max(1, cache_chunks)
+            self._lock = threading.Lock()
+        elif self.format != 'raw':
+            raise RecordingError('Unknown recording format: ' +
+                                 repr(self.format))
+
+        self.index = self.index[:n]
+        self.shape = (n,) + frame_shape
+        if self.format == 'raw':
+            if n:
+                self._frames = np.memmap(path, self.dtype, 'r',
+                                         shape=self.shape)
+            else:
+                self._frames = np.empty(self.shape, self.dtype)
+
+        self.thumbnails = self.thumbnail_frames = None
+        thumbs = self.header.get('thumbnails', {})
+        if thumbs.get('every') and os.path.exists(path + '.thumbs'):
+            self._load_thumbnails(thumbs['every'], thumbs['factor'])
+
+    def _load_thumbnails(self, every, factor):
+        shape = make_thumbnail(np.empty(self.shape[1:], np.uint8),
+                               factor).shape
+        size = os.path.getsize(self.path + '.thumbs')
+        count = size//(int(np.prod(shape))*self.dtype.itemsize)
+        frame_numbers = np.arange(0, len(self), every)[:count]
+        if not len(frame_numbers):
+            return
+        self.thumbnails = np.memmap(
+            self.path + '.thumbs', self.dtype, 'r',
+            shape=(len(frame_numbers),) + shape)
+        self.thumbnail_frames = frame_numbers
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return '<Recording %s %s %s>' % (self.path, self.shape, self.dtype)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def close(self):
+        """Release the memory maps of the recording."""
+        self._frames = self._data = None
+        if self.format == 'chunked':
+            self._cache.clear()
+
+    # Metadata
+    # -------------------------------------------------------------------------
+
+    @property
+    def timestamps(self):
+        return self.index['timestamp']
+
+    @property
+    def exposure(self):
+        """Exposure times in ms."""
+        return self.index['exposure']
+
+    @property
+    def gain(self):
+        return self.index['gain']
+
+    @property
+    def bins(self):
+        return self.index['bins']
+
+    @property
+    def roi(self):
+        """Regions of interest, as an (N, 4) array."""
+        return self.index['roi']
+
+    @property
+    def images(self):
+        """SDK image indices of the frames, -1 where unknown."""
+        if 'image' not in self.index.dtype.names:
+            return np.full(len(self), -1, np.int64)
+        return self.index['image']
+
+    @property
+    def missing(self):
+        """Number of images acquired by the camera between the first
+        and last recorded frames which are not in the recording.
+
+        """
+        images = self.images
+        images = images[images >= 0]
+        steps = np.diff(images)
+        # Restarting the camera starts the indices from 1 again.
+        return int(np.sum(steps[steps > 1] - 1))
+
+    # Frames
+    # -------------------------------------------------------------------------
+
+    def __array__(self, dtype=None):
+        frames = self[:]
+        return frames if dtype is None else frames.astype(dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if self.format == 'raw':
+            return self._frames[key]
+
+        key = self._expand_ellipsis(key) or (slice(None),)
+        frame_key, image_key = key[0], key[1:]
+        numbers = self._frame_numbers(frame_key)
+        if np.ndim(numbers) == 0:
+            frame = self._read_frames(np.array([numbers]))[0]
+            return frame[image_key]
+        frames = self._read_frames(numbers)
+        return frames[(slice(None),) + image_key]
+
+    def _expand_ellipsis(self, key):
+        """Replace an Ellipsis in an index with the full slices it
+        stands for, as numpy does.
+
+        """
+        ellipses = [i for i, k in enumerate(key) if k is Ellipsis]
+        if not ellipses:
+            return key
+        if len(ellipses) > 1:
+            raise IndexError("an index can only have a single ellipsis "
+                             "('...')")
+        i = ellipses[0]
+        n = self.ndim - (len(key) - 1)
+        if n < 0:
+            raise IndexError('too many indices for recording: recording '
+                             'is %i-dimensional' % self.ndim)
+        return key[:i] + (slice(None),)*n + key[i + 1:]
+
+    def _frame_numbers(self, key):
+        """Convert an index along the frame axis to frame numbers,
+        without building an array of every frame number.
+
+        """
+        n = len(self)
+        if isinstance(key, slice):
+            return np.arange(*key.indices(n))
+        try:
+            number = operator.index(key)
+        except TypeError:
+            pass
+        else:
+            if not -n <= number < n:
+                raise IndexError('Frame %i is out of range for %i frames'
+                                 % (number, n))
+            return number + n if number < 0 else number
+
+        numbers = np.asarray(key)
+        if numbers.dtype == bool:
+            if numbers.shape != (n,):
+                raise IndexError('Boolean index of shape %s does not match '
+                                 '%i frames' % (numbers.shape, n))
+            return np.flatnonzero(numbers)
+        if not numbers.size:
+            return numbers.astype(np.intp)
+        numbers = numbers.astype(np.intp, casting='same_kind')
+        if not (-n <= numbers.min() and numbers.max() < n):
+            raise IndexError('Frame index out of range for %i frames' % n)
+        return np.where(numbers < 0, numbers + n, numbers)
+
+    def _read_frames(self, numbers):
+        """Read frames of a compressed recording by number."""
+        out = np.empty((len(numbers),) + self.shape[1:], self.dtype)
+        if not len(numbers):
+            return out
+        chunks = np.searchsorted(self._firsts, numbers, 'right') - 1
+        for chunk in np.unique(chunks):
+            which = chunks == chunk
+            frames = self._read_chunk(chunk)
+            out[which] = frames[numbers[which] - self._firsts[chunk]]
+        return out
+
+    def _read_chunk(self, chunk):
+        """Get the decompressed frames of a chunk, using the cache."""
+        with self._lock:
+            if chunk in self._cache:
+                self._cache[chunk] = frames = self._cache.pop(chunk)
+                return frames
+        record = self.chunks[chunk]
+        start = int(record['offset'])
+        data = self._data[start:start + int(record['size'])].tobytes()
+        frames = decompress_chunk(data, self.shape[1:], self.dtype,
+                                  self.codec)
+        with self._lock:
+            self._cache[chunk] = frames
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return frames
+
+
+class CameraBuffer(object):
+    """Frames in an Andor camera's circular buffer, read in pages on
+    demand with GetImages.
+
+    The range of images is fixed when created, and is empty if the
+    buffer was. Reads go through the camera's lock so they can run
+    alongside acquisition. Images which have been overwritten by the
+    time they are read come back blank. The first
+    access to a page only reads the requested frame, so showing a
+    single frame costs a single frame of I/O; the whole page is read
+    when it is accessed again.
+
+    Attributes
+    ----------
+    first, last : int
+        Camera indices of the first and last images.
+    page_frames : int
+        Number of frames read at a time.
+
+    """
+    def __init__(self, camera, page_frames=16, cache_pages=8):
+        self.cam = camera
+        first, last = camera.get_num_available_images()
+
+        # The oldest image may be overwritten at any moment.
+        self.first, self.last = first + 1, last
+        self.dtype = camera.frame_pool.dtype
+        self.shape = (max(0, last - first),) + camera.frame_pool.shape
+        self.page_frames = page_frames
+        self._pages = OrderedDict()
+        self._cache_pages = cache_pages
+        self._touched = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Frame %i is outside the buffer' % i)
+        page, offset = divmod(i, self.page_frames)
+        with self._lock:
+            frames = self._pages.pop(page, None)
+            if frames is None and page not in self._touched:
+                self._touched.add(page)
+                return self._read(i, i)[0]
+            if frames is None:
+                start = page*self.page_frames
+                end = min(start + self.page_frames, len(self)) - 1
+                frames = self._read(start, end)
+            self._pages[page] = frames
+            while len(self._pages) > self._cache_pages:
+                self._pages.popitem(last=False)
+        return frames[offset]
+
+    def _read(self, start, end):
+        """Read frames start to end inclusive, blank where no longer
+        valid.
+
+        """
+        out = np.zeros((end - start + 1,) + self.shape[1:], self.dtype)
+        images, first, last = self.cam.acquire_images(self.first + start,
+                                                      self.first + end)
+        if len(images):
+            i = first - self.first - start
+            out[i:i + len(images)] = images
+        return out
+
+
+class FrameCache(object):
+    """LRU cache of frames from a source, filled ahead of the playhead
+    by a background thread.
+
+    The source can be anything indexable by frame number with a
+    length, such as a :class:`Recording` or an (N, height, width)
+    array. Memory use is bounded by :attr:`size` frames however long
+    the source is.
+
+    An error reading ahead is logged and raised from the next call to
+    :meth:`get`; reading ahead carries on when the playhead moves.
+
+    Attributes
+    ----------
+    source
+        Where frames are read from.
+    size : int
+        Maximum number of frames held.
+    ahead : int
+        Number of frames to read ahead of the playhead.
+
+    """
+    def __init__(self, source, size=32, ahead=8):
+        self.source = source
+        self.size = max(size, ahead + 1)
+        self.ahead = ahead
+        self._cache = OrderedDict()
+        self._cond = threading.Condition()
+        self._playhead = None
+        self._step = 1
+        self._abort = False
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='prefetch')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __len__(self):
+        return len(self.source)
+
+    def get(self, index, step=1):
+        """Get a frame, reading it now if it is not cached, and start
+        reading the frames which follow it.
+
+        Parameters
+        ----------
+        index : int
+            Frame number.
+        step : int
+            Spacing of the frames which will be requested next, e.g. -1
+            when stepping backwards or greater than 1 when playing fast.
+
+        """
+        with self._cond:
+            error, self._error = self._error, None
+            frame = self._cache.pop(index, None)
+            if frame is not None:
+                self._cache[index] = frame
+        if error is not None:
+            raise error
+        if frame is None:
+            frame = self._add(index)
+        with self._cond:
+            self._playhead = index
+            self._step = step or 1
+            self._cond.notify_all()
+        return frame
+
+    def _add(self, index):
+        frame = np.asarray(self.source[index])
+        with self._cond:
+            self._cache[index] = frame
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+        return frame
+
+    def _run(self):
+        done = (None, 1)
+        while True:
+            with self._cond:
+                while not self._abort and (self._playhead, self._step) == done:
+                    self._cond.wait()
+                if self._abort:
+                    return
+                playhead, step = done = self._playhead, self._step
+
+            for k in range(1, self.ahead + 1):
+                index = playhead + k*step
+                with self._cond:
+                    # Start again if the playhead has moved.
+                    if self._abort or self._playhead != playhead:
+                        break
+                    if index in self._cache:
+                        continue
+                if not 0 <= index < len(self.source):
+                    break
+                try:
+                    self._add(index)
+                except Exception as e:
+                    logger.exception('Error reading frame %i ahead' % index)
+                    with self._cond:
+                        self._error = e
+                    break
+
+    def close(self):
+        """Stop reading ahead and empty the cache."""
+        with self._cond:
+            self._abort = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._cache.clear()
+
+
+class ThumbnailBuilder(threading.Thread):
+    """Makes thumbnails of evenly spaced frames of a source in the
+    background.
+
+    Thumbnails stored with a :class:`Recording` are used directly.
+    Otherwise each frame is read and block averaged in turn, and
+    :attr:`thumbnails` grows as they are made, so they can be shown
+    as they arrive.
+
+    Attributes
+    ----------
+    frames : np.ndarray
+        Frame numbers of the thumbnails.
+    thumbnails : list
+        Thumbnails made so far, in the order of :attr:`frames`.
+
+    """
+    def __init__(self, source, count=100, factor=THUMB_FACTOR):
+        super(ThumbnailBuilder, self).__init__(name='thumbnails')
+        self.daemon = True
+        self.source = source
+        self.factor = factor
+        self.abort = False
+        self.thumbnails = []
+
+        stored = getattr(source, 'thumbnail_frames', None)
+        if stored is not None:
+            pick = np.unique(np.linspace(0, len(stored) - 1, count).astype(int))
+            self.frames = stored[pick]
+            self._stored = pick
+        else:
+            self.frames = np.unique(np.linspace(
+                0, len(source) - 1, min(count, len(source))).astype(int))
+            self._stored = None
+
+    @property
+    def done(self):
+        return len(self.thumbnails) == len(self.frames)
+
+    def run(self):
+        if self._stored is not None:
+            self.thumbnails.extend(np.array(self.source.thumbnails[self._stored]))
+            return
+        for i in self.frames:
+            if self.abort:
+                return
+            self.thumbnails.append(
+                make_thumbnail(np.asarray(self.source[i]), self.factor))
+
+    def stop(self):
+        self.abort = True
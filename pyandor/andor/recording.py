@@ -0,0 +1,723 @@
+"""Lossless raw recording
+
+A raw recording is made of three files:
+
+``<name>.raw``
+    Frames in their native pixel type, stored back to back. The file is
+    grown in preallocated chunks while recording and trimmed when the
+    recording is closed.
+``<name>.raw.idx``
+    One :data:`RECORD_DTYPE` record per frame with its timestamp, byte
+    offset, acquisition settings and SDK image index.
+``<name>.raw.json``
+    Header describing the frame shape, pixel type, frame count, the
+    settings at the start of the recording and the SDK images recorded.
+
+``<name>.raw.thumbs``
+    Block-averaged thumbnails of every :attr:`RawRecorder.thumb_every`
+    th frame, so that a recording can be browsed without reading it.
+
+The frame data can be read back directly with :func:`numpy.memmap`,
+e.g. using :func:`load_raw`.
+
+A compressed recording (:class:`ChunkedRecorder`) stores the frames
+in independently compressed chunks instead, with a ``<name>.chunks``
+index locating each chunk in the data file.
+
+Frames are written from a :class:`FrameWriter` thread, so a slow disk
+never holds up acquisition or the display. The writer reports its
+queue depth, throughput and any dropped or stalled frames.
+
+Frames tagged with their SDK image index (see :mod:`counters`) have it
+stored in the index, and any images missing between them are counted
+in the header, so it can be checked whether a recording is complete.
+
+"""
+
+from __future__ import print_function, division
+import datetime
+import json
+import multiprocessing
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+try:
+    import blosc
+except ImportError:
+    blosc = None
+
+from .counters import image_index
+from .latency import tick, timings
+from .log import logger
+from .pipeline import FrameQueue
+
+FORMAT_VERSION = 2
+
+_RECORD_FIELDS = [
+    ('frame', '<u8'),
+    ('timestamp', '<f8'),
+    ('offset', '<u8'),
+    ('exposure', '<f4'),
+    ('gain', '<f4'),
+    ('bins', '<u2'),
+    ('roi', '<i4', 4),
+]
+
+# Version 2 added the SDK image index, -1 for untagged frames.
+RECORD_DTYPE = np.dtype(_RECORD_FIELDS + [('image', '<i8')])
+
+# Index record types of each format version.
+RECORD_DTYPES = {1: np.dtype(_RECORD_FIELDS), 2: RECORD_DTYPE}
+
+CHUNK_DTYPE = np.dtype([
+    ('offset', '<u8'),
+    ('size', '<u8'),
+    ('first', '<u8'),
+    ('frames', '<u4'),
+])
+
+# Default thumbnail spacing in frames and downsampling factor.
+THUMB_EVERY = 25
+THUMB_FACTOR = 16
+
+# Codecs for compressed recordings, with their default levels.
+CODECS = {'blosc': 5, 'zlib': 1}
+
+# Marker used to stop the writer thread.
+_STOP = object()
+
+
+class RecordingError(Exception):
+    """Errors while writing or reading recordings."""
+
+
+def record_dtype(header):
+    """Get the index record type of a recording from its header."""
+    version = header.get('version', 1)
+    if version not in RECORD_DTYPES:
+        raise RecordingError('Unsupported recording version: ' +
+                             repr(version))
+    return RECORD_DTYPES[version]
+
+
+def frame_record(frame_number, timestamp, offset, settings, image=None):
+    """Build an index record for a frame."""
+    record = np.zeros((), RECORD_DTYPE)
+    record['frame'] = frame_number
+    record['timestamp'] = timestamp
+    record['offset'] = offset
+    record['exposure'] = settings.get('exposure_ms', 0)
+    record['gain'] = settings.get('gain', 0)
+    record['bins'] = settings.get('bins', 1)
+    record['roi'] = settings.get('roi', [0, 0, 0, 0])
+    record['image'] = -1 if image is None else image
+    return record
+
+
+def make_thumbnail(frames, factor=THUMB_FACTOR):
+    """Downsample frames by averaging blocks of factor x factor pixels.
+
+    Parameters
+    ----------
+    frames : np.ndarray
+        A frame, or a stack of frames in the last two dimensions.
+        Edges which do not fill a block are cropped.
+
+    Returns
+    -------
+    np.ndarray
+        Thumbnails with the pixel type of the frames.
+
+    """
+    frames = np.asarray(frames)
+    h, w = frames.shape[-2] // factor, frames.shape[-1] // factor
+    h, w = max(h, 1), max(w, 1)
+    fy, fx = min(factor, frames.shape[-2]), min(factor, frames.shape[-1])
+    blocks = frames[..., :h*fy, :w*fx].reshape(
+        frames.shape[:-2] + (h, fy, w, fx))
+    return blocks.mean(axis=(-3, -1)).astype(frames.dtype)
+
+
+def camera_settings(camera):
+    """Get the settings of a camera to store with a recording."""
+    return {
+        'exposure_ms': camera.t_ms,
+        'gain': camera.gain,
+        'bins': camera.bins,
+        'roi': list(camera.roi),
+        'trigger_mode': camera.trigger_mode,
+        'acq_mode': camera.acq_mode,
+    }
+
+
+def _nbytes(item):
+    """Size of the frame in a queued item."""
+    if isinstance(item, tuple):
+        item = item[0]
+    return getattr(item, 'nbytes', 0)
+
+
+class FrameWriter(threading.Thread):
+    """Thread which writes queued frames, keeping slow disks away from
+    acquisition and display.
+
+    Attributes
+    ----------
+    queue : FrameQueue
+        Queue of frames waiting to be written.
+    frames : int
+        Number of frames written.
+    bytes_written : int
+        Number of bytes of frame data written.
+    error : Exception or None
+        The first error encountered while writing, if any.
+    finished : bool
+        True once all frames have been written and the writer closed.
+
+    """
+    def __init__(self, write, on_finish=None, queue=None, maxsize=64,
+                 policy='block', name='writer', counters=None):
+        """Create and start a writer.
+
+        Parameters
+        ----------
+        write : callable
+            Called in the writer thread with each queued item.
+        on_finish : callable
+            Called in the writer thread after the last item is written.
+        queue : FrameQueue
+            Queue to take frames from, e.g. a pipeline sink's queue. If
+            None, a queue is created with maxsize and policy.
+        counters : FrameCounters
+            Camera frame counters to count written frames as recorded.
+
+        """
+        super(FrameWriter, self).__init__(name=name)
+        self.daemon = True
+        self.write = write
+        self.on_finish = on_finish
+        self.counters = counters
+        self.queue = queue if queue is not None else \
+            FrameQueue(maxsize, policy)
+        self.frames = 0
+        self.bytes_written = 0
+        self.error = None
+        self.finished = False
+        self._rate = (time.time(), 0, 0.)
+        self.start()
+
+    def put(self, item):
+        """Queue an item to be written."""
+        return self.queue.put(item)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            start = tick()
+            try:
+                self.write(item)
+            except Exception as e:
+                # Keep draining the queue so producers never block.
+                if self.error is None:
+                    logger.exception('Error in writer ' + self.name)
+                self.error = e
+                continue
+            timings.record('record', start)
+            self.frames += 1
+            self.bytes_written += _nbytes(item)
+            if self.counters is not None:
+                self.counters.count('recorded')
+        try:
+            if self.on_finish is not None:
+                self.on_finish()
+        except Exception as e:
+            logger.exception('Error finishing writer ' + self.name)
+            if self.error is None:
+                self.error = e
+        finally:
+            self.finished = True
+
+    def stop(self, wait=True):
+        """Write the frames already queued, then finish. If wait is
+        False, returns immediately and :attr:`finished` becomes True
+        once done.
+
+        """
+        self.queue.put(_STOP, force=True)
+        if wait:
+            self.join()
+
+    def throughput(self):
+        """Rate of writing in MB/s since the previous call."""
+        t0, b0, rate = self._rate
+        t = time.time()
+        if t - t0 >= 0.5:
+            rate = (self.bytes_written - b0)/(t - t0)/1e6
+            self._rate = (t, self.bytes_written, rate)
+        return rate
+
+    def stats(self):
+        """Get the writer's telemetry.
+
+        Returns
+        -------
+        dict
+            Queue depth and size, frames written, MB/s, frames dropped
+            by the queue and number of times a producer stalled waiting
+            for space.
+
+        """
+        return {
+            'depth': len(self.queue),
+            'maxsize': self.queue.maxsize,
+            'frames': self.frames,
+            'mb_per_s': self.throughput(),
+            'dropped': self.queue.dropped,
+            'stalls': self.queue.stalls,
+        }
+
+
+class RawRecorder(object):
+    """Writes frames to a raw recording from a dedicated thread.
+
+    Attributes
+    ----------
+    path : str
+        Path of the frame data file.
+    shape : tuple
+        Shape of each frame.
+    dtype : np.dtype
+        Pixel type of the recording.
+    settings : dict
+        Acquisition settings stored in the header and, unless
+        overridden, in each frame's index record.
+    count : int
+        Number of frames written so far.
+    missing : int
+        Number of images skipped between tagged frames, i.e. acquired
+        by the camera but not recorded.
+    writer : FrameWriter
+        Thread writing the frames.
+    thumb_every : int
+        Spacing in frames of the stored thumbnails, or 0 for none.
+    thumb_factor : int
+        Downsampling factor of the thumbnails.
+
+    """
+    def __init__(self, path, shape, dtype, settings=None, chunk_frames=64,
+                 maxsize=256, queue=None, thumb_every=THUMB_EVERY,
+                 thumb_factor=THUMB_FACTOR, counters=None):
+        """Create a recording and start its writer thread.
+
+        Parameters
+        ----------
+        chunk_frames : int
+            Number of frames of disk space to preallocate at a time.
+        maxsize : int
+            Maximum number of frames waiting to be written. When full,
+            :meth:`write` blocks.
+        queue : FrameQueue
+            Queue to take frames from instead of :meth:`write`, e.g. a
+            pipeline sink's queue.
+        thumb_every, thumb_factor : int
+            Thumbnail spacing and downsampling factor.
+        counters : FrameCounters
+            Camera frame counters to count written frames as recorded.
+
+        """
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.settings = dict(settings or {})
+        self.chunk_frames = chunk_frames
+        self.thumb_every = thumb_every
+        self.thumb_factor = thumb_factor
+        self.count = 0
+        self.missing = 0
+        self.first_image = self.last_image = None
+        self.frame_bytes = int(np.prod(self.shape))*self.dtype.itemsize
+        self.started = datetime.datetime.now().isoformat()
+
+        self._file = open(path, 'wb')
+        self._index = open(path + '.idx', 'wb')
+        self._thumbs = open(path + '.thumbs', 'wb') if thumb_every else None
+        self._allocated = 0
+        self._write_header(final=False)
+        self.writer = FrameWriter(self._write, self._finish, queue, maxsize,
+                                  'block', name='recorder', counters=counters)
+        logger.info('Recording to ' + path)
+
+    @property
+    def error(self):
+        return self.writer.error
+
+    @property
+    def finished(self):
+        return self.writer.finished
+
+    def write(self, frame, timestamp=None, settings=None):
+        """Queue a frame to be written.
+
+        Parameters
+        ----------
+        frame : np.ndarray
+            Frame with the recording's shape and pixel type.
+        timestamp : float
+            Acquisition time. Defaults to the current time.
+        settings : dict
+            Settings to store for this frame, if different from
+            :attr:`settings`.
+
+        """
+        self._check_frame(frame)
+        if timestamp is None:
+            timestamp = time.time()
+        self.writer.put((frame, timestamp, settings))
+
+    @staticmethod
+    def _unpack(item):
+        """Split a queued item into frame, timestamp, settings and SDK
+        image index. Items from a pipeline are bare frames.
+
+        """
+        if isinstance(item, tuple):
+            frame, timestamp, settings = item
+        else:
+            frame, timestamp, settings = item, time.time(), None
+        return frame, timestamp, settings, image_index(frame)
+
+    def _check_frame(self, frame):
+        """Refuse a frame which does not match the recording, e.g. one
+        queued before the binning, ROI or bit depth was changed, rather
+        than write it at the wrong offset or convert it.
+
+        """
+        if frame.shape != self.shape or frame.dtype != self.dtype:
+            raise RecordingError(
+                'Frame %s %s does not match recording %s %s' % (
+                    frame.shape, frame.dtype, self.shape, self.dtype))
+
+    def _check_image(self, image):
+        """Count any images skipped before a tagged frame. Indices
+        going backwards mean the camera was restarted.
+
+        """
+        if image is None:
+            return
+        if self.first_image is None:
+            self.first_image = image
+        elif image > self.last_image + 1:
+            self.missing += image - self.last_image - 1
+        self.last_image = image
+
+    def _add_record(self, frame, timestamp, settings, image=None):
+        """Add the index record and any thumbnail for the next frame."""
+        self._check_image(image)
+        if self._thumbs is not None and self.count % self.thumb_every == 0:
+            thumb = make_thumbnail(frame, self.thumb_factor)
+            self._thumbs.write(thumb.astype(self.dtype).tobytes())
+        record = frame_record(self.count, timestamp,
+                              self.count*self.frame_bytes,
+                              settings or self.settings, image)
+        self._index.write(record.tobytes())
+        self.count += 1
+
+    def _write(self, item):
+        frame, timestamp, settings, image = self._unpack(item)
+        self._check_frame(frame)
+        offset = self.count*self.frame_bytes
+        if self.count >= self._allocated:
+            self._allocated += self.chunk_frames
+            self._file.truncate(self._allocated*self.frame_bytes)
+            self._file.seek(offset)
+        frame = np.ascontiguousarray(frame)
+        self._file.write(frame.data)
+        self._add_record(frame, timestamp, settings, image)
+
+        # Keep the files on disk up to date whenever the writer catches
+        # up, so an interrupted recording loses as little as possible.
+        if not len(self.writer.queue):
+            self._flush()
+
+    def _flush(self):
+        self._file.flush()
+        self._index.flush()
+        if self._thumbs is not None:
+            self._thumbs.flush()
+
+    def header(self):
+        """Get the header describing the recording."""
+        return {
+            'version': FORMAT_VERSION,
+            'format': 'raw',
+            'shape': list(self.shape),
+            'dtype': self.dtype.str,
+            'frames': self.count,
+            'started': self.started,
+            'settings': self.settings,
+            'images': {
+                'first': self.first_image,
+                'last': self.last_image,
+                'missing': self.missing,
+            },
+            'thumbnails': {
+                'every': self.thumb_every,
+                'factor': self.thumb_factor,
+            },
+        }
+
+    def close(self, wait=True):
+        """Write any queued frames, then trim and close the files. If
+        wait is False, returns immediately and :attr:`finished` becomes
+        True once done.
+
+        """
+        self.writer.stop(wait)
+
+    def _finish(self):
+        self._file.truncate(self.count*self.frame_bytes)
+        self._close_files()
+
+    def _write_header(self, final):
+        """Write the header file. Until the recording is closed, the
+        frame count is null and readers count the index records.
+
+        """
+        header = self.header()
+        if not final:
+            header['frames'] = None
+        with open(self.path + '.json', 'w') as f:
+            json.dump(header, f, indent=2)
+
+    def _close_files(self):
+        self._file.close()
+        self._index.close()
+        if self._thumbs is not None:
+            self._thumbs.close()
+        self._write_header(final=True)
+        logger.info('Recorded %i frames to %s' % (self.count, self.path))
+        if self.missing:
+            logger.warn('%i acquired images are missing from %s' %
+                        (self.missing, self.path))
+
+
+def _shuffle(data, itemsize):
+    """Group the bytes of each significance together, which makes
+    pixel data far more compressible.
+
+    """
+    return np.frombuffer(data, np.uint8).reshape(-1, itemsize).T.tobytes()
+
+
+def _unshuffle(data, itemsize):
+    return np.frombuffer(data, np.uint8).reshape(itemsize, -1).T.tobytes()
+
+
+def compress_chunk(frames, codec='zlib', level=1):
+    """Compress a block of frames.
+
+    Parameters
+    ----------
+    frames : np.ndarray
+        Frames to compress.
+    codec : str
+        One of :data:`CODECS`.
+    level : int
+        Compression level of the codec.
+
+    Returns
+    -------
+    bytes
+
+    """
+    frames = np.ascontiguousarray(frames)
+    if codec == 'blosc':
+        return blosc.compress(frames.tobytes(), typesize=frames.itemsize,
+                              clevel=level, shuffle=blosc.SHUFFLE,
+                              cname='lz4')
+    elif codec == 'zlib':
+        return zlib.compress(_shuffle(frames.data, frames.itemsize), level)
+    raise RecordingError('Unknown codec: ' + repr(codec))
+
+
+def decompress_chunk(data, shape, dtype, codec='zlib'):
+    """Decompress a block of frames made by :func:`compress_chunk`.
+
+    Returns
+    -------
+    np.ndarray
+        Frames as an (N, height, width) array.
+
+    """
+    dtype = np.dtype(dtype)
+    if codec == 'blosc':
+        if blosc is None:
+            raise RecordingError('The blosc package is needed to read this '
+                                 'recording.')
+        data = blosc.decompress(data)
+    elif codec == 'zlib':
+        data = _unshuffle(zlib.decompress(data), dtype.itemsize)
+    else:
+        raise RecordingError('Unknown codec: ' + repr(codec))
+    return np.frombuffer(data, dtype).reshape((-1,) + tuple(shape))
+
+
+class ChunkedRecorder(RawRecorder):
+    """Writes frames to a compressed recording.
+
+    Frames are grouped into chunks of :attr:`chunk_frames`, which are
+    compressed in parallel by a pool of threads and written in order.
+    Both codecs release the GIL while compressing, so throughput scales
+    with the number of cores.
+
+    Besides the frame index and header of a raw recording, a chunked
+    recording has a ``<name>.chunks`` file with one
+    :data:`CHUNK_DTYPE` record per chunk giving its location in the
+    data file, so any frame can be read by decompressing one chunk.
+
+    Attributes
+    ----------
+    codec : str
+        Codec used to compress the chunks.
+    level : int
+        Compression level.
+    compressed_bytes : int
+        Size of the chunks written so far.
+
+    """
+    def __init__(self, path, shape, dtype, settings=None, chunk_frames=16,
+                 codec=None, level=None, workers=None, maxsize=256,
+                 queue=None, thumb_every=THUMB_EVERY,
+                 thumb_factor=THUMB_FACTOR, counters=None):
+        """Create a recording and start its writer thread.
+
+        Parameters
+        ----------
+        chunk_frames : int
+            Number of frames compressed together.
+        codec : str
+            One of :data:`CODECS`. Defaults to blosc if it is installed
+            and zlib otherwise.
+        level : int
+            Compression level. Defaults to a fast level of the codec.
+        workers : int
+            Number of compression threads. Defaults to the number of
+            CPUs.
+
+        """
+        if codec is None:
+            codec = 'blosc' if blosc is not None else 'zlib'
+        if codec not in CODECS or (codec == 'blosc' and blosc is None):
+            raise RecordingError('Codec not available: ' + repr(codec))
+        self.codec = codec
+        self.level = CODECS[codec] if level is None else level
+        self.compressed_bytes = 0
+        self._raw_bytes = 0
+        self._workers = workers or multiprocessing.cpu_count()
+        self._pool = ThreadPoolExecutor(self._workers)
+        self._pending = deque()
+        self._chunk = None
+        self._chunk_first = 0
+        self._chunks = open(path + '.chunks', 'wb')
+        super(ChunkedRecorder, self).__init__(
+            path, shape, dtype, settings, chunk_frames, maxsize, queue,
+            thumb_every, thumb_factor, counters)
+
+    @property
+    def ratio(self):
+        """Compression ratio achieved so far."""
+        if not self.compressed_bytes:
+            return 1.
+        return self._raw_bytes/self.compressed_bytes
+
+    def _write(self, item):
+        frame, timestamp, settings, image = self._unpack(item)
+        self._check_frame(frame)
+        if self._chunk is None:
+            self._chunk = np.empty((self.chunk_frames,) + self.shape,
+                                   self.dtype)
+            self._chunk_first = self.count
+        n = self.count - self._chunk_first
+        self._chunk[n] = frame
+        self._add_record(frame, timestamp, settings, image)
+        if n + 1 == self.chunk_frames:
+            self._submit()
+
+    def _submit(self):
+        """Start compressing the current chunk."""
+        frames = self._chunk[:self.count - self._chunk_first]
+        future = self._pool.submit(compress_chunk, frames, self.codec,
+                                   self.level)
+        self._pending.append((self._chunk_first, len(frames), future))
+        self._chunk = None
+
+        # Write out finished chunks, waiting if too many are in flight.
+        while self._pending and (self._pending[0][2].done() or
+                                 len(self._pending) > 2*self._workers):
+            self._write_chunk(*self._pending.popleft())
+
+    def _write_chunk(self, first, frames, future):
+        data = future.result()
+        record = np.zeros((), CHUNK_DTYPE)
+        record['offset'] = self._file.tell()
+        record['size'] = len(data)
+        record['first'] = first
+        record['frames'] = frames
+        self._file.write(data)
+        self._chunks.write(record.tobytes())
+        self.compressed_bytes += len(data)
+        self._raw_bytes += frames*self.frame_bytes
+        self._flush()
+        self._chunks.flush()
+
+    def _finish(self):
+        if self._chunk is not None:
+            self._submit()
+        while self._pending:
+            self._write_chunk(*self._pending.popleft())
+        self._pool.shutdown()
+        self._chunks.close()
+        self._close_files()
+        logger.info('Compression ratio %.2f' % self.ratio)
+
+    def header(self):
+        header = super(ChunkedRecorder, self).header()
+        header.update({
+            'format': 'chunked',
+            'codec': self.codec,
+            'level': self.level,
+            'chunk_frames': self.chunk_frames,
+        })
+        return header
+
+
+def load_raw(path):
+    """Open a raw recording.
+
+    Returns
+    -------
+    frames : np.memmap
+        The frames, as an (N, height, width) read-only memory map.
+    index : np.ndarray
+        The frame index records.
+    header : dict
+        The recording header.
+
+    """
+    with open(path + '.json') as f:
+        header = json.load(f)
+    if header['format'] != 'raw':
+        raise RecordingError('Not a raw recording: ' + path)
+    index = np.fromfile(path + '.idx', record_dtype(header))
+    if header['frames'] is not None:
+        index = index[:header['frames']]
+    shape = (len(index),) + tuple(header['shape'])
+    if not len(index):
+        return np.empty(shape, header['dtype']), index, header
+    frames = np.memmap(path, header['dtype'], 'r', shape=shape)
+    return frames, index, header
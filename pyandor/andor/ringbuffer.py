@@ -0,0 +1,222 @@
+"""Disk-backed ring buffer
+
+Keeps the last N frames from the camera in a preallocated,
+memory-mapped file so that recent history is always saved. The file
+starts with a header followed by an index with one record per slot
+(frame number, timestamp and geometry), and then the frame data.
+Writing a frame is a single copy into its slot and an update of its
+index record.
+
+Other processes can open the same file with :meth:`RingBuffer.open`
+to inspect recent frames without touching the camera.
+
+"""
+
+from __future__ import print_function, division
+import os.path
+import time
+import numpy as np
+
+from .log import logger
+
+_MAGIC = b'PYANDRB'
+_VERSION = 1
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('slots', '<u4'),
+    ('xpx', '<u4'),
+    ('ypx', '<u4'),
+    ('dtype', 'S8'),
+    ('count', '<u8'),
+])
+
+INDEX_DTYPE = np.dtype([
+    ('frame', '<u8'),
+    ('timestamp', '<f8'),
+    ('xpx', '<u4'),
+    ('ypx', '<u4'),
+    ('bins', '<u4'),
+    ('roi', '<i4', 4),
+])
+
+# Offsets of the index and the data in the file.
+_INDEX_OFFSET = 512
+_ALIGN = 4096
+
+
+def _data_offset(slots):
+    end = _INDEX_OFFSET + slots*INDEX_DTYPE.itemsize
+    return -(-end//_ALIGN)*_ALIGN
+
+
+class RingBuffer(object):
+    """Ring buffer of the most recent frames in a memory-mapped file.
+
+    Frames are numbered from 1 in the order written; frame ``n`` lives
+    in slot ``(n - 1) % slots``.
+
+    Attributes
+    ----------
+    path : str
+        Path to the buffer file.
+    slots : int
+        Number of frames held.
+    shape : tuple
+        Maximum (x, y) shape of a frame, as for the camera.
+    dtype : np.dtype
+        Pixel type. Frames are cast to it when written, but only if no
+        values can wrap (numpy's ``'same_kind'`` casting).
+    recording : bool
+        When False, :meth:`write` does nothing.
+    roi : list
+        Current region of interest, stored with each frame.
+    count : int
+        Total number of frames written.
+
+    """
+    def __init__(self, directory='.', recording=True, roi=None, slots=100,
+                 shape=(1024, 1024), dtype=np.uint16,
+                 filename='rbuffer.bin', mode='w+'):
+        """Create a new buffer file, or open an existing one.
+
+        Parameters
+        ----------
+        directory : str
+            Directory to store the buffer file in.
+        mode : str
+            ``'w+'`` to create (or overwrite) the file, ``'r+'`` to open
+            an existing file for writing or ``'r'`` to open it read
+            only. shape, dtype and slots are ignored unless creating.
+
+        """
+        self.path = os.path.join(directory, filename)
+        self.recording = recording
+        self.roi = roi if roi is not None else [0, 0, 0, 0]
+        self.bins = 1
+
+        if mode == 'w+':
+            dtype = np.dtype(dtype)
+            size = _data_offset(slots) + slots*shape[0]*shape[1]*dtype.itemsize
+            with open(self.path, 'wb') as f:
+                f.truncate(size)
+            header = np.memmap(self.path, HEADER_DTYPE, 'r+', 0, (1,))
+            header['magic'] = _MAGIC
+            header['version'] = _VERSION
+            header['slots'] = slots
+            header['xpx'], header['ypx'] = shape
+            header['dtype'] = dtype.str.encode()
+            header['count'] = 0
+            header.flush()
+            mode = 'r+'
+        else:
+            header = np.memmap(self.path, HEADER_DTYPE, mode, 0, (1,))
+            if header['magic'][0] != _MAGIC:
+                raise IOError('Not a ring buffer file: ' + self.path)
+
+        self._header = header
+        self.slots = int(header['slots'][0])
+        self.shape = (int(header['xpx'][0]), int(header['ypx'][0]))
+        self.dtype = np.dtype(header['dtype'][0].decode())
+        self.index = np.memmap(self.path, INDEX_DTYPE, mode, _INDEX_OFFSET,
+                               (self.slots,))
+        self._data = np.memmap(
+            self.path, self.dtype, mode, _data_offset(self.slots),
+            (self.slots, self.shape[0]*self.shape[1]))
+        logger.info('Ring buffer of %i frames at %s' %
+                    (self.slots, self.path))
+
+    @classmethod
+    def open(cls, path, mode='r'):
+        """Open an existing buffer file, read only by default."""
+        directory, filename = os.path.split(path)
+        return cls(directory, recording=mode != 'r', filename=filename,
+                   mode=mode)
+
+    @property
+    def count(self):
+        return int(self._header['count'][0])
+
+    def close(self):
+        """Flush and close the buffer file."""
+        if self._data is None:
+            return
+        if self._data.mode != 'r':
+            self._data.flush()
+            self.index.flush()
+            self._header.flush()
+        self._header = self.index = self._data = None
+
+    # Writing
+    # -------------------------------------------------------------------------
+
+    def write(self, frame, roi=None, bins=None, timestamp=None):
+        """Write a frame into the next slot.
+
+        Parameters
+        ----------
+        frame : np.ndarray
+            2D image no larger than :attr:`shape`.
+        roi, bins
+            Geometry to record with the frame. Defaults to the
+            :attr:`roi` and :attr:`bins` attributes.
+        timestamp : float
+            Acquisition time. Defaults to the current time.
+
+        Returns
+        -------
+        int or None
+            Frame number, or None if not recording.
+
+        """
+        if not self.recording:
+            return None
+        nx, ny = frame.shape
+        if nx > self.shape[0] or ny > self.shape[1]:
+            raise ValueError('Frame too large for ring buffer: ' +
+                             repr(frame.shape))
+        n = self.count + 1
+        slot = (n - 1) % self.slots
+        record = self.index[slot]
+
+        # Invalidate the slot while it is being written.
+        record['frame'] = 0
+        np.copyto(self._data[slot, :nx*ny].reshape(nx, ny), frame,
+                  casting='same_kind')
+        record['timestamp'] = time.time() if timestamp is None else timestamp
+        record['xpx'], record['ypx'] = nx, ny
+        record['bins'] = self.bins if bins is None else bins
+        record['roi'] = self.roi if roi is None else roi
+        record['frame'] = n
+        self._header['count'] = n
+        return n
+
+    # Reading
+    # -------------------------------------------------------------------------
+
+    def frame_numbers(self):
+        """Numbers of the frames currently held, oldest first."""
+        count = self.count
+        return list(range(max(1, count - self.slots + 1), count + 1))
+
+    def read(self, n):
+        """Get a copy of frame n and its index record, or (None, None)
+        if it is no longer in the buffer.
+
+        """
+        slot = (n - 1) % self.slots
+        record = self.index[slot].copy()
+        if n < 1 or record['frame'] != n:
+            return None, None
+        nx, ny = record['xpx'], record['ypx']
+        frame = np.array(self._data[slot, :nx*ny]).reshape(nx, ny)
+
+        # Check that it was not overwritten while copying.
+        if self.index[slot]['frame'] != n:
+            return None, None
+        return frame, record
+
+    def latest(self):
+        """Get a copy of the most recent frame and its index record."""
+        return self.read(self.count)
@@ -0,0 +1,250 @@
+"""ctypes bindings for the Andor SDK
+
+Declares the prototype of every SDK function pyandor uses, so that
+ctypes converts arguments directly instead of guessing their types on
+every call, and binds the functions once so that calling them is a
+plain attribute lookup.
+
+Out-parameters of frequently called functions should use the storage
+preallocated in :class:`OutParams`, passed with :func:`ctypes.byref`,
+rather than allocating new ctypes objects and pointers on every call.
+
+The library itself is found by :func:`load_library`: ``atmcd64d.dll``
+or ``atmcd32d.dll`` on Windows, depending on whether Python is 64 or
+32-bit, and ``libandor.so`` on Linux. A specific library can be chosen
+with the ``ANDOR_SDK_PATH`` environment variable.
+
+"""
+
+from __future__ import print_function, division
+import ctypes
+import ctypes.util
+import os.path
+import sys
+import threading
+
+from .andor_capabilities import AndorCapabilities
+from .log import logger
+
+# SDK types; at_32 and at_u32 are a long on Windows and an int
+# elsewhere, and are always 32 bits. Indices, counts and buffer sizes
+# all use them, never a plain long, which is 64 bits on 64-bit Linux.
+at_32 = ctypes.c_int32
+at_u32 = ctypes.c_uint32
+_int, _float = ctypes.c_int, ctypes.c_float
+_p = ctypes.POINTER
+
+#: Environment variable giving the path of the SDK library to load.
+SDK_PATH_VARIABLE = 'ANDOR_SDK_PATH'
+
+# The libraries shipped with pyandor are at the top of the repository.
+_PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+_WINDOWS = sys.platform.startswith('win')
+_LINUX = sys.platform.startswith('linux')
+
+#: Argument types of each SDK function. All return an unsigned int
+#: status code.
+PROTOTYPES = {
+    # Setup and shutdown
+    'Initialize': [ctypes.c_char_p],
+    'ShutDown': [],
+    'GetDetector': [_p(_int), _p(_int)],
+    'GetCapabilities': [_p(AndorCapabilities)],
+    'SetReadMode': [_int],
+    'SetFrameTransferMode': [_int],
+
+    # Acquisition
+    'SetAcquisitionMode': [_int],
+    'SetKineticCycleTime': [_float],
+    'SetTriggerMode': [_int],
+    'SetImage': [_int, _int, _int, _int, _int, _int],
+    'SetExposureTime': [_float],
+    'GetAcquisitionTimings': [_p(_float), _p(_float), _p(_float)],
+    'GetSizeOfCircularBuffer': [_p(at_32)],
+    'StartAcquisition': [],
+    'AbortAcquisition': [],
+    'GetStatus': [_p(_int)],
+    'SendSoftwareTrigger': [],
+    'WaitForAcquisition': [],
+    'WaitForAcquisitionTimeOut': [_int],
+    'CancelWait': [],
+
+    # Reading images
+    'GetTotalNumberImagesAcquired': [_p(at_32)],
+    'GetNumberAvailableImages': [_p(at_32), _p(at_32)],
+    'GetNumberNewImages': [_p(at_32), _p(at_32)],
+    'GetMostRecentImage': [_p(at_32), at_u32],
+    'GetMostRecentImage16': [_p(ctypes.c_uint16), at_u32],
+    'GetImages': [at_32, at_32, _p(at_32), at_u32, _p(at_32), _p(at_32)],
+    'GetImages16': [at_32, at_32, _p(ctypes.c_uint16), at_u32, _p(at_32),
+                    _p(at_32)],
+    'PostProcessNoiseFilter': [_p(at_32), _p(at_32), _int, _int, _int,
+                               _float, _int, _int],
+
+    # Gain
+    'GetNumberPreAmpGains': [_p(_int)],
+    'SetPreAmpGain': [_int],
+    'SetEMGainMode': [_int],
+    'GetEMGainRange': [_p(_int), _p(_int)],
+    'SetEMCCDGain': [_int],
+    'GetEMCCDGain': [_p(_int)],
+
+    # Shutter and cooling
+    'SetShutter': [_int, _int, _int, _int],
+    'GetTemperatureRange': [_p(_int), _p(_int)],
+    'SetTemperature': [_int],
+    'GetTemperature': [_p(_int)],
+    'CoolerON': [],
+    'CoolerOFF': [],
+}
+
+
+class SDKLoadError(Exception):
+    """The SDK library could not be found or loaded."""
+
+
+def library_name():
+    """Get the file name of the SDK library for this platform."""
+    if _WINDOWS:
+        return 'atmcd64d.dll' if ctypes.sizeof(ctypes.c_void_p) == 8 \
+            else 'atmcd32d.dll'
+    if _LINUX:
+        return 'libandor.so'
+    raise SDKLoadError('The Andor SDK is not available for ' + sys.platform)
+
+
+def default_init_dir():
+    """Get the directory passed to ``Initialize``, where the SDK
+    looks for its detector configuration files.
+
+    """
+    return '/usr/local/etc/andor' if _LINUX else '.'
+
+
+def _search_paths(name):
+    """Paths to try loading the library from, in order. The bare
+    name is last, so that the system's library search path is used.
+
+    """
+    dirs = [
+        getattr(sys, '_MEIPASS', None),  # frozen with PyInstaller
+        _PACKAGE_ROOT,
+        os.path.abspath(os.path.join('..', '..')),  # from pyandor/gui
+    ]
+    if _LINUX:
+        dirs.append('/usr/local/lib')
+    paths = [os.path.join(d, name) for d in dirs if d]
+    paths = [p for p in paths if os.path.exists(p)]
+    if _LINUX:
+        found = ctypes.util.find_library('andor')
+        if found:
+            paths.append(found)
+    return paths + [name]
+
+
+def load_library(path=None):
+    """Load the Andor SDK library.
+
+    Parameters
+    ----------
+    path : str or None
+        Path of the library. If None, the path in the
+        :data:`SDK_PATH_VARIABLE` environment variable is used if set,
+        otherwise the library for the platform is searched for next to
+        pyandor and on the system's library path.
+
+    Returns
+    -------
+    ctypes.CDLL
+        The library, loaded with WinDLL on Windows and CDLL elsewhere.
+
+    Raises
+    ------
+    SDKLoadError
+        If the library can't be found or loaded.
+
+    """
+    if path is None:
+        path = os.environ.get(SDK_PATH_VARIABLE) or None
+    if path is not None:
+        if not os.path.exists(path):
+            raise SDKLoadError('Andor SDK library not found: ' + path)
+        candidates = [path]
+    else:
+        candidates = _search_paths(library_name())
+
+    loader = ctypes.WinDLL if _WINDOWS else ctypes.CDLL
+    errors = []
+    for candidate in candidates:
+        try:
+            lib = loader(candidate)
+        except OSError as e:
+            errors.append('  %s: %s' % (candidate, e))
+            continue
+        logger.info('Loaded Andor SDK from ' + candidate)
+        return lib
+    raise SDKLoadError(
+        'Could not load the Andor SDK library. Tried:\n' +
+        '\n'.join(errors) + '\nSet %s to the path of the library, e.g. '
+        'if Python and the library are not both 32 or 64-bit.' %
+        SDK_PATH_VARIABLE)
+
+
+class AndorSDK(object):
+    """SDK functions bound from a library.
+
+    Every function in :data:`PROTOTYPES` which the library provides is
+    looked up once and stored as an attribute. For ctypes libraries,
+    the function's ``argtypes`` and ``restype`` are set as well. Other
+    library objects, such as :class:`simulated.SimulatedAndorSDK`, are
+    bound as they are.
+
+    Attributes
+    ----------
+    lib : object
+        The library the functions were bound from.
+
+    """
+    def __init__(self, lib):
+        self.lib = lib
+        missing = []
+        for name, argtypes in PROTOTYPES.items():
+            try:
+                func = getattr(lib, name)
+            except AttributeError:
+                missing.append(name)
+                continue
+            if isinstance(func, ctypes._CFuncPtr):
+                func.argtypes = argtypes
+                func.restype = ctypes.c_uint
+            setattr(self, name, func)
+        if missing:
+            logger.debug('SDK functions not found: ' +
+                         ', '.join(sorted(missing)))
+
+    def __getattr__(self, name):
+        # Functions without a prototype are bound on first use.
+        func = getattr(self.lib, name)
+        setattr(self, name, func)
+        return func
+
+
+class OutParams(threading.local):
+    """Preallocated out-parameter storage and references to pass to
+    SDK functions. Each thread gets its own set, so concurrent calls
+    never share storage.
+
+    """
+    def __init__(self):
+        self.int = _int()
+        self.int_ref = ctypes.byref(self.int)
+        self.first, self.last = at_32(), at_32()
+        self.first_ref = ctypes.byref(self.first)
+        self.last_ref = ctypes.byref(self.last)
+        self.exposure, self.accumulate, self.kinetic = \
+            _float(), _float(), _float()
+        self.timings_refs = (ctypes.byref(self.exposure),
+                             ctypes.byref(self.accumulate),
+                             ctypes.byref(self.kinetic))
@@ -0,0 +1,598 @@
+"""Simulated Andor SDK
+
+A pure-numpy stand-in for the Andor SDK library which can be passed to
+:class:`AndorCamera` in place of the real DLL, e.g.::
+
+    cam = AndorCamera(clib=SimulatedAndorSDK(readout_time=0.01))
+
+The simulator keeps a circular buffer with the same indexing semantics
+as the real driver and produces frames on a schedule determined by the
+exposure time, readout time and trigger mode. Frame contents are a
+noisy Gaussian spot, generated from a fixed seed. The clock and sleep
+functions can be replaced so that timing is fully deterministic.
+
+"""
+
+from __future__ import print_function, division
+import ctypes
+import threading
+import time
+from collections import deque
+import numpy as np
+
+from .andor_status_codes import ANDOR_STATUS
+
+_SUCCESS = ANDOR_STATUS['DRV_SUCCESS']
+_NO_NEW_DATA = ANDOR_STATUS['DRV_NO_NEW_DATA']
+_IDLE = ANDOR_STATUS['DRV_IDLE']
+_ACQUIRING = ANDOR_STATUS['DRV_ACQUIRING']
+_NOT_INITIALIZED = ANDOR_STATUS['DRV_NOT_INITIALIZED']
+
+# Values of SetAcquisitionMode and SetTriggerMode used by the simulator.
+_ACQ_SINGLE = 1
+_TRIGGER_INTERNAL = 0
+_TRIGGER_SOFTWARE = 10
+
+
+def _obj(arg):
+    """Get the ctypes object referred to by a pointer or byref
+    argument.
+
+    """
+    if isinstance(arg, ctypes._Pointer):
+        return arg.contents
+    if hasattr(arg, '_obj'):
+        return arg._obj
+    return arg
+
+
+def _value(arg):
+    """Get the Python value of a scalar argument."""
+    arg = _obj(arg)
+    return getattr(arg, 'value', arg)
+
+
+def _set(arg, value):
+    """Write a value to an output argument."""
+    _obj(arg).value = value
+
+
+def _array(arg, ctype, size):
+    """Get a numpy view of an output array argument."""
+    if isinstance(arg, ctypes._Pointer):
+        address = ctypes.addressof(arg.contents)
+    elif hasattr(arg, '_obj'):
+        address = ctypes.addressof(arg._obj)
+    elif isinstance(arg, ctypes.c_void_p):
+        address = arg.value
+    elif isinstance(arg, int):
+        address = arg
+    else:
+        address = ctypes.addressof(arg)
+    return np.frombuffer((ctype*size).from_address(address), dtype=ctype)
+
+
+class VirtualClock(object):
+    """Clock which only advances when slept on, for deterministic
+    simulations.
+
+    """
+    def __init__(self, start=0.):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def sleep(self, dt):
+        self.now += max(dt, 0)
+
+
+class SimulatedAndorSDK(object):
+    """Simulation of the subset of the Andor SDK used by pyandor.
+
+    Attributes
+    ----------
+    detector : tuple
+        Number of (horizontal, vertical) pixels.
+    readout_time : float
+        Time in s to read out the full sensor. The actual readout time
+        scales with the number of binned rows read.
+    buffer_frames : int
+        Capacity of the circular buffer in full, unbinned frames.
+    frame_rate : float or None
+        If set, the maximum frame rate regardless of exposure.
+
+    """
+    def __init__(self, detector=(1024, 1024), readout_time=0.03,
+                 buffer_frames=48, frame_rate=None, variants=8, seed=0,
+                 clock=None, sleep=None):
+        """Create a simulated SDK.
+
+        Parameters
+        ----------
+        variants : int
+            Number of distinct noise realizations to cycle through.
+            Frames are precomputed when the image geometry changes so
+            that generating them does not distort timing.
+        seed : int
+            Seed for the random number generator.
+        clock : callable
+            Function returning the current time in s. Defaults to
+            ``time.perf_counter``.
+        sleep : callable
+            Function used to wait for a number of s. Defaults to
+            waiting on an event which :meth:`CancelWait`, triggers
+            and aborts interrupt.
+
+        """
+        self.detector = tuple(detector)
+        self.readout_time = readout_time
+        self.buffer_frames = buffer_frames
+        self.frame_rate = frame_rate
+        self.variants = variants
+        self._rng = np.random.RandomState(seed)
+        self._clock = clock or getattr(time, 'perf_counter', time.time)
+        self._wake = threading.Event()
+        self._sleep = sleep or self._wake.wait
+        self._lock = threading.RLock()
+
+        x0 = self._rng.randint(self.detector[0]//4, self.detector[0]//2)
+        y0 = self._rng.randint(self.detector[1]//4, self.detector[1]//2)
+        self.spot_center = (x0, y0)
+
+        self.initialized = False
+        self.acq_mode = 5
+        self.trigger_mode = _TRIGGER_INTERNAL
+        self.exposure = 0.01
+        self.kinetic_cycle = 0.
+        self.gain = 0
+        self.cooler = False
+        self.set_point = 20
+        self.temperature = 20.
+        self.shutter = 0
+        self._temp_time = self._clock()
+        self._stable_since = None
+
+        self.acquiring = False
+        self._cancelled = False
+        self._t_first = None
+        self._triggers = deque()
+        self._triggered = 0
+        self._total = 0
+        self._retrieved = 0
+        self._waited = 0
+        self._set_image(1, 1, 1, self.detector[0], 1, self.detector[1])
+
+    # Simulation internals
+    # -------------------------------------------------------------------------
+
+    def _set_image(self, hbin, vbin, hstart, hend, vstart, vend):
+        self.image = (hbin, vbin, hstart, hend, vstart, vend)
+        self.frame_shape = ((hend - hstart + 1)//hbin,
+                            (vend - vstart + 1)//vbin)
+        self.frame_size = self.frame_shape[0]*self.frame_shape[1]
+        full_size = self.detector[0]*self.detector[1]
+        self.capacity = max(1, self.buffer_frames*full_size//self.frame_size)
+
+        # Gaussian spot on a noisy background, in binned coordinates.
+        x = (np.arange(hstart, hend + 1, hbin) - self.spot_center[0])
+        y = (np.arange(vstart, vend + 1, vbin) - self.spot_center[1])
+        x, y = x[:self.frame_shape[0]], y[:self.frame_shape[1]]
+        spot = 2000*np.exp(-(x[:, None]**2 + y[None, :]**2)/(2*40.**2))
+        spot *= hbin*vbin
+        self._bank = np.empty(
+            (self.variants,) + self.frame_shape, dtype=np.int32)
+        for frame in self._bank:
+            noise = self._rng.normal(
+                100*hbin*vbin, 10*hbin*vbin, self.frame_shape)
+            frame[:] = np.clip(spot + noise, 0, 65535)
+
+    def _readout(self):
+        hbin, vbin, hstart, hend, vstart, vend = self.image
+        rows = (vend - vstart + 1)/vbin
+        return self.readout_time*rows/self.detector[1]
+
+    def _cycle(self):
+        cycle = max(self.kinetic_cycle, self.exposure + self._readout())
+        if self.frame_rate:
+            cycle = max(cycle, 1./self.frame_rate)
+        return cycle
+
+    def _update(self):
+        """Bring the count of acquired images up to date."""
+        if not self.acquiring:
+            return
+        now = self._clock()
+        if self.trigger_mode == _TRIGGER_INTERNAL:
+            if now >= self._t_first:
+                total = int((now - self._t_first)//self._cycle()) + 1
+            else:
+                total = 0
+        else:
+            while self._triggers and self._triggers[0] <= now:
+                self._triggers.popleft()
+                self._triggered += 1
+            total = self._triggered
+        if self.acq_mode == _ACQ_SINGLE:
+            total = min(total, 1)
+        self._total = total
+        if self.acq_mode == _ACQ_SINGLE and total:
+            self.acquiring = False
+
+    def _next_frame_time(self):
+        """Time at which the next image will be acquired, or None if
+        it is waiting on a trigger.
+
+        """
+        if self.trigger_mode == _TRIGGER_INTERNAL:
+            return self._t_first + self._total*self._cycle()
+        return self._triggers[0] if self._triggers else None
+
+    def _available(self):
+        """First and last image indices still in the circular buffer."""
+        return max(1, self._total - self.capacity + 1), self._total
+
+    def _read_frame(self, index, out):
+        """Write the image with the given index into out. The first
+        pixel is stamped with the index so that gaps can be detected.
+        No temporary copies are made, so that the simulator does not
+        add to the allocations of code being benchmarked.
+
+        """
+        out[...] = self._bank[index % self.variants]
+        out.flat[0] = index & 0xffff
+
+    def trigger(self):
+        """Simulate an external trigger pulse."""
+        with self._lock:
+            start = self._clock()
+            if self._triggers:
+                start = max(start, self._triggers[-1])
+            self._triggers.append(start + self.exposure + self._readout())
+        self._wake.set()
+
+    # Setup and shutdown
+    # -------------------------------------------------------------------------
+
+    def Initialize(self, directory):
+        self.initialized = True
+        return _SUCCESS
+
+    def ShutDown(self):
+        self.initialized = False
+        return _SUCCESS
+
+    def GetDetector(self, xpx, ypx):
+        if not self.initialized:
+            return _NOT_INITIALIZED
+        _set(xpx, self.detector[0])
+        _set(ypx, self.detector[1])
+        return _SUCCESS
+
+    def GetCapabilities(self, caps):
+        caps = _obj(caps)
+        caps.ulAcqModes = 1 | 2 | 4 | 8 | 16
+        caps.ulTriggerModes = 1 | 2 | 16 | 32
+        caps.ulCameraType = 1  # iXon
+        return _SUCCESS
+
+    def SetReadMode(self, mode):
+        return _SUCCESS
+
+    def SetFrameTransferMode(self, mode):
+        return _SUCCESS
+
+    # Acquisition settings
+    # -------------------------------------------------------------------------
+
+    def SetImage(self, hbin, vbin, hstart, hend, vstart, vend):
+        args = [int(_value(x)) for x in
+                (hbin, vbin, hstart, hend, vstart, vend)]
+        if self.acquiring:
+            return _ACQUIRING
+        if args[0] < 1 or args[1] < 1:
+            return ANDOR_STATUS['DRV_P1INVALID']
+        if not 1 <= args[2] <= args[3] <= self.detector[0]:
+            return ANDOR_STATUS['DRV_P3INVALID']
+        if not 1 <= args[4] <= args[5] <= self.detector[1]:
+            return ANDOR_STATUS['DRV_P5INVALID']
+        with self._lock:
+            self._set_image(*args)
+        return _SUCCESS
+
+    def SetAcquisitionMode(self, mode):
+        if self.acquiring:
+            return _ACQUIRING
+        self.acq_mode = int(_value(mode))
+        return _SUCCESS
+
+    def SetTriggerMode(self, mode):
+        if self.acquiring:
+            return _ACQUIRING
+        self.trigger_mode = int(_value(mode))
+        return _SUCCESS
+
+    def SetExposureTime(self, t):
+        if self.acquiring:
+            return _ACQUIRING
+        self.exposure = float(_value(t))
+        return _SUCCESS
+
+    def SetKineticCycleTime(self, t):
+        if self.acquiring:
+            return _ACQUIRING
+        self.kinetic_cycle = float(_value(t))
+        return _SUCCESS
+
+    def GetAcquisitionTimings(self, exposure, accumulate, kinetic):
+        _set(exposure, self.exposure)
+        _set(accumulate, self.exposure + self._readout())
+        _set(kinetic, self._cycle())
+        return _SUCCESS
+
+    def GetSizeOfCircularBuffer(self, size):
+        _set(size, self.capacity)
+        return _SUCCESS
+
+    # Acquisition
+    # -------------------------------------------------------------------------
+
+    def StartAcquisition(self):
+        with self._lock:
+            if self.acquiring:
+                return _ACQUIRING
+            self.acquiring = True
+            self._cancelled = False
+            self._t_first = self._clock() + self.exposure + self._readout()
+            self._triggers.clear()
+            self._triggered = self._total = 0
+            self._retrieved = self._waited = 0
+        return _SUCCESS
+
+    def AbortAcquisition(self):
+        with self._lock:
+            if not self.acquiring:
+                return _IDLE
+            self._update()
+            self.acquiring = False
+        self._wake.set()
+        return _SUCCESS
+
+    def GetStatus(self, status):
+        with self._lock:
+            self._update()
+            _set(status, _ACQUIRING if self.acquiring else _IDLE)
+        return _SUCCESS
+
+    def SendSoftwareTrigger(self):
+        if self.trigger_mode != _TRIGGER_SOFTWARE:
+            return ANDOR_STATUS['DRV_INVALID_MODE']
+        if not self.acquiring:
+            return _IDLE
+        self.trigger()
+        return _SUCCESS
+
+    def _wait(self, timeout=None):
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            with self._lock:
+                self._wake.clear()
+                self._update()
+                if self._total > self._waited:
+                    self._waited = self._total
+                    return _SUCCESS
+                if self._cancelled or not self.acquiring:
+                    self._cancelled = False
+                    return _NO_NEW_DATA
+                next_t = self._next_frame_time()
+            now = self._clock()
+            if deadline is not None and now >= deadline:
+                return _NO_NEW_DATA
+            dt = 0.1 if next_t is None else max(next_t - now, 1e-6)
+            if deadline is not None:
+                dt = min(dt, deadline - now)
+            self._sleep(dt)
+
+    def WaitForAcquisition(self):
+        return self._wait()
+
+    def WaitForAcquisitionTimeOut(self, timeout_ms):
+        return self._wait(_value(timeout_ms)/1000.)
+
+    def CancelWait(self):
+        self._cancelled = True
+        self._wake.set()
+        return _SUCCESS
+
+    def GetTotalNumberImagesAcquired(self, index):
+        with self._lock:
+            self._update()
+            _set(index, self._total)
+        return _SUCCESS
+
+    def GetNumberAvailableImages(self, first, last):
+        with self._lock:
+            self._update()
+            if self._total == 0:
+                return _NO_NEW_DATA
+            a, b = self._available()
+        _set(first, a)
+        _set(last, b)
+        return _SUCCESS
+
+    def GetNumberNewImages(self, first, last):
+        with self._lock:
+            self._update()
+            a, b = self._available()
+            a = max(a, self._retrieved + 1)
+            if a > b:
+                return _NO_NEW_DATA
+        _set(first, a)
+        _set(last, b)
+        return _SUCCESS
+
+    def _get_most_recent(self, arr, size, ctype):
+        size = int(_value(size))
+        if size != self.frame_size:
+            return ANDOR_STATUS['DRV_P2INVALID']
+        with self._lock:
+            self._update()
+            if self._total == 0:
+                return _NO_NEW_DATA
+            index = self._total
+            self._retrieved = index
+        out = _array(arr, ctype, size)
+        out.shape = self.frame_shape
+        self._read_frame(index, out)
+        return _SUCCESS
+
+    def GetMostRecentImage(self, arr, size):
+        return self._get_most_recent(arr, size, ctypes.c_int32)
+
+    def GetMostRecentImage16(self, arr, size):
+        return self._get_most_recent(arr, size, ctypes.c_uint16)
+
+    def _get_images(self, first, last, arr, size, valid_first, valid_last,
+                    ctype):
+        first, last = int(_value(first)), int(_value(last))
+        size = int(_value(size))
+        if last < first:
+            return ANDOR_STATUS['DRV_P2INVALID']
+        if size < (last - first + 1)*self.frame_size:
+            return ANDOR_STATUS['DRV_P4INVALID']
+        with self._lock:
+            self._update()
+            a, b = self._available()
+            if first > b:
+                return _NO_NEW_DATA
+            # Like the SDK, refuse images which are not in the buffer.
+            if first < a:
+                return ANDOR_STATUS['DRV_P1INVALID']
+            if last > b:
+                return ANDOR_STATUS['DRV_P2INVALID']
+            a, b = first, last
+            self._retrieved = max(self._retrieved, b)
+        out = _array(arr, ctype, (b - a + 1)*self.frame_size)
+        out.shape = (b - a + 1,) + self.frame_shape
+        for i, index in enumerate(range(a, b + 1)):
+            self._read_frame(index, out[i])
+        _set(valid_first, a)
+        _set(valid_last, b)
+        return _SUCCESS
+
+    def GetImages(self, first, last, arr, size, valid_first, valid_last):
+        return self._get_images(first, last, arr, size, valid_first,
+                                valid_last, ctypes.c_int32)
+
+    def GetImages16(self, first, last, arr, size, valid_first, valid_last):
+        return self._get_images(first, last, arr, size, valid_first,
+                                valid_last, ctypes.c_uint16)
+
+    def PostProcessNoiseFilter(self, in_arr, out_arr, size, baseline, mode,
+                               threshold, width, height):
+        n = int(_value(width))*int(_value(height))
+        _array(out_arr, ctypes.c_int32, n)[:] = \
+            _array(in_arr, ctypes.c_int32, n)
+        return _SUCCESS
+
+    # Gain
+    # -------------------------------------------------------------------------
+
+    def GetNumberPreAmpGains(self, n):
+        _set(n, 3)
+        return _SUCCESS
+
+    def SetPreAmpGain(self, index):
+        return _SUCCESS
+
+    def SetEMGainMode(self, mode):
+        return _SUCCESS
+
+    def GetEMGainRange(self, low, high):
+        _set(low, 0)
+        _set(high, 255)
+        return _SUCCESS
+
+    def SetEMCCDGain(self, gain):
+        self.gain = int(_value(gain))
+        return _SUCCESS
+
+    def GetEMCCDGain(self, gain):
+        _set(gain, self.gain)
+        return _SUCCESS
+
+    # Shutter and cooling
+    # -------------------------------------------------------------------------
+
+    def SetShutter(self, typ, mode, closing_time, opening_time):
+        self.shutter = int(_value(mode))
+        return _SUCCESS
+
+    def GetTemperatureRange(self, low, high):
+        _set(low, -90)
+        _set(high, 30)
+        return _SUCCESS
+
+    def SetTemperature(self, temp):
+        self.set_point = int(_value(temp))
+        return _SUCCESS
+
+    def CoolerON(self):
+        self.cooler = True
+        return _SUCCESS
+
+    def CoolerOFF(self):
+        self.cooler = False
+        return _SUCCESS
+
+    def GetTemperature(self, temp):
+        # Approach the set point (or ambient) at 5 degrees per second.
+        now = self._clock()
+        target = self.set_point if self.cooler else 20
+        step = 5*(now - self._temp_time)
+        self._temp_time = now
+        delta = target - self.temperature
+        self.temperature += max(-step, min(step, delta))
+        _set(temp, int(round(self.temperature)))
+
+        if not self.cooler:
+            return ANDOR_STATUS['DRV_TEMPERATURE_OFF']
+        if abs(target - self.temperature) > 1:
+            self._stable_since = None
+            return ANDOR_STATUS['DRV_TEMPERATURE_NOT_REACHED']
+        if self._stable_since is None:
+            self._stable_since = now
+        if now - self._stable_since < 2:
+            return ANDOR_STATUS['DRV_TEMP_NOT_STABILIZED']
+        return ANDOR_STATUS['DRV_TEMPERATURE_STABILIZED']
+
+
+class CtypesSimulatedSDK(object):
+    """Simulated SDK called through ctypes.
+
+    Every function in :data:`sdk.PROTOTYPES` which the simulator
+    provides is wrapped in a ctypes callback with that prototype, so
+    calls go through the same argument conversion as calls into the
+    real library, and back into Python. This lets benchmarks measure
+    the cost of marshalling without the SDK installed, e.g.::
+
+        cam = AndorCamera(clib=CtypesSimulatedSDK(SimulatedAndorSDK()))
+
+    Attributes
+    ----------
+    sdk : SimulatedAndorSDK
+        The wrapped simulator. Functions without a prototype are
+        called on it directly.
+
+    """
+    def __init__(self, sdk):
+        from .sdk import PROTOTYPES
+        self.sdk = sdk
+        for name, argtypes in PROTOTYPES.items():
+            func = getattr(sdk, name, None)
+            if func is not None:
+                prototype = ctypes.CFUNCTYPE(ctypes.c_uint, *argtypes)
+                setattr(self, name, prototype(func))
+
+    def __getattr__(self, name):
+        return getattr(self.sdk, name)
@@ -0,0 +1,148 @@
+"""Timelapse acquisition
+
+:class:`Timelapse` captures single frames at a fixed interval and
+appends each one, with its timestamp and acquisition settings, to a
+raw recording (see :mod:`recording`). It runs in its own thread and
+does not depend on the GUI.
+
+Captures are scheduled on the monotonic clock relative to the start
+of the timelapse, so the time taken by each capture does not
+accumulate as drift: frame ``k`` is always due at ``start + k *
+interval``. If a capture overruns one or more intervals, the missed
+slots are skipped and logged rather than captured late.
+
+"""
+
+from __future__ import print_function, division
+import math
+import threading
+import time
+
+from .log import logger
+from .recording import RawRecorder, camera_settings
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+
+class Timelapse(threading.Thread):
+    """Thread capturing frames at fixed intervals into a recording.
+
+    The camera should not be acquiring when the timelapse starts, and
+    should not be used by anything else until it stops.
+
+    Attributes
+    ----------
+    interval : float
+        Time between frames in s.
+    frames : int
+        Number of frames captured so far.
+    skipped : int
+        Number of intervals skipped because a capture overran.
+    recorder : RawRecorder
+        Recording the frames are written to.
+
+    """
+    def __init__(self, camera, path, interval, duration=None, count=None,
+                 trigger_mode='internal', on_frame=None):
+        """Create a timelapse. Call :meth:`start` to begin.
+
+        Parameters
+        ----------
+        camera : Camera
+            Camera to capture from.
+        path : str
+            Path of the recording to write.
+        interval : float
+            Time between frames in s.
+        duration : float or None
+            Stop once this many seconds have passed.
+        count : int or None
+            Stop after this many frames. With neither duration nor
+            count, runs until :meth:`stop` is called.
+        trigger_mode : str
+            Trigger mode to capture each frame with.
+        on_frame : callable
+            Called from the timelapse thread with each frame.
+
+        """
+        super(Timelapse, self).__init__(name='timelapse')
+        self.daemon = True
+        if interval <= 0:
+            raise ValueError('Timelapse interval must be positive.')
+        self.cam = camera
+        self.path = path
+        self.interval = interval
+        self.duration = duration
+        self.count = count
+        self.trigger_mode = trigger_mode
+        self.on_frame = on_frame
+        self.frames = 0
+        self.skipped = 0
+        self.recorder = None
+        self._stop_event = threading.Event()
+
+    def stop(self, wait=True):
+        """Stop after any capture in progress and close the recording."""
+        self._stop_event.set()
+        if wait and self.is_alive():
+            self.join()
+
+    def capture(self):
+        """Capture a single frame with the timelapse's trigger mode,
+        leaving the camera's trigger mode as it was.
+
+        """
+        mode = self.cam.get_trigger_mode()
+        self.cam.set_trigger_mode(self.trigger_mode)
+        try:
+            self.cam.start()
+            return self.cam.get_image()
+        finally:
+            self.cam.stop()
+            self.cam.set_trigger_mode(mode)
+
+    def run(self):
+        self.cam.stop()
+        logger.info('Timelapse of one frame every %g s to %s' %
+                    (self.interval, self.path))
+        start = _monotonic()
+        k = 0
+        try:
+            while True:
+                due = k*self.interval
+                if self.duration is not None and due > self.duration:
+                    break
+                if self.count is not None and self.frames >= self.count:
+                    break
+                if self._stop_event.wait(max(0., start + due - _monotonic())):
+                    break
+
+                timestamp = time.time()
+                frame = self.capture()
+                if self.recorder is None:
+                    # Sized from the first frame, which reflects the
+                    # current ROI and binning.
+                    self.recorder = RawRecorder(
+                        self.path, frame.shape, frame.dtype,
+                        settings=camera_settings(self.cam), chunk_frames=16,
+                        thumb_every=1)
+                self.recorder.write(frame, timestamp,
+                                    camera_settings(self.cam))
+                self.frames += 1
+                if self.on_frame is not None:
+                    self.on_frame(frame)
+
+                # Schedule the next slot which is still in the future.
+                elapsed = _monotonic() - start
+                k_next = max(k + 1, int(math.ceil(elapsed/self.interval)))
+                if k_next > k + 1:
+                    logger.warn('Timelapse capture overran; skipped %i '
+                                'frame(s).' % (k_next - k - 1))
+                    self.skipped += k_next - k - 1
+                k = k_next
+        except Exception:
+            logger.exception('Timelapse stopped by an error.')
+        finally:
+            if self.recorder is not None:
+                self.recorder.close()
+            logger.info('Timelapse finished after %i frames.' % self.frames)
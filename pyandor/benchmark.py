@@ -0,0 +1,513 @@
+"""Acquisition benchmarks
+
+Runs the acquisition paths against the simulated SDK over a matrix of
+ROI sizes, binning levels and exposure times, and saves the results as
+JSON so runs can be compared over time::
+
+    python -m pyandor.benchmark -o before.json
+    # ... make changes ...
+    python -m pyandor.benchmark -o after.json --compare before.json
+
+Scenarios
+---------
+``single``
+    Start, read one image and stop, as for single exposures.
+``continuous``
+    Read the most recent image in a loop with :meth:`get_image`.
+``burst``
+    Wait for and drain every new image from the circular buffer.
+``recording``
+    Burst acquisition into a :class:`RawRecorder`.
+``display``
+    Continuous acquisition with each frame set on a pyqtgraph
+    ``ImageItem``, as the GUI display does. Without Qt, only the level
+    computation the display performs is timed.
+
+By default the simulator runs on a virtual clock, so exposure and
+readout take no real time and the measurements reflect only pyandor's
+own overhead, which makes them reproducible. Use ``--realtime`` to
+include the simulated camera timing.
+
+Each run reports sustained fps, p50 and p99 frame latency (from
+requesting a frame until it is delivered), CPU time, skipped frames
+and bytes allocated per frame, plus the latency of each instrumented
+stage (see :mod:`pyandor.andor.latency`). Allocations are measured
+with tracemalloc in a separate pass, on Python 3.9 or newer.
+
+The per-frame SDK queries are also timed on their own, through ctypes
+callbacks into the simulator (:class:`CtypesSimulatedSDK`), both
+untyped and through their prototypes (see :mod:`pyandor.andor.sdk`),
+as is checking the status code each SDK call returns.
+
+"""
+
+from __future__ import print_function, division
+import argparse
+import ctypes
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+import numpy as np
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from pyandor.andor import ANDOR_STATUS, AndorCamera
+from pyandor.andor.latency import timings
+from pyandor.andor.log import logger
+from pyandor.andor.recording import RawRecorder
+from pyandor.andor.sdk import OutParams
+from pyandor.andor.simulated import CtypesSimulatedSDK, SimulatedAndorSDK, \
+    VirtualClock
+
+_timer = getattr(time, 'perf_counter', time.time)
+_cpu = getattr(time, 'process_time', None) or time.clock
+
+SCENARIOS = ('single', 'continuous', 'burst', 'recording', 'display')
+DETECTOR = (1024, 1024)
+
+# Camera methods called for every frame, timed by measure_calls.
+CALLS = ('get_num_new_images', 'get_num_available_images',
+         'get_total_images_acquired', 'get_exposure_time',
+         'get_cooler_temperature')
+
+# Status codes timed through AndorCamera._chk by measure_calls.
+STATUS_CHECKS = ('DRV_SUCCESS', 'DRV_TEMPERATURE_NOT_REACHED')
+
+# SDK queries timed both untyped and through their prototypes by
+# measure_call_paths.
+CALL_PATHS = ('GetAcquisitionTimings', 'GetNumberAvailableImages',
+              'GetTotalNumberImagesAcquired', 'GetTemperature')
+
+
+# Scenarios
+# -----------------------------------------------------------------------------
+# Each scenario delivers n frames, calling context['tick']() after each
+# one, and returns their latencies in s.
+
+def run_single(cam, n, context):
+    latencies = []
+    for _ in range(n):
+        t0 = _timer()
+        cam.start()
+        cam.get_image()
+        cam.stop()
+        latencies.append(_timer() - t0)
+        context['tick']()
+    return latencies
+
+
+def run_continuous(cam, n, context):
+    latencies = []
+    cam.start()
+    try:
+        for _ in range(n):
+            t0 = _timer()
+            cam.get_image()
+            latencies.append(_timer() - t0)
+            context['tick']()
+    finally:
+        cam.stop()
+    return latencies
+
+
+def _burst(cam, n, context, consume):
+    latencies = []
+    cam.start()
+    try:
+        while len(latencies) < n:
+            t0 = _timer()
+            cam.wait_for_acquisition()
+            images, first = cam.drain_images()
+            if images is None:
+                continue
+            images = images[:n - len(latencies)]
+            for img in images:
+                consume(img)
+            latencies.extend([_timer() - t0]*len(images))
+            context['tick']()
+    finally:
+        cam.stop()
+    return latencies
+
+
+def run_burst(cam, n, context):
+    return _burst(cam, n, context, lambda img: None)
+
+
+def run_recording(cam, n, context):
+    recorder = RawRecorder(
+        os.path.join(context['tmpdir'], 'bench.raw'), cam.frame_pool.shape,
+        cam.get_dtype())
+    try:
+        return _burst(cam, n, context, recorder.write)
+    finally:
+        recorder.close()
+
+
+def run_display(cam, n, context):
+    display = context['display']
+    latencies = []
+    cam.start()
+    try:
+        for _ in range(n):
+            t0 = _timer()
+            display(cam.get_image())
+            latencies.append(_timer() - t0)
+            context['tick']()
+    finally:
+        cam.stop()
+    return latencies
+
+
+def _display_function():
+    """Get a function displaying a frame and the name of the backend."""
+    try:
+        import pyqtgraph as pg
+        app = pg.mkQApp()
+        item = pg.ImageItem()
+    except Exception:
+        def levels(img):
+            return np.nanmin(img), np.nanmax(img)
+        return levels, 'levels only'
+
+    def display(img):
+        item.setImage(img, autoLevels=True)
+        app.processEvents()
+    return display, 'pyqtgraph ImageItem'
+
+
+# Running
+# -----------------------------------------------------------------------------
+
+def make_camera(realtime=False, marshal=False):
+    """Connect to a simulated camera, called through ctypes if
+    marshal is True.
+
+    """
+    if realtime:
+        sdk = SimulatedAndorSDK(detector=DETECTOR)
+    else:
+        clock = VirtualClock()
+        sdk = SimulatedAndorSDK(detector=DETECTOR, clock=clock.time,
+                                sleep=clock.sleep)
+    if marshal:
+        sdk = CtypesSimulatedSDK(sdk)
+    return AndorCamera(clib=sdk, bit_depth=16, wait_for_temp=False)
+
+
+def configure(cam, roi_size, bins, exposure_ms):
+    """Set a centered square ROI, binning and exposure time."""
+    x0 = (DETECTOR[0] - roi_size)//2 + 1
+    y0 = (DETECTOR[1] - roi_size)//2 + 1
+    cam.reconfigure(roi=[x0, x0 + roi_size - 1, y0, y0 + roi_size - 1],
+                    bins=bins, exposure=exposure_ms)
+
+
+def measure(cam, scenario, frames, warmup, context):
+    """Run a scenario and summarize its performance."""
+    func = globals()['run_' + scenario]
+    func(cam, warmup, context)
+
+    timings.reset()
+    cam.counters.reset()
+    cpu0, t0 = _cpu(), _timer()
+    latencies = np.array(func(cam, frames, context))
+    wall, cpu = _timer() - t0, _cpu() - cpu0
+
+    result = {
+        'frames': len(latencies),
+        'fps': len(latencies)/wall,
+        'latency_p50_ms': 1e3*np.percentile(latencies, 50),
+        'latency_p99_ms': 1e3*np.percentile(latencies, 99),
+        'cpu_per_frame_ms': 1e3*cpu/len(latencies),
+        'bytes_per_frame': None,
+        'dropped': cam.counters.dropped,
+        'stages': timings.snapshot(),
+    }
+
+    # Allocations are measured separately since tracing slows things.
+    if hasattr(tracemalloc, 'reset_peak'):
+        n = max(frames//10, 10)
+        result['bytes_per_frame'] = _allocated(func, cam, n, context)/n
+    return result
+
+
+def _allocated(func, cam, n, context):
+    """Run a scenario, summing the memory allocated while delivering
+    each frame, i.e. the peak traced memory above that at the start of
+    the frame.
+
+    """
+    total = [0]
+
+    def tick():
+        current, peak = tracemalloc.get_traced_memory()
+        total[0] += peak - tick.base
+        tracemalloc.reset_peak()
+        tick.base = current
+
+    tracemalloc.start()
+    try:
+        tick.base = tracemalloc.get_traced_memory()[0]
+        context['tick'] = tick
+        func(cam, n, context)
+    finally:
+        tracemalloc.stop()
+        context['tick'] = _no_tick
+    return total[0]
+
+
+def _no_tick():
+    pass
+
+
+def measure_calls(cam, n=20000):
+    """Time the per-frame SDK queries and status checks.
+
+    Returns
+    -------
+    dict
+        Method name, or ``_chk(<status>)`` for status checks, to the
+        best time per call in us.
+
+    """
+    def best(func):
+        return 1e6*min(timeit.repeat(func, number=n, repeat=3))/n
+
+    cam.start()
+    try:
+        cam.get_image()
+        calls = dict((name, best(getattr(cam, name))) for name in CALLS)
+    finally:
+        cam.stop()
+    for status in STATUS_CHECKS:
+        code = ANDOR_STATUS[status]
+        calls['_chk(%s)' % status] = best(lambda: cam._chk(code))
+    return calls
+
+
+def _untyped(func):
+    """Get an untyped function pointer to a ctypes function, called
+    as SDK functions were before their prototypes were declared.
+
+    """
+    address = ctypes.cast(func, ctypes.c_void_p).value
+    untyped = ctypes.CFUNCTYPE(ctypes.c_uint)(address)
+    untyped.argtypes = None
+    return untyped
+
+
+def _call_path_functions(func, values, refs):
+    """Make functions calling func both ways, returning the values of
+    its outputs.
+
+    """
+    untyped = _untyped(func)
+    types = [type(value) for value in values]
+
+    def untyped_call():
+        # New output objects and pointers for every call.
+        outputs = [t() for t in types]
+        untyped(*[ctypes.pointer(output) for output in outputs])
+        return [output.value for output in outputs]
+
+    def prototype_call():
+        func(*refs)
+        return [value.value for value in values]
+    return untyped_call, prototype_call
+
+
+def measure_call_paths(cam, n=20000):
+    """Time SDK queries made untyped, with new output pointers for
+    every call, and through their bound prototypes with reused
+    :class:`OutParams`. cam must call the SDK through ctypes, e.g.
+    from ``make_camera(marshal=True)``.
+
+    Returns
+    -------
+    dict
+        SDK function name to the best time per call in us of each
+        path, as a dict with keys ``'untyped'`` and ``'prototype'``.
+
+    """
+    params = OutParams()
+    outputs = {
+        'GetAcquisitionTimings': (
+            (params.exposure, params.accumulate, params.kinetic),
+            params.timings_refs),
+        'GetNumberAvailableImages': (
+            (params.first, params.last), (params.first_ref, params.last_ref)),
+        'GetTotalNumberImagesAcquired': ((params.first,), (params.first_ref,)),
+        'GetTemperature': ((params.int,), (params.int_ref,)),
+    }
+    paths = {}
+    cam.start()
+    try:
+        cam.get_image()
+        for name in CALL_PATHS:
+            untyped_call, prototype_call = _call_path_functions(
+                getattr(cam.clib, name), *outputs[name])
+            assert untyped_call() == prototype_call()
+            paths[name] = dict(
+                (path, 1e6*min(timeit.repeat(func, number=n, repeat=3))/n)
+                for path, func in [('untyped', untyped_call),
+                                   ('prototype', prototype_call)])
+    finally:
+        cam.stop()
+    return paths
+
+
+def format_call_paths(paths):
+    lines = []
+    for name in CALL_PATHS:
+        if name in paths:
+            times = paths[name]
+            lines.append('{:<30} untyped {:>7.3f} us  prototype {:>7.3f} us'
+                         '  ({:+.1%})'.format(
+                             name, times['untyped'], times['prototype'],
+                             times['prototype']/times['untyped'] - 1))
+    return '\n'.join(lines)
+
+
+def _call_names():
+    return list(CALLS) + ['_chk(%s)' % status for status in STATUS_CHECKS]
+
+
+def format_calls(calls, baseline=None):
+    lines = []
+    for name in _call_names():
+        if name not in calls:
+            continue
+        line = '{:<40} {:>7.3f} us/call'.format(name, calls[name])
+        if baseline and name in baseline:
+            line += '  ({:+.1%})'.format(calls[name]/baseline[name] - 1)
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def run(scenarios=SCENARIOS, roi_sizes=(128, 512, 1024), bins=(1, 2, 4),
+        exposures=(1., 10.), frames=200, warmup=10, realtime=False):
+    """Run the benchmark matrix.
+
+    Returns
+    -------
+    dict
+        The report, with a ``meta`` description of the environment and
+        a list of ``results``.
+
+    """
+    cam = make_camera(realtime)
+    display, backend = _display_function()
+    context = {'tmpdir': tempfile.mkdtemp(prefix='pyandor-bench-'),
+               'display': display, 'tick': _no_tick}
+    results = []
+    try:
+        for roi_size in roi_sizes:
+            for b in bins:
+                for exposure in exposures:
+                    configure(cam, roi_size, b, exposure)
+                    for scenario in scenarios:
+                        result = {'scenario': scenario, 'roi': roi_size,
+                                  'bins': b, 'exposure_ms': exposure}
+                        result.update(measure(cam, scenario, frames, warmup,
+                                              context))
+                        results.append(result)
+                        print(format_result(result))
+    finally:
+        cam.close()
+        shutil.rmtree(context['tmpdir'], ignore_errors=True)
+
+    cam = make_camera(realtime, marshal=True)
+    try:
+        calls = measure_calls(cam)
+        print(format_calls(calls))
+        call_paths = measure_call_paths(cam)
+        print(format_call_paths(call_paths))
+    finally:
+        cam.close()
+
+    meta = {
+        'date': datetime.datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'clock': 'realtime' if realtime else 'virtual',
+        'display': backend,
+        'frames': frames,
+        'calls_backend': 'ctypes callbacks into the simulator',
+    }
+    return {'meta': meta, 'results': results, 'calls': calls,
+            'call_paths': call_paths}
+
+
+def _key(result):
+    return (result['scenario'], result['roi'], result['bins'],
+            result['exposure_ms'])
+
+
+def format_result(result, baseline=None):
+    line = ('{scenario:<11} roi {roi:>4} bins {bins} exp {exposure_ms:>5.1f} ms'
+            ' | {fps:>8.1f} fps  p50 {latency_p50_ms:>7.3f} ms'
+            '  p99 {latency_p99_ms:>7.3f} ms  cpu {cpu_per_frame_ms:>7.3f} ms'
+            '  {dropped:>5} dropped').format(**result)
+    if result['bytes_per_frame'] is not None:
+        line += '  {:>10.0f} B'.format(result['bytes_per_frame'])
+    if baseline is not None:
+        line += '  ({:+.1%} fps)'.format(result['fps']/baseline['fps'] - 1)
+    return line
+
+
+def compare(report, baseline):
+    """Print results alongside the change from a baseline report."""
+    old = dict((_key(r), r) for r in baseline['results'])
+    for result in report['results']:
+        print(format_result(result, old.get(_key(result))))
+    print(format_calls(report['calls'], baseline.get('calls')))
+    if 'call_paths' in report:
+        print(format_call_paths(report['call_paths']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pyandor.benchmark',
+        description='Benchmark acquisition against the simulated SDK.')
+    parser.add_argument('-o', '--output', help='JSON file to save results to')
+    parser.add_argument('--compare', help='JSON results to compare against')
+    parser.add_argument('-s', '--scenarios', nargs='+', choices=SCENARIOS,
+                        default=SCENARIOS)
+    parser.add_argument('--roi', type=int, nargs='+', default=[128, 512, 1024],
+                        help='square ROI sizes in pixels')
+    parser.add_argument('--bins', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--exposure', type=float, nargs='+', default=[1., 10.],
+                        help='exposure times in ms')
+    parser.add_argument('-n', '--frames', type=int, default=200,
+                        help='frames per run')
+    parser.add_argument('--realtime', action='store_true',
+                        help='run the simulated camera in real time')
+    args = parser.parse_args(argv)
+
+    # Configuration changes are logged at INFO; keep the report readable.
+    logger.setLevel('WARNING')
+
+    report = run(args.scenarios, args.roi, args.bins, args.exposure,
+                 args.frames, realtime=args.realtime)
+    if args.compare:
+        with open(args.compare) as f:
+            print('\nCompared with ' + args.compare)
+            compare(report, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,7 +6,10 @@ import time
 from collections import deque
 from pathlib import Path
 import datetime
-import functools
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
 
 import cv2
 import numpy as np
@@ -15,10 +18,15 @@ from PyQt4 import QtGui, QtCore
 from scipy.misc import imresize
 
 sys.path.append('../..')
-from pyandor.andor import AndorAcqInProgress
 from pyandor.andor import AndorCamera, AndorError
 from pyandor.andor import log
 from pyandor.andor.camthread import CameraThread
+from pyandor.andor.eventcapture import EventCapture
+from pyandor.andor.latency import tick, timings
+from pyandor.andor.pipeline import Pipeline
+from pyandor.andor.reader import CameraBuffer, FrameCache, ThumbnailBuilder, open_recording
+from pyandor.andor.recording import ChunkedRecorder, FrameWriter, RawRecorder, RecordingError, camera_settings
+from pyandor.andor.timelapse import Timelapse
 from pyandor.andor.log import logger, gui_logger
 
 log.setup_logging(logger, level=logging.INFO)
@@ -59,6 +67,7 @@ class Frame(QtGui.QMainWindow):
         self.setCentralWidget(self.main_widget)
 
         self.buffer_viewer = BufferFrame(self)
+        self.diagnostics = DiagnosticsFrame(self)
         self.show()
 
     def create_status_bar(self):
@@ -79,6 +88,7 @@ class Frame(QtGui.QMainWindow):
         """
         self.main_widget.shutdown_camera()
         self.buffer_viewer.close()
+        self.diagnostics.close()
         super(Frame, self).closeEvent(event)
 
 
@@ -101,9 +111,12 @@ class CentralWidget(QtGui.QWidget):
         self.overlay_active = False
         self.bins = 1
         self.old_sb_roi = np.array([1, 1024, 1, 1024])
+        self.timelapse = None
         self.timelapse_timer = None
-        self.timelapse_duration = None
-        self.f = None
+        self.event_capture = None
+        self.event_input_state = 0
+        self.recorder = None
+        self.writer = None
 
         self.trigger_mode = 'internal'
         if HAS_U3:
@@ -155,12 +168,19 @@ class CentralWidget(QtGui.QWidget):
         Attempts to connect to camera
         """
         try:
-            self.cam = AndorCamera()
+            self.cam = AndorCamera(bit_depth=16)
             self.cam.update_exposure_time(16)
 
             self.cam_thread = CameraThread(self.cam)
             self.cam_thread.image_signal.connect(self.image_viewer.update)
 
+            # frames, single exposures included, go through the pipeline;
+            # the display only ever shows the latest one
+            self.pipeline = Pipeline()
+            self.image_viewer.display_queue = self.pipeline.add_sink('display', policy='latest')
+            self.cam_thread.pipeline = self.pipeline
+            self.pipeline.start()
+
             # start capturing frames
             self.cam_thread.start()
             self.cam_thread.unpause()
@@ -225,6 +245,16 @@ class CentralWidget(QtGui.QWidget):
         self.button_view_buffer = QtGui.QPushButton('View Buffer')
         self.button_view_buffer.clicked.connect(self.on_button_view_buffer)
 
+        self.button_event_capture = QtGui.QPushButton('Event Capture')
+        self.button_event_capture.setCheckable(True)
+        self.button_event_capture.clicked.connect(self.on_button_event_capture)
+
+        self.button_mark_event = QtGui.QPushButton('Mark Event')
+        self.button_mark_event.clicked.connect(self.on_button_mark_event)
+
+        self.button_diagnostics = QtGui.QPushButton('Diagnostics')
+        self.button_diagnostics.clicked.connect(self.on_button_diagnostics)
+
         self.spinbox_exposure = QtGui.QDoubleSpinBox()
         self.spinbox_exposure.setRange(0, 10000)
         self.spinbox_exposure.setSingleStep(10)
@@ -258,6 +288,9 @@ class CentralWidget(QtGui.QWidget):
         layout_control_splitter.addWidget(self.spinbox_bins)
         layout_control_splitter.addWidget(self.button_screenshot)
         layout_control_splitter.addWidget(self.button_view_buffer)
+        layout_control_splitter.addWidget(self.button_event_capture)
+        layout_control_splitter.addWidget(self.button_mark_event)
+        layout_control_splitter.addWidget(self.button_diagnostics)
         layout_control_splitter.addLayout(self.setup_roi_controls())
 
         self.button_set_roi = QtGui.QPushButton('Set ROI')
@@ -432,6 +465,17 @@ class CentralWidget(QtGui.QWidget):
         self.status_buffer = QtGui.QLabel('Buffer: {}'.format(0))
         self.frame.statusbar.addPermanentWidget(self.status_buffer)
 
+        self.status_frames = QtGui.QLabel('Frames: 0/0, 0 dropped')
+        self.frame.statusbar.addPermanentWidget(self.status_frames)
+
+        self.status_record = QtGui.QLabel('Rec: off')
+        self.frame.statusbar.addPermanentWidget(self.status_record)
+
+        self.record_status_timer = QtCore.QTimer(self)
+        self.record_status_timer.timeout.connect(self.update_status_record)
+        self.record_status_timer.timeout.connect(self.update_status_frames)
+        self.record_status_timer.start(500)
+
     def update_overlay(self):
         """
         Updates the overlay.
@@ -474,18 +518,86 @@ class CentralWidget(QtGui.QWidget):
         checked = state == QtCore.Qt.Checked
 
         if checked:
-            filename = str(QtGui.QFileDialog.getSaveFileName(self, 'Video save', './', selectedFilter='*.mov'))
+            filename = str(QtGui.QFileDialog.getSaveFileName(self, 'Video save', './',
+                                                             filter='Video (*.mov);;Raw frames (*.raw);;Compressed frames (*.zraw)',
+                                                             selectedFilter='*.mov'))
             if not filename:
                 self.checkbox_record.setChecked(False)
                 return  # TODO: fix this (unchecks, but then recheck does nothing)
 
+            lossless = filename.endswith('.raw') or filename.endswith('.zraw')
+            if lossless and not self.connected:
+                gui_logger.warn('Connect to the camera before recording raw frames.')
+                self.checkbox_record.setChecked(False)
+                return
+
+            # frames are written from a dedicated thread, taking them straight from the pipeline when connected
+            queue = counters = None
+            if self.connected:
+                queue = self.pipeline.add_sink('record', policy='block', maxsize=64)
+                counters = self.cam.counters
+
+            if lossless:
+                # frames are written at their native bit depth, compressed in chunks for .zraw
+                recorder = ChunkedRecorder if filename.endswith('.zraw') else RawRecorder
+                shape = (self.cam.shape[0] // self.cam.bins, self.cam.shape[1] // self.cam.bins)
+                self.recorder = recorder(filename, shape, self.cam.get_dtype(),
+                                         settings=camera_settings(self.cam), queue=queue, counters=counters)
+                self.writer = self.recorder.writer
+                gui_logger.info('Will save raw recording to:\n\t\t{}'.format(filename))
+                return
+
             self.image_viewer.init_out(filename)
+            self.writer = FrameWriter(self.image_viewer.write_out, self.image_viewer.release_out,
+                                      queue=queue, name='video', counters=counters)
             gui_logger.info('Will save recording to:\n\t\t{}'.format(filename))
             self.image_viewer.to_out = checked
 
-        else:
+        elif self.writer is not None:
             self.image_viewer.to_out = checked
-            self.image_viewer.release_out()
+            if self.connected:
+                self.pipeline.remove_sink('record')
+            # frames still queued are written in the background, see update_status_record
+            if self.recorder is not None:
+                self.recorder.close(wait=False)
+            else:
+                self.writer.stop(wait=False)
+            self.status_record.setText('Rec: saving...')
+
+    def update_status_record(self):
+        """
+        Shows the recording writer's telemetry and finishes up once a stopped recording is saved.
+        """
+        if self.writer is None:
+            return
+
+        if self.writer.finished:
+            if self.recorder is not None:
+                gui_logger.info('Saved {} raw frames, {} acquired frames missing.'.format(
+                    self.recorder.count, self.recorder.missing))
+            if self.writer.error is not None:
+                gui_logger.error('Recording incomplete: {}'.format(self.writer.error))
+            self.writer = None
+            self.recorder = None
+            self.status_record.setText('Rec: off')
+            return
+
+        stats = self.writer.stats()
+        text = 'Rec: {depth}/{maxsize} queued, {mb_per_s:.1f} MB/s, {dropped} dropped, {stalls} stalls'.format(**stats)
+        if hasattr(self.recorder, 'ratio'):
+            text += ', {:.2f}x compression'.format(self.recorder.ratio)
+        if self.checkbox_record.isChecked():
+            self.status_record.setText(text)
+
+    def update_status_frames(self):
+        """
+        Shows how many frames the camera acquired and delivered, and how many were dropped in between.
+        """
+        if not self.connected:
+            return
+
+        counts = self.cam.counters.snapshot()
+        self.status_frames.setText('Frames: {delivered}/{acquired}, {dropped} dropped'.format(**counts))
 
     def on_button_capture_overlay(self):
         """
@@ -536,6 +648,9 @@ class CentralWidget(QtGui.QWidget):
             return
 
         if self.button_start_pause.text() == start:
+            if self.timelapse is not None:
+                gui_logger.warn('Cannot start while a timelapse is running.')
+                return
             self.cam_thread.unpause()
             self.playing = True
             self.status_playing.setText('Playing')
@@ -572,18 +687,76 @@ class CentralWidget(QtGui.QWidget):
 
     def on_button_view_buffer(self):
         """
-        Captures a single frame and writes to file.
+        Shows the images in the camera's circular buffer.
         """
         if not self.connected:
             gui_logger.warn('Not connected to camera.')
             return
 
-        first, last = self.cam.get_num_available_images()
-        img_array, size, shape, bins = self.cam.acquire_images(first+1, last)
-        step = img_array.size // size
-
+        # frames are read from the camera in pages as they are viewed
         self.frame.buffer_viewer.show()
-        self.frame.buffer_viewer.update_buffer_param(img_array, size, shape, bins, step)
+        self.frame.buffer_viewer.set_source(CameraBuffer(self.cam), 'Camera Buffer')
+
+    def on_button_diagnostics(self):
+        """
+        Shows the latency of each stage of the acquisition and display path.
+        """
+        self.frame.diagnostics.show()
+        self.frame.diagnostics.raise_()
+
+    def on_button_event_capture(self):
+        """
+        Toggles keeping a rolling history of frames for saving around events.
+        """
+        checked = self.button_event_capture.isChecked()
+
+        if not self.connected:
+            gui_logger.warn('Not connected to camera.')
+            self.button_event_capture.setChecked(False)
+            return
+
+        if checked:
+            savedir = str(QtGui.QFileDialog.getExistingDirectory(self, 'Event save directory', './'))
+            if not savedir:
+                self.button_event_capture.setChecked(False)
+                return
+
+            # history is sized from the current geometry and the camera's frame rate
+            self.event_capture = EventCapture.for_camera(self.cam, directory=savedir)
+            self.pipeline.add_sink('event', self.event_capture.add, policy='block', maxsize=64)
+
+            # poll labjack input for event triggers
+            if HAS_U3:
+                self.event_input_timer = QtCore.QTimer(self)
+                self.event_input_timer.timeout.connect(self.poll_event_input)
+                self.event_input_timer.start(5)
+
+        else:
+            if HAS_U3:
+                self.event_input_timer.stop()
+            self.pipeline.remove_sink('event')
+            # finish saving any event still being captured
+            self.event_capture.close()
+            self.event_capture = None
+
+    def on_button_mark_event(self):
+        """
+        Saves the frames around now to disk.
+        """
+        if self.event_capture is None:
+            gui_logger.warn('Event capture not active.')
+            return
+
+        self.event_capture.trigger()
+
+    def poll_event_input(self):
+        """
+        Marks an event on a rising edge of the labjack input.
+        """
+        state = self.d.getFIOState(5)
+        if state and not self.event_input_state:
+            self.on_button_mark_event()
+        self.event_input_state = state
 
     def send_trigger(self, t=None):
         """
@@ -645,7 +818,7 @@ class CentralWidget(QtGui.QWidget):
         """
         Changes the exposure time of the camera (in ms)
         """
-        if self.image_viewer.to_out:
+        if self.image_viewer.to_out or self.recorder is not None:
             gui_logger.warn('Cannot update binning while recording')
             self.spinbox_bins.setValue(self.bins)
             return
@@ -659,29 +832,17 @@ class CentralWidget(QtGui.QWidget):
 
         bins = [1, 2, 4, 8, 16, 32, 64]
 
-        if b in bins:
-            self.cam_thread.pause()
-            time.sleep(.3)
-
-            # sometimes doesn't pause in time if rapid switch
-            try:
-                self.cam.set_bins(b)
-                self.bins = b
-                if b == 1:
-                    self.image_viewer.noise_kernel = np.ones((3, 3), np.uint8)
-                else:
-                    self.image_viewer.noise_kernel = np.ones((1, 1), np.uint8)
-
-            except AndorAcqInProgress:
-                raise
-
-            time.sleep(.1)
+        if b == self.bins:
+            return
 
-            if self.playing:
-                self.cam_thread.unpause()
-                # need to wait for unpause, in case try to change binning again
-                while self.cam_thread.paused:
-                    pass
+        if b in bins:
+            # applied by the camera thread between frames
+            self.cam_thread.reconfigure(bins=b)
+            self.bins = b
+            if b == 1:
+                self.image_viewer.noise_kernel = np.ones((3, 3), np.uint8)
+            else:
+                self.image_viewer.noise_kernel = np.ones((1, 1), np.uint8)
 
         else:  # TODO: decide if pass or only arrows
             # pass
@@ -728,7 +889,7 @@ class CentralWidget(QtGui.QWidget):
 
         :return:
         """
-        if self.image_viewer.to_out:
+        if self.image_viewer.to_out or self.recorder is not None:
             gui_logger.warn('Cannot update binning while recording')
             self.spinbox_bins.setValue(self.bins)
             return
@@ -738,9 +899,6 @@ class CentralWidget(QtGui.QWidget):
             self.spinbox_bins.setValue(self.bins)
             return
 
-        self.cam_thread.pause()
-        time.sleep(.3)
-
         roi = [self.spinbox_y1.value(),
                self.spinbox_y2.value(),
                self.spinbox_x1.value(),
@@ -748,25 +906,12 @@ class CentralWidget(QtGui.QWidget):
 
         roi = list(map(int, roi))
 
-        # sometimes doesn't pause in time if rapid switch
-        try:
-            self.cam.set_roi(roi)
-            self.image_viewer.roi_value = roi
-
-            self.image_viewer.roi.setPos([0, 0])
-            if self.image_viewer.ui.roiBtn.isChecked():
-                self.image_viewer.ui.roiBtn.toggle()
+        self.cam_thread.reconfigure(roi=roi)
+        self.image_viewer.roi_value = roi
 
-        except AndorAcqInProgress:
-            raise
-
-        time.sleep(.1)
-
-        if self.playing:
-            self.cam_thread.unpause()
-            # need to wait for unpause, in case try to change binning again
-            while self.cam_thread.paused:
-                pass
+        self.image_viewer.roi.setPos([0, 0])
+        if self.image_viewer.ui.roiBtn.isChecked():
+            self.image_viewer.ui.roiBtn.toggle()
 
     def on_button_reset_roi(self):
         """
@@ -774,7 +919,7 @@ class CentralWidget(QtGui.QWidget):
 
         :return:
         """
-        if self.image_viewer.to_out:
+        if self.image_viewer.to_out or self.recorder is not None:
             gui_logger.warn('Cannot update binning while recording')
             self.spinbox_bins.setValue(self.bins)
             return
@@ -786,31 +931,17 @@ class CentralWidget(QtGui.QWidget):
         if self.image_viewer.ui.roiBtn.isChecked():
             self.image_viewer.ui.roiBtn.toggle()
 
-        self.cam_thread.pause()
-        time.sleep(.3)
-
         roi = [1,
                1024,
                1,
                1024]
 
-        # sometimes doesn't pause in time if rapid switch
-        try:
-            self.cam.set_roi(roi)
-            self.image_viewer.roi_value = roi
-            self.bins = 1
-            self.spinbox_bins.setValue(self.bins)
-
-        except AndorAcqInProgress:
-            raise
-
-        time.sleep(.1)
-
-        if self.playing:
-            self.cam_thread.unpause()
-            # need to wait for unpause, in case try to change binning again
-            while self.cam_thread.paused:
-                pass
+        # roi and binning are reset together in one change
+        self.cam_thread.reconfigure(roi=roi, bins=1)
+        self.image_viewer.roi_value = roi
+        self.bins = 1
+        self.image_viewer.noise_kernel = np.ones((3, 3), np.uint8)
+        self.spinbox_bins.setValue(self.bins)
 
     def on_slider_overlay_opacity(self):
         """
@@ -843,49 +974,65 @@ class CentralWidget(QtGui.QWidget):
         checked = self.button_timelapse.isChecked()
 
         if checked:
-            filename = str(QtGui.QFileDialog.getSaveFileName(self, 'Timelapse save', './', selectedFilter='*.png'))
-            if not filename:
+            filename = str(QtGui.QFileDialog.getSaveFileName(self, 'Timelapse save', './',
+                                                             filter='Raw frames (*.raw)', selectedFilter='*.raw'))
+            if not filename or not self.connected:
+                if not self.connected:
+                    gui_logger.warn('Not connected to camera.')
                 if self.button_timelapse.isChecked():
                     self.button_timelapse.toggle()
                 return
 
             p = Path(filename)
-            timelapse_savedir = p.parent
-            timelapse_root = p.stem
+            if not p.parent.exists():
+                p.parent.mkdir(parents=True, exist_ok=False)
 
-            self.timelapse_init(timelapse_savedir, timelapse_root)
+            self.timelapse_init(str(p.with_suffix('.raw')))
 
         else:
             self.timelapse_stop()
 
-    def timelapse_init(self, savedir, name_root):
+    def timelapse_init(self, path):
         """
         Starts the timelapse
+
+        :param path: recording to save frames to
         """
-        if self.timelapse_timer is not None:
+        if self.timelapse is not None:
             return
 
         if self.playing:
             self.on_button_start_pause()
+            # the timelapse needs the camera to itself
+            if not self.cam_thread.wait_paused(timeout=5.):
+                gui_logger.warn('Camera did not pause; not starting timelapse.')
+                self.button_timelapse.setChecked(False)
+                return
 
-        if not Path(savedir).exists():
-            Path(savedir).mkdir(parents=True, exist_ok=False)
-
-        # timer for flashing overlay
-        self.timelapse_timer = QtCore.QTimer(self)
-        self.timelapse_timer.timeout.connect(functools.partial(self.timelapse_capture, savedir, name_root))
-
-        timer_interval = self.spinbox_interval_minutes.value() * 60000 + self.spinbox_interval_secs.value() * 1000
+        interval = self.spinbox_interval_minutes.value() * 60 + self.spinbox_interval_secs.value()
+        if interval <= 0:
+            gui_logger.warn('Set a timelapse interval first.')
+            self.button_timelapse.setChecked(False)
+            return
+        duration = self.spinbox_duration_hours.value() * 3600 or None
 
-        # timer for stopping timelapse
-        self.timelapse_duration = QtCore.QTimer(self)
-        self.timelapse_duration.timeout.connect(self.timelapse_stop)
+        # frames are captured on the timelapse's own schedule and shown as they arrive
+        self.timelapse = Timelapse(self.cam, path, interval, duration=duration, trigger_mode=self.trigger_mode,
+                                   on_frame=self.cam_thread.image_signal.emit)
+        self.timelapse.start()
+        gui_logger.info('Saving timelapse to:\n\t\t{}'.format(path))
 
-        duration = self.spinbox_duration_hours.value() * 3e6 + timer_interval / 2
+        # timer for noticing the timelapse has finished
+        self.timelapse_timer = QtCore.QTimer(self)
+        self.timelapse_timer.timeout.connect(self.timelapse_poll)
+        self.timelapse_timer.start(1000)
 
-        # start timers
-        self.timelapse_timer.start(timer_interval)
-        self.timelapse_duration.start(duration)
+    def timelapse_poll(self):
+        """
+        Updates the controls once the timelapse has finished
+        """
+        if self.timelapse is not None and not self.timelapse.is_alive():
+            self.timelapse_stop()
 
     def timelapse_stop(self):
         """
@@ -896,50 +1043,34 @@ class CentralWidget(QtGui.QWidget):
             self.timelapse_timer.stop()
             self.timelapse_timer = None
 
-            self.timelapse_duration.stop()
-            self.timelapse_duration = None
+        if self.timelapse is not None:
+            self.timelapse.stop()
+            self.timelapse = None
 
         if self.button_timelapse.isChecked():
             self.button_timelapse.toggle()
 
-        try:
-            self.cam_thread.image_signal.disconnect(self.f)
-        except:
-            raise
-
-    def timelapse_capture(self, savedir, name_root):
-        """
-        Captures the timelapse image.
-        """
-        gui_logger.info('Capturing timelapse image')
-        date_string = datetime.datetime.now().strftime('%Y_%m_%d_%H%M%S')
-        self.on_button_single()
-        save_name = Path(savedir) / (name_root + '_' + date_string + '.png')
-
-        # need to wait for image to be captured before writing
-        if self.f is not None:
-            self.cam_thread.image_signal.disconnect(self.f)
-        self.f = functools.partial(self.delayed_screenshot, str(save_name))
-        self.cam_thread.image_signal.connect(self.f)
-
-    def delayed_screenshot(self, save_name):
-        """
-        Does a delayed screenshot
-        """
-        f = functools.partial(self.image_viewer.write_screenshot, str(save_name))
-        QtCore.QTimer.singleShot(self.spinbox_exposure.value() * 2, f)
-
     def shutdown_camera(self):
         """
         Intercept close event to properly shut down camera and thread.
         """
         gui_logger.info('Gracefully exiting.')
 
-        if self.image_viewer.out is not None:
+        if self.checkbox_record.isChecked():
             self.checkbox_record.setChecked(False)
+        if self.writer is not None:
+            self.writer.join()
+        if self.timelapse is not None:
+            self.timelapse_stop()
+        if self.button_event_capture.isChecked():
+            self.button_event_capture.setChecked(False)
+            self.on_button_event_capture()
 
         if self.connected:
             self.cam_thread.stop()
+            # the thread wakes as soon as it is told to stop
+            self.cam_thread.wait(2000)
+            self.pipeline.stop()
             self.cam.close()
 
 
@@ -989,6 +1120,12 @@ class ImageWidget(pg.ImageView, object):
         self.deque = deque([0], maxlen=10)
         self.fps = 7
 
+        # latest frame from the pipeline, polled by the display timer
+        self.display_queue = None
+        self.display_timer = QtCore.QTimer(self)
+        self.display_timer.timeout.connect(self.poll_display)
+        self.display_timer.start(10)
+
         self.roi.removeHandle(1)
 
     def update(self, img_data=None):
@@ -998,16 +1135,24 @@ class ImageWidget(pg.ImageView, object):
         :param img_data: image data, if None only updates overlay
         """
         if img_data is not None:
+            cam_thread = getattr(self.parent, 'cam_thread', None)
+            if cam_thread is not None and cam_thread.handoff is not None:
+                timings.record('handoff', cam_thread.handoff)
+
+            start = tick()
             self.setImage(img_data,
                           autoLevels=self.do_autolevel,
                           autoRange=self.previous_size != img_data.shape,
                           autoHistogramRange=self.do_autolevel
                           )
+            timings.record('display', start)
             self.previous_size = img_data.shape
+            if self.parent.connected:
+                self.parent.cam.counters.count('displayed')
 
             try:
                 first, last = self.parent.cam.get_num_available_images()
-                buffer_size = last - first
+                buffer_size = max(0, last - first)
             except (AndorError, AttributeError):
                 buffer_size = 0
             self.parent.status_buffer.setText('Buffer: {}'.format(buffer_size))
@@ -1021,10 +1166,12 @@ class ImageWidget(pg.ImageView, object):
             #     r = self.parent.timelapse_timer.remainingTime()
             #     print(r)
 
-            if self.to_out:
-                self.write_out(img_data)
+            # without a pipeline, record from the display path
+            if self.to_out and self.display_queue is None:
+                self.parent.writer.put(img_data)
 
         if self.parent.overlay_active:
+            start = tick()
             if self.do_threshold:
 
                 if img_data is not None and img_data.shape != self.overlay_image.shape:
@@ -1038,6 +1185,21 @@ class ImageWidget(pg.ImageView, object):
 
             else:
                 self.viewer_overlay.setImage(self.overlay_image, opacity=self.overlay_opacity)
+            timings.record('overlay', start)
+
+    def poll_display(self):
+        """
+        Displays the latest frame from the pipeline, if there is a new one.
+        """
+        if self.display_queue is None:
+            return
+
+        try:
+            img_data = self.display_queue.get(block=False)
+        except Empty:
+            return
+
+        self.update(img_data)
 
     def threshold_overlay(self, img, thresh_value):
         """
@@ -1259,7 +1421,10 @@ class ImageWidget(pg.ImageView, object):
 
 class BufferFrame(QtGui.QMainWindow):
     """
-    Main window
+    Viewer for the camera buffer and for recordings on disk.
+
+    Frames are read from the source through a FrameCache, which keeps a bounded number of frames and reads ahead of
+    the playhead in a background thread, so sources of any length can be scrubbed and played back.
     """
     def __init__(self, parent=None):
         """
@@ -1274,21 +1439,32 @@ class BufferFrame(QtGui.QMainWindow):
         self.central_widget = QtGui.QWidget()
 
         # viewer params
-        self.img_array = None
-        self.size = None
-        self.shape = None
-        self.bins = None
-        self.step = None
+        self.source = None
+        self.cache = None
+        self.size = 0
         self.current_index = None
+        self.play_fps = 30.
+        self.play_position = 0.
+
+        # thumbnail builders, kept per recording so they are only made once
+        self.thumbnails = None
+        self.thumbnail_cache = {}
+        self.filmstrip_timer = QtCore.QTimer(self)
+        self.filmstrip_timer.timeout.connect(self.update_filmstrip)
 
         self.statusbar = self.create_status_bar()
         # init central widget
         self.viewer = pg.ImageView()
 
+        self.play_timer = QtCore.QTimer(self)
+        self.play_timer.timeout.connect(self.on_play_timer)
+
         # top level layout
         layout_frame = QtGui.QVBoxLayout()
 
         layout_frame.addWidget(self.viewer)
+        layout_frame.addWidget(self.setup_filmstrip())
+        layout_frame.addWidget(self.setup_slider())
         layout_frame.addLayout(self.setup_controls())
 
         self.central_widget.setLayout(layout_frame)
@@ -1305,6 +1481,34 @@ class BufferFrame(QtGui.QMainWindow):
         self.setStatusBar(statusbar)
         return statusbar
 
+    def setup_filmstrip(self):
+        """
+        Creates the strip of thumbnails used to navigate
+
+        :return: QListWidget
+        """
+        self.filmstrip = QtGui.QListWidget()
+        self.filmstrip.setViewMode(QtGui.QListView.IconMode)
+        self.filmstrip.setFlow(QtGui.QListView.LeftToRight)
+        self.filmstrip.setWrapping(False)
+        self.filmstrip.setMovement(QtGui.QListView.Static)
+        self.filmstrip.setIconSize(QtCore.QSize(64, 64))
+        self.filmstrip.setFixedHeight(96)
+        self.filmstrip.itemClicked.connect(self.on_filmstrip_clicked)
+        return self.filmstrip
+
+    def setup_slider(self):
+        """
+        Creates the scrub slider
+
+        :return: QSlider
+        """
+        self.slider_scrub = QtGui.QSlider(QtCore.Qt.Horizontal)
+        self.slider_scrub.setMinimum(0)
+        self.slider_scrub.setMaximum(0)
+        self.slider_scrub.valueChanged.connect(self.on_slider_scrub)
+        return self.slider_scrub
+
     def setup_controls(self):
         """
         Method to gen buttons, outside of init
@@ -1313,6 +1517,9 @@ class BufferFrame(QtGui.QMainWindow):
         """
         control_splitter = QtGui.QHBoxLayout()
 
+        self.button_open = QtGui.QPushButton('Open')
+        self.button_open.clicked.connect(self.on_button_open)
+
         self.button_way_left = QtGui.QPushButton('<<')
         self.button_way_left.clicked.connect(self.on_button_way_left)
 
@@ -1321,7 +1528,7 @@ class BufferFrame(QtGui.QMainWindow):
 
         self.label_current_index = QtGui.QLabel('{} / {}'.format('00', '00'))
         self.label_current_index.setAlignment(QtCore.Qt.AlignCenter)
-        self.label_current_index.setFixedWidth(60)
+        self.label_current_index.setFixedWidth(100)
 
         self.button_right = QtGui.QPushButton('>')
         self.button_right.clicked.connect(self.on_button_right)
@@ -1329,11 +1536,24 @@ class BufferFrame(QtGui.QMainWindow):
         self.button_way_right = QtGui.QPushButton('>>')
         self.button_way_right.clicked.connect(self.on_button_way_right)
 
+        self.button_play = QtGui.QPushButton('Play')
+        self.button_play.setCheckable(True)
+        self.button_play.clicked.connect(self.on_button_play)
+
+        self.spinbox_speed = QtGui.QDoubleSpinBox()
+        self.spinbox_speed.setRange(0.1, 32)
+        self.spinbox_speed.setSingleStep(0.5)
+        self.spinbox_speed.setValue(1)
+        self.spinbox_speed.setSuffix(' x')
+
+        control_splitter.addWidget(self.button_open)
         control_splitter.addWidget(self.button_way_left)
         control_splitter.addWidget(self.button_left)
         control_splitter.addWidget(self.label_current_index)
         control_splitter.addWidget(self.button_right)
         control_splitter.addWidget(self.button_way_right)
+        control_splitter.addWidget(self.button_play)
+        control_splitter.addWidget(self.spinbox_speed)
 
         control_splitter.setAlignment(QtCore.Qt.AlignHCenter)
         return control_splitter
@@ -1344,113 +1564,343 @@ class BufferFrame(QtGui.QMainWindow):
 
         :param event:
         """
+        self.stop_playing()
         self.hide()
 
-    def update_buffer_param(self, img_array, size, shape, bins, step):
+    def set_source(self, source, name='Buffer Viewer'):
         """
-        Updates the parameters for viewing the buffer
-        :param img_array:
-        :param size:
-        :param shape:
-        :param bins:
-        :param step:
-        :return:
+        Shows frames from a new source.
+
+        :param source: anything indexable by frame number with a length, e.g. a recording or an (N, height, width) array
+        :param name: window title
         """
-        self.img_array = img_array
-        self.size = size
-        self.shape = shape
-        self.bins = bins
-        self.step = step
+        self.stop_playing()
+        if self.cache is not None:
+            self.cache.close()
+
+        self.source = source
+        self.size = len(source)
+        self.cache = FrameCache(source)
+        self.setWindowTitle(name)
 
-        first_im = -1
-        im1 = None
-        while im1 is None:
-            first_im += 1
-            im1 = self.get_im_from_buffer(first_im)
+        # play back at the recorded frame rate when it is known
+        self.play_fps = 30.
+        timestamps = getattr(source, 'timestamps', None)
+        if timestamps is not None and len(timestamps) > 1:
+            interval = np.median(np.diff(timestamps[:1000]))
+            if interval > 0:
+                self.play_fps = min(interval**-1, 100.)
 
-        self.current_index = first_im
-        self.label_current_index.setText('{} / {}'.format(self.current_index+1, self.size))
+        self.slider_scrub.setMaximum(max(self.size - 1, 0))
+        self.current_index = None
+        if self.size:
+            self.seek(0, auto_levels=True)
 
-        self.viewer.setImage(im1)
+        self.start_filmstrip()
 
-    def get_im_from_buffer(self, im_number):
+    def start_filmstrip(self):
+        """
+        Starts making thumbnails of the source, reusing any already made for it.
         """
-        Gets the selected image from the buffer.
+        if self.thumbnails is not None and self.thumbnails not in self.thumbnail_cache.values():
+            self.thumbnails.stop()
+        self.filmstrip.clear()
 
-        :param im_number:
-        :return:
+        self.thumbnails = None
+        if not self.size:
+            return
+
+        key = getattr(self.source, 'path', None)
+        self.thumbnails = self.thumbnail_cache.get(key)
+        if self.thumbnails is None:
+            self.thumbnails = ThumbnailBuilder(self.source)
+            self.thumbnails.start()
+            if key is not None:
+                self.thumbnail_cache[key] = self.thumbnails
+
+        self.filmstrip_timer.start(200)
+
+    def update_filmstrip(self):
+        """
+        Adds thumbnails to the filmstrip as they are made.
         """
-        if im_number < 0 or im_number >= self.size:
-            raise AssertionError('Cannot seek out of buffer bounds.')
+        if self.thumbnails is None:
+            self.filmstrip_timer.stop()
+            return
 
-        im = self.img_array[self.step*im_number:self.step*(im_number+1)]
-        im.shape = np.array(self.shape) // self.bins
+        thumbnails = self.thumbnails.thumbnails
+        for i in range(self.filmstrip.count(), len(thumbnails)):
+            item = QtGui.QListWidgetItem(self.thumbnail_icon(thumbnails[i]), str(self.thumbnails.frames[i] + 1))
+            self.filmstrip.addItem(item)
 
-        # sometimes data comes back empty
-        if im.min() == 0 and im.min() == 0:
-            im = None
+        if self.filmstrip.count() == len(self.thumbnails.frames):
+            self.filmstrip_timer.stop()
 
-        return im
+    @staticmethod
+    def thumbnail_icon(thumb):
+        """
+        Makes an icon of a thumbnail, oriented as in the image viewer.
 
-    def on_button_left(self):
+        :param thumb: 2D thumbnail
+        :return: QIcon
         """
-        Seeks left
+        thumb = thumb.T.astype(np.float32)
+        lo, hi = thumb.min(), thumb.max()
+        gray = ((thumb - lo) * (255. / max(hi - lo, 1))).astype(np.uint32)
+        rgb = np.ascontiguousarray((255 << 24) | (gray << 16) | (gray << 8) | gray)
+        h, w = rgb.shape
+        image = QtGui.QImage(rgb.data, w, h, 4 * w, QtGui.QImage.Format_RGB32)
+        return QtGui.QIcon(QtGui.QPixmap.fromImage(image))
+
+    def on_filmstrip_clicked(self, item):
         """
-        try:
-            im = self.get_im_from_buffer(self.current_index - 1)
-        except AssertionError:
+        Seeks to the frame of the clicked thumbnail
+        """
+        self.seek(self.thumbnails.frames[self.filmstrip.row(item)])
+
+    def update_buffer_param(self, img_array):
+        """
+        Updates the parameters for viewing the buffer
+        :param img_array: (N, height, width) array of buffer images
+        :return:
+        """
+        self.set_source(img_array)
+
+    def seek(self, index, step=1, auto_levels=False):
+        """
+        Shows the selected frame.
+
+        :param index: frame number, clipped to the source
+        :param step: spacing of the frames expected next, for reading ahead
+        :param auto_levels: whether to rescale the display levels to this frame
+        """
+        if not self.size:
             return
+        index = int(np.clip(index, 0, self.size - 1))
+        im = self.cache.get(index, step)
 
-        self.current_index -= 1
+        self.current_index = index
         self.label_current_index.setText('{} / {}'.format(self.current_index + 1, self.size))
+        self.slider_scrub.blockSignals(True)
+        self.slider_scrub.setValue(index)
+        self.slider_scrub.blockSignals(False)
 
-        if im is not None:
-            self.viewer.setImage(im)
+        self.viewer.setImage(im, autoLevels=auto_levels, autoRange=auto_levels, autoHistogramRange=auto_levels)
 
-    def on_button_right(self):
+    def on_button_open(self):
         """
-        Seeks right
+        Opens a recording to view.
         """
+        filename = str(QtGui.QFileDialog.getOpenFileName(self, 'Open recording', './',
+                                                         filter='Recordings (*.raw *.zraw)'))
+        if not filename:
+            return
+
         try:
-            im = self.get_im_from_buffer(self.current_index + 1)
-        except AssertionError:
+            recording = open_recording(filename)
+        except (IOError, ValueError, RecordingError) as e:
+            gui_logger.error('Could not open recording: {}'.format(e))
             return
 
-        self.current_index += 1
-        self.label_current_index.setText('{} / {}'.format(self.current_index + 1, self.size))
+        self.set_source(recording, Path(filename).name)
+        gui_logger.info('Opened recording of {} frames:\n\t\t{}'.format(len(recording), filename))
+
+    def on_slider_scrub(self, value):
+        """
+        Seeks to the slider position
+        """
+        self.seek(value)
 
-        if im is not None:
-            self.viewer.setImage(im)
+    def on_button_left(self):
+        """
+        Seeks left
+        """
+        if self.current_index is not None:
+            self.seek(self.current_index - 1, step=-1)
+
+    def on_button_right(self):
+        """
+        Seeks right
+        """
+        if self.current_index is not None:
+            self.seek(self.current_index + 1)
 
     def on_button_way_left(self):
         """
         Seeks to start
         """
-        try:
-            im = self.get_im_from_buffer(0)
-        except AssertionError:
+        self.seek(0)
+
+    def on_button_way_right(self):
+        """
+        Seeks to end
+        """
+        self.seek(self.size - 1, step=-1)
+
+    def on_button_play(self):
+        """
+        Starts or stops playback
+        """
+        if self.button_play.isChecked() and self.size:
+            if self.current_index is None or self.current_index >= self.size - 1:
+                self.seek(0)
+            self.play_position = self.current_index
+            self.play_timer.start(int(1000 / self.play_fps))
+            self.button_play.setText('Pause')
+        else:
+            self.stop_playing()
+
+    def on_play_timer(self):
+        """
+        Advances playback by the selected speed
+        """
+        speed = self.spinbox_speed.value()
+        self.play_position += speed
+        if self.play_position > self.size - 1:
+            self.seek(self.size - 1)
+            self.stop_playing()
             return
 
-        self.current_index = 0
-        self.label_current_index.setText('{} / {}'.format(self.current_index + 1, self.size))
+        self.seek(self.play_position, step=max(1, int(round(speed))))
 
-        if im is not None:
-            self.viewer.setImage(im)
+    def stop_playing(self):
+        """
+        Stops playback
+        """
+        self.play_timer.stop()
+        self.button_play.setChecked(False)
+        self.button_play.setText('Play')
 
-    def on_button_way_right(self):
+
+class DiagnosticsFrame(QtGui.QMainWindow):
+    """
+    Shows latency histograms for each stage of the acquisition and display path.
+
+    Timings are recorded all the time (see pyandor.andor.latency); this window only displays them, refreshing once a
+    second while it is open.
+    """
+    columns = ('count', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms')
+
+    def __init__(self, parent=None):
         """
-        Seeks to end
+        init
         """
-        try:
-            im = self.get_im_from_buffer(self.size-1)
-        except AssertionError:
+        super(DiagnosticsFrame, self).__init__(parent)
+
+        self.setGeometry(150, 150, 600, 450)
+        self.setWindowTitle('Diagnostics')
+        self.central_widget = QtGui.QWidget()
+        self.selected = None
+
+        self.table = QtGui.QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels(['Count', 'Mean (ms)', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)', 'Max (ms)'])
+        self.table.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
+        self.table.itemSelectionChanged.connect(self.on_table_selection)
+
+        # histogram of the selected stage, on a log time axis
+        self.plot = pg.PlotWidget(labels={'bottom': 'log10(latency / ms)', 'left': 'frames'})
+        self.bars = None
+
+        self.label_counters = QtGui.QLabel('Not connected')
+
+        self.button_reset = QtGui.QPushButton('Reset')
+        self.button_reset.clicked.connect(self.on_button_reset)
+
+        layout_frame = QtGui.QVBoxLayout()
+        layout_frame.addWidget(self.label_counters)
+        layout_frame.addWidget(self.table)
+        layout_frame.addWidget(self.plot)
+        layout_frame.addWidget(self.button_reset)
+
+        self.central_widget.setLayout(layout_frame)
+        self.setCentralWidget(self.central_widget)
+
+        self.refresh_timer = QtCore.QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        """
+        Starts refreshing when shown.
+
+        :param event:
+        """
+        self.refresh()
+        self.refresh_timer.start(1000)
+        super(DiagnosticsFrame, self).showEvent(event)
+
+    def closeEvent(self, event):
+        """
+        Stops refreshing and hides the window.
+
+        :param event:
+        """
+        self.refresh_timer.stop()
+        self.hide()
+
+    def refresh(self):
+        """
+        Updates the frame counts, the table and the histogram plot from the latest timings.
+        """
+        main_widget = self.parent().main_widget
+        if main_widget.connected:
+            counts = main_widget.cam.counters.snapshot()
+            self.label_counters.setText('Frames acquired: {acquired}, delivered: {delivered}, displayed: {displayed}, '
+                                        'recorded: {recorded}, dropped: {dropped} in {gaps} gaps, pending: {pending}'.format(**counts))
+
+        snapshot = timings.snapshot()
+        names = list(snapshot)
+
+        self.table.blockSignals(True)
+        self.table.setRowCount(len(names))
+        self.table.setVerticalHeaderLabels(names)
+        for row, name in enumerate(names):
+            for col, key in enumerate(self.columns):
+                value = snapshot[name][key]
+                text = str(value) if key == 'count' else '{:.3f}'.format(value)
+                self.table.setItem(row, col, QtGui.QTableWidgetItem(text))
+        if self.selected in names:
+            self.table.selectRow(names.index(self.selected))
+        self.table.blockSignals(False)
+
+        self.update_plot()
+
+    def update_plot(self):
+        """
+        Plots the histogram of the selected stage.
+        """
+        if self.bars is not None:
+            self.plot.removeItem(self.bars)
+            self.bars = None
+        if self.selected is None:
             return
 
-        self.current_index = self.size-1
-        self.label_current_index.setText('{} / {}'.format(self.current_index + 1, self.size))
+        hist = timings.histogram(self.selected)
+        edges = np.array(hist.edges() + [2 * hist.edges()[-1]]) * 1e3
+        edges[0] = edges[1] / 2
+        x = np.log10(edges)
+        self.bars = pg.BarGraphItem(x0=x[:-1], x1=x[1:], height=hist.counts, brush='b')
+        self.plot.addItem(self.bars)
+        self.plot.setTitle(self.selected)
 
-        if im is not None:
-            self.viewer.setImage(im)
+    def on_table_selection(self):
+        """
+        Shows the histogram of the stage selected in the table.
+        """
+        rows = self.table.selectionModel().selectedRows()
+        if rows:
+            self.selected = str(self.table.verticalHeaderItem(rows[0].row()).text())
+        self.update_plot()
+
+    def on_button_reset(self):
+        """
+        Clears all recorded timings and frame counts.
+        """
+        timings.reset()
+        main_widget = self.parent().main_widget
+        if main_widget.connected:
+            main_widget.cam.counters.reset()
+        self.refresh()
 
 
 def main():
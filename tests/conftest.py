@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyandor.andor import AndorCamera  # noqa: E402
+from pyandor.andor.simulated import SimulatedAndorSDK, VirtualClock  # noqa: E402
+
+
+@pytest.fixture
+def clock():
+    return VirtualClock()
+
+
+@pytest.fixture
+def camera(clock):
+    """Simulated 32x32 camera on a virtual clock, whose circular buffer
+    holds 8 frames. Each frame's first pixel is its image index.
+
+    """
+    sdk = SimulatedAndorSDK(detector=(32, 32), buffer_frames=8,
+                            clock=clock.time, sleep=clock.sleep)
+    cam = AndorCamera(clib=sdk, bit_depth=16, wait_for_temp=False)
+    cam.set_trigger_mode('internal')
+    yield cam
+    cam.close()
@@ -0,0 +1,16 @@
+"""Tests for the benchmark helpers."""
+
+from pyandor import benchmark
+
+
+def test_call_paths_time_both_paths():
+    cam = benchmark.make_camera(marshal=True)
+    try:
+        paths = benchmark.measure_call_paths(cam, n=10)
+    finally:
+        cam.close()
+    assert sorted(paths) == sorted(benchmark.CALL_PATHS)
+    for times in paths.values():
+        assert times['untyped'] > 0
+        assert times['prototype'] > 0
+    assert 'untyped' in benchmark.format_call_paths(paths)
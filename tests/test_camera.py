@@ -0,0 +1,49 @@
+"""Tests for the camera classes, run against the simulated SDK."""
+
+import numpy as np
+import pytest
+
+from pyandor.andor import AndorCamera
+from pyandor.andor.simulated import SimulatedAndorSDK
+
+
+@pytest.fixture
+def recording_camera(clock, tmp_path):
+    sdk = SimulatedAndorSDK(detector=(32, 32), buffer_frames=64,
+                            clock=clock.time, sleep=clock.sleep)
+    cam = AndorCamera(clib=sdk, bit_depth=16, wait_for_temp=False,
+                      recording=True, buffer_dir=str(tmp_path),
+                      buffer_frames=16)
+    cam.set_trigger_mode('internal')
+    yield cam
+    cam.rbuffer.close()
+    cam.close()
+
+
+def test_get_image_saves_to_ring_buffer(recording_camera):
+    cam = recording_camera
+    cam.start()
+    frame = np.array(cam.get_image())
+    cam.stop()
+    assert cam.rbuffer.count == 1
+    assert np.array_equal(cam.rbuffer.read(1)[0], frame)
+
+
+def test_drain_images_saves_to_ring_buffer(recording_camera, clock):
+    cam = recording_camera
+    cam.burst_size = 4
+    cam.start()
+    while cam.get_total_images_acquired() < 6:
+        clock.sleep(0.001)
+    drained = []
+    while True:
+        images, first = cam.drain_images()
+        if images is None:
+            break
+        drained.extend(np.array(img) for img in images)
+    cam.stop()
+
+    assert len(drained) >= 6
+    assert cam.rbuffer.count == len(drained)
+    for n, frame in enumerate(drained, 1):
+        assert np.array_equal(cam.rbuffer.read(n)[0], frame)
@@ -0,0 +1,108 @@
+"""Tests for the shared-memory frame ring and camera process."""
+
+import os
+import subprocess
+import sys
+import textwrap
+
+import numpy as np
+import pytest
+
+from pyandor.andor import camprocess
+from pyandor.andor.camprocess import SharedFrameRing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+pytestmark = pytest.mark.skipif(camprocess.shared_memory is None,
+                                reason='needs multiprocessing.shared_memory')
+
+
+def run_script(source):
+    """Run source in a fresh interpreter and return its stderr, which
+    includes anything the resource tracker reports.
+
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run([sys.executable, '-c', textwrap.dedent(source)],
+                            env=env, stderr=subprocess.PIPE, timeout=60)
+    assert result.returncode == 0, result.stderr.decode()
+    return result.stderr.decode()
+
+
+def test_write_and_read():
+    ring = SharedFrameRing(shape=(4, 6), dtype=np.uint16, slots=2)
+    try:
+        frame = np.arange(12, dtype=np.uint16).reshape(3, 4)
+        seq = ring.write(frame, index=7)
+        out, info = ring.read(seq)
+        assert np.array_equal(out, frame)
+        assert info['index'] == 7
+        ring.write(frame)
+        ring.write(frame)
+        assert not ring.valid(seq)
+    finally:
+        ring.close()
+
+
+def test_write_refuses_wrapping_cast():
+    ring = SharedFrameRing(shape=(2, 2), dtype=np.uint16, slots=2)
+    try:
+        with pytest.raises(TypeError):
+            ring.write(np.zeros((2, 2), np.float64))
+    finally:
+        ring.close()
+
+
+def test_attach_in_creating_process_is_quiet():
+    stderr = run_script("""
+        import time
+        from pyandor.andor.camprocess import SharedFrameRing
+        ring = SharedFrameRing(shape=(4, 4), slots=2)
+        reader = SharedFrameRing.attach(ring.name)
+        reader.close()
+        ring.close()
+        time.sleep(1)
+        """)
+    assert stderr == ''
+
+
+def test_ring_survives_unrelated_reader():
+    ring = SharedFrameRing(shape=(2, 2), dtype=np.uint16, slots=2)
+    try:
+        seq = ring.write(np.full((2, 2), 5, np.uint16))
+        stderr = run_script("""
+            from pyandor.andor.camprocess import SharedFrameRing
+            reader = SharedFrameRing.attach(%r)
+            assert reader.read(%i)[0].sum() == 20
+            reader.close()
+            """ % (ring.name, seq))
+        assert stderr == ''
+        assert ring.read(seq)[0].sum() == 20
+    finally:
+        ring.close()
+
+
+def test_camera_process_is_quiet():
+    stderr = run_script("""
+        from pyandor.andor import AndorCamera
+        from pyandor.andor.camprocess import CameraProcess, SharedFrameRing
+        from pyandor.andor.log import logger
+        from pyandor.andor.simulated import SimulatedAndorSDK
+
+        def factory():
+            logger.setLevel('ERROR')
+            return AndorCamera(clib=SimulatedAndorSDK(detector=(32, 32)),
+                               bit_depth=16, wait_for_temp=False)
+
+        if __name__ == '__main__':
+            logger.setLevel('ERROR')
+            proc = CameraProcess(factory, slots=4)
+            proc.set_trigger_mode('internal')
+            proc.unpause()
+            reader = SharedFrameRing.attach(proc.ring.name)
+            assert reader.wait(timeout=5) is not None
+            proc.pause()
+            reader.close()
+            proc.stop()
+        """)
+    assert stderr == ''
@@ -0,0 +1,76 @@
+"""Tests for frame accounting."""
+
+from pyandor.andor import AndorCamera
+from pyandor.andor.counters import FrameCounters, image_index
+from pyandor.andor.simulated import SimulatedAndorSDK
+
+
+class LateFrames(object):
+    """Wraps a simulated SDK so that a new image is acquired just after
+    each image is read out.
+
+    """
+    def __init__(self, sdk, clock):
+        self.sdk, self.clock = sdk, clock
+        self.cycle = 0.
+
+    def __getattr__(self, name):
+        func = getattr(self.sdk, name)
+        if not name.startswith(('GetImages', 'GetMostRecentImage')):
+            return func
+
+        def read(*args):
+            status = func(*args)
+            self.clock.sleep(self.cycle)
+            return status
+        return read
+
+
+def test_deliver_counts_gaps():
+    counters = FrameCounters()
+    counters.deliver(1, 3)
+    counters.deliver(6, 2)
+    counts = counters.snapshot()
+    assert counts['delivered'] == 5
+    assert counts['dropped'] == 2
+    assert counts['gaps'] == 1
+    assert counters.last_index == 7
+
+
+def test_get_image_is_tagged_with_its_own_index(clock):
+    sdk = LateFrames(SimulatedAndorSDK(detector=(32, 32), clock=clock.time,
+                                       sleep=clock.sleep), clock)
+    camera = AndorCamera(clib=sdk, bit_depth=16, wait_for_temp=False)
+    camera.set_trigger_mode('internal')
+    sdk.cycle = camera.get_exposure_time()[2]
+    camera.start()
+    for _ in range(5):
+        frame = camera.get_image()
+        # The simulator stamps each image's index into its first pixel.
+        assert image_index(frame) == frame.flat[0]
+    camera.stop()
+    camera.close()
+    counts = camera.counters.snapshot()
+    assert counts['delivered'] == 5
+    assert counts['dropped'] == 0
+
+
+def test_drain_counts_only_returned_images(camera, clock):
+    camera.burst_size = 3
+    camera.start()
+    while camera.get_total_images_acquired() < 7:
+        clock.sleep(0.001)
+    total = camera.get_total_images_acquired()
+
+    images, first = camera.drain_images()
+    assert (first, len(images)) == (1, 3)
+    counts = camera.counters.snapshot()
+    assert counts['acquired'] == counts['delivered'] == 3
+    assert counts['pending'] == total - 3
+
+    while camera.counters.pending:
+        camera.drain_images()
+    camera.stop()
+    counts = camera.counters.snapshot()
+    assert counts['acquired'] == counts['delivered'] == total
+    assert counts['dropped'] == 0
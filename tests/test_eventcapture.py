@@ -0,0 +1,95 @@
+"""Tests for pre-trigger event capture."""
+
+import os
+
+import numpy as np
+
+from pyandor.andor import AndorCamera
+from pyandor.andor.eventcapture import EventCapture
+from pyandor.andor.simulated import SimulatedAndorSDK, VirtualClock
+
+
+def frame(i):
+    return np.full((4, 4), i, np.uint16)
+
+
+def load(path):
+    return np.load(path), np.load(path[:-len('.npy')] + '_timestamps.npy')
+
+
+def test_event_holds_history_and_post_frames(tmp_path):
+    capture = EventCapture((4, 4), np.uint16, fps=1., pre_seconds=3,
+                           post_seconds=2, directory=str(tmp_path))
+    for i in range(5):
+        capture.add(frame(i), timestamp=i)
+    path = capture.trigger('a')
+    for i in range(5, 8):
+        capture.add(frame(i), timestamp=i)
+    capture.close()
+
+    frames, times = load(path)
+    assert list(frames[:, 0, 0]) == [2, 3, 4, 5, 6]
+    assert list(times) == [2, 3, 4, 5, 6]
+    assert capture.saved == [path]
+
+
+def test_history_carries_on_across_events(tmp_path):
+    capture = EventCapture((4, 4), np.uint16, fps=1., pre_seconds=3,
+                           post_seconds=2, directory=str(tmp_path))
+    for i in range(4):
+        capture.add(frame(i))
+    first = capture.trigger('a')
+    for i in range(4, 6):
+        capture.add(frame(i))
+    capture.close()
+    second = capture.trigger('b')
+    capture.add(frame(6))
+    capture.close()
+
+    assert list(load(first)[0][:, 0, 0]) == [1, 2, 3, 4, 5]
+    assert list(load(second)[0][:, 0, 0]) == [3, 4, 5, 6]
+
+
+def test_close_finishes_capture_in_progress(tmp_path):
+    saved = []
+    capture = EventCapture((4, 4), np.uint16, fps=10., pre_seconds=0.2,
+                           post_seconds=10, directory=str(tmp_path),
+                           on_saved=saved.append)
+    capture.add(frame(0))
+    capture.add(frame(1))
+    path = capture.trigger('early')
+    capture.add(frame(2))
+    capture.close()
+
+    assert saved == [path]
+    frames, times = load(path)
+    assert list(frames[:, 0, 0]) == [0, 1, 2]
+    assert len(times) == 3
+    assert not os.path.exists(path[:-len('.npy')] + '.part.npy')
+    assert not capture.capturing
+
+
+def test_close_without_event(tmp_path):
+    capture = EventCapture((4, 4), np.uint16, fps=10.,
+                           directory=str(tmp_path))
+    capture.add(frame(0))
+    capture.close()
+    assert capture.saved == []
+
+
+def test_for_camera_uses_kinetic_cycle(tmp_path):
+    clock = VirtualClock()
+    sdk = SimulatedAndorSDK(detector=(32, 32), clock=clock.time,
+                            sleep=clock.sleep)
+    cam = AndorCamera(clib=sdk, bit_depth=16, wait_for_temp=False)
+    try:
+        cam.set_exposure_time(10.)
+        kinetic = cam.get_exposure_time()[2]
+        capture = EventCapture.for_camera(cam, pre_seconds=1.,
+                                          post_seconds=2.,
+                                          directory=str(tmp_path))
+        assert capture.pre_frames == int(np.ceil(1./kinetic))
+        assert capture.post_frames == int(np.ceil(2./kinetic))
+        assert capture.shape == (32, 32)
+    finally:
+        cam.close()
@@ -0,0 +1,128 @@
+"""Tests for reading recordings and the camera buffer."""
+
+import threading
+
+import numpy as np
+import pytest
+
+from pyandor.andor.reader import CameraBuffer, FrameCache, open_recording
+from pyandor.andor.recording import ChunkedRecorder, RawRecorder
+
+INDICES = [
+    5, -1, np.int64(3), slice(None), slice(2, 9, 3), slice(None, None, -2),
+    [1, -2, 5], [], np.arange(20) % 3 == 0, Ellipsis, (), (Ellipsis, 2),
+    (Ellipsis, slice(1, 3)), (3, Ellipsis), (slice(2, 5), Ellipsis, 1),
+    (-3, slice(2, 4)), (slice(None), 1, 2), (1, 2, 3, Ellipsis),
+]
+
+
+@pytest.fixture(scope='module')
+def recordings(tmp_path_factory):
+    """The same frames as an array and as raw and chunked recordings."""
+    directory = tmp_path_factory.mktemp('recordings')
+    data = np.arange(20*4*6, dtype=np.uint16).reshape(20, 4, 6)
+    paths = []
+    for recorder_class, name in [(RawRecorder, 'rec.raw'),
+                                 (ChunkedRecorder, 'rec.zraw')]:
+        path = str(directory / name)
+        recorder = recorder_class(path, (4, 6), np.uint16, chunk_frames=8)
+        for frame in data:
+            recorder.write(frame)
+        recorder.close()
+        paths.append(path)
+    return data, [open_recording(path) for path in paths]
+
+
+@pytest.mark.parametrize('key', INDICES, ids=repr)
+def test_recordings_index_like_arrays(recordings, key):
+    data, (raw, chunked) = recordings
+    expected = data[key]
+    assert np.array_equal(raw[key], expected)
+    assert np.array_equal(chunked[key], expected)
+    assert chunked[key].shape == expected.shape
+
+
+@pytest.mark.parametrize('key', [20, -21, [0, 20], (Ellipsis, Ellipsis),
+                                 (1, 2, 3, 4)], ids=repr)
+def test_recordings_refuse_bad_indices(recordings, key):
+    _, recs = recordings
+    for rec in recs:
+        with pytest.raises(IndexError):
+            rec[key]
+
+
+def run_until(camera, clock, n):
+    """Advance the clock until the camera has acquired n images."""
+    while camera.get_total_images_acquired() < n:
+        clock.sleep(0.01)
+
+
+def test_camera_buffer_empty(camera):
+    camera.start()
+    buf = CameraBuffer(camera)
+    camera.stop()
+    assert len(buf) == 0
+    with pytest.raises(IndexError):
+        buf[0]
+
+
+def test_camera_buffer_reads_frames(camera, clock):
+    camera.start()
+    run_until(camera, clock, 6)
+    buf = CameraBuffer(camera, page_frames=2)
+    assert len(buf) == camera.get_total_images_acquired() - 1
+    for i in range(len(buf)):
+        assert buf[i].flat[0] == buf.first + i
+        assert buf[i].flat[0] == buf.first + i
+
+
+def test_camera_buffer_blanks_overwritten_frames(camera, clock):
+    camera.start()
+    run_until(camera, clock, 10)
+    buf = CameraBuffer(camera, page_frames=4)
+    # Overwrite the oldest images in the buffer.
+    run_until(camera, clock, 13)
+
+    oldest, _ = camera.get_num_available_images()
+    assert oldest > buf.first
+    frames = [buf[i] for i in range(len(buf))]
+    for i, frame in enumerate(frames):
+        if buf.first + i < oldest:
+            assert not frame.any()
+        else:
+            assert frame.flat[0] == buf.first + i
+
+
+class FailingSource(object):
+    def __init__(self, bad):
+        self.bad = bad
+        self.read = threading.Event()
+
+    def __len__(self):
+        return 20
+
+    def __getitem__(self, i):
+        if i == self.bad:
+            self.read.set()
+            raise IOError('cannot read frame %i' % i)
+        return np.full((2, 2), i)
+
+
+def test_frame_cache_passes_back_read_ahead_errors():
+    source = FailingSource(bad=3)
+    cache = FrameCache(source, size=8, ahead=4)
+    try:
+        assert cache.get(0)[0, 0] == 0
+        assert source.read.wait(5)
+        with pytest.raises(IOError):
+            for _ in range(100):
+                cache.get(1)
+                threading.Event().wait(0.01)
+        # The thread is still reading ahead.
+        source.read.clear()
+        assert cache.get(10)[0, 0] == 10
+        cache.get(5)
+        assert cache.get(6)[0, 0] == 6
+        assert cache._thread.is_alive()
+    finally:
+        cache.close()
@@ -0,0 +1,71 @@
+"""Tests for writing recordings."""
+
+import numpy as np
+import pytest
+
+from pyandor.andor.counters import tag_frame
+from pyandor.andor.pipeline import FrameQueue
+from pyandor.andor.reader import open_recording
+from pyandor.andor.recording import ChunkedRecorder, RawRecorder, \
+    RecordingError
+
+RECORDERS = [(RawRecorder, 'rec.raw'), (ChunkedRecorder, 'rec.zraw')]
+
+
+def frames(n, shape=(4, 6), dtype=np.uint16, first=1):
+    return [tag_frame(np.full(shape, first + i, dtype), first + i)
+            for i in range(n)]
+
+
+@pytest.mark.parametrize('recorder_class, name', RECORDERS)
+def test_round_trip(tmp_path, recorder_class, name):
+    path = str(tmp_path / name)
+    recorder = recorder_class(path, (4, 6), np.uint16)
+    for i, frame in enumerate(frames(5)):
+        recorder.write(frame, timestamp=i)
+    recorder.close()
+    assert recorder.error is None
+
+    rec = open_recording(path)
+    assert rec.shape == (5, 4, 6)
+    assert list(rec[:][:, 0, 0]) == [1, 2, 3, 4, 5]
+    assert list(rec.timestamps) == [0, 1, 2, 3, 4]
+    assert list(rec.images) == [1, 2, 3, 4, 5]
+
+
+@pytest.mark.parametrize('recorder_class, name', RECORDERS)
+def test_write_refuses_mismatched_frames(tmp_path, recorder_class, name):
+    recorder = recorder_class(str(tmp_path / name), (4, 6), np.uint16)
+    try:
+        with pytest.raises(RecordingError):
+            recorder.write(np.zeros((2, 3), np.uint16))
+        with pytest.raises(RecordingError):
+            recorder.write(np.zeros((4, 6), np.int32))
+    finally:
+        recorder.close()
+
+
+@pytest.mark.parametrize('recorder_class, name', RECORDERS)
+def test_queued_mismatched_frames_are_not_written(tmp_path, recorder_class,
+                                                  name):
+    """Frames queued from a pipeline after a reconfigure are refused
+    without corrupting the frames around them.
+
+    """
+    path = str(tmp_path / name)
+    queue = FrameQueue(64)
+    recorder = recorder_class(path, (4, 6), np.uint16, queue=queue)
+    for frame in frames(2):
+        queue.put(frame)
+    queue.put(frames(1, shape=(2, 3), first=3)[0])
+    queue.put(frames(1, dtype=np.int32, first=4)[0])
+    for frame in frames(2, first=5):
+        queue.put(frame)
+    recorder.close()
+
+    assert isinstance(recorder.error, RecordingError)
+    rec = open_recording(path)
+    assert len(rec) == 4
+    assert list(rec[:][:, 0, 0]) == [1, 2, 5, 6]
+    assert (rec[:] == rec[:][:, :1, :1]).all()
+    assert list(rec.images) == [1, 2, 5, 6]